@@ -0,0 +1,119 @@
+"""
+Microbenchmark dello smistamento dei callback dei pulsanti.
+
+Confronta, sugli stessi click (stesso mix di azioni e di id):
+- regex: la vecchia catena di CallbackQueryHandler di main.py, provata in ordine di registrazione
+  fino al primo re.match, più il parsing con split("_") fatto dagli handler;
+- trie: callbacks.router senza cache (visita del trie + decodifica base64/varint);
+- trie_cached: callbacks.router.resolve, come negli handler (lo stesso callback si decodifica una volta).
+Riporta anche la lunghezza media di callback_data nei due formati (Telegram accetta max 64 byte).
+
+Uso:  python benchmarks/bench_callback_router.py [--clicks 200000] [--max-id 100000]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import callbacks  # noqa: E402
+
+# Pattern della vecchia main.py, nell'ordine in cui PTB li provava (conversazioni, poi handler globali)
+OLD_PATTERNS = [
+    '^add_cat$', '^edit_cat_list$', '^back_to_cat_menu$', '^add_cat$', '^back_to_cat_menu$',
+    '^sel_edit_cat_', '^pg_editcat_', '^back_to_cat_menu$', '^edit_cat_list$', '^(act_cat_|edit_cat_list)',
+    '^back_to_cat_panel$',
+    '^add_prod_start$', '^mod_start$', '^sel_cat_', '^pg_addcat_', '^menu_prodotti$', '^back_to_step_1$',
+    '^back_to_step_2$', '^back_to_step_3$', '^add_prod_start$', '^main_menu$',
+    '^(mod_cat_|mod_prod_|act_|back_to_prod_list|pg_prod_)', '^(mod_start$|pg_modcat_)', '^menu_prodotti$',
+    '^cancel_flow$',
+    '^main_menu$', '^menu_categorie$', '^menu_prodotti$', '^show_full_inventory$', '^show_shopping_list$',
+    '^print_shopping_list$', '^print_full_inventory$',
+]
+
+# (peso, vecchio formato, nuovo formato): i ➕/➖ sono di gran lunga i click più frequenti
+CLICKS = [
+    (30, lambda p, c: f"act_stock_plus_{p}", lambda p, c: callbacks.ADJUST_STOCK(p, 1)),
+    (10, lambda p, c: f"act_stock_minus_{p}", lambda p, c: callbacks.ADJUST_STOCK(p, -1)),
+    (5, lambda p, c: f"act_thr_plus_{p}", lambda p, c: callbacks.ADJUST_THRESHOLD(p, 1)),
+    (10, lambda p, c: f"mod_prod_{p}", lambda p, c: callbacks.OPEN_PRODUCT(p)),
+    (8, lambda p, c: f"mod_cat_{c}", lambda p, c: callbacks.OPEN_CATEGORY(c)),
+    (4, lambda p, c: f"pg_prod_n_{p}", lambda p, c: callbacks.PRODUCT_PAGE(True, p)),
+    (3, lambda p, c: f"act_move_do_{p}_{c}", lambda p, c: callbacks.MOVE_TO(p, c)),
+    (3, lambda p, c: f"sel_cat_{c}", lambda p, c: callbacks.PICK_CATEGORY(c)),
+    (2, lambda p, c: f"sel_edit_cat_{c}", lambda p, c: callbacks.EDIT_CATEGORY(c)),
+    (5, lambda p, c: "main_menu", lambda p, c: callbacks.MAIN_MENU()),
+    (5, lambda p, c: "show_shopping_list", lambda p, c: callbacks.SHOPPING_LIST()),
+    (5, lambda p, c: "show_full_inventory", lambda p, c: callbacks.FULL_INVENTORY()),
+    (5, lambda p, c: "back_to_prod_list", lambda p, c: callbacks.BACK_TO_PRODUCT_LIST()),
+]
+
+
+def make_clicks(n, max_id, seed=1):
+    rng = random.Random(seed)
+    weights = [w for w, _, _ in CLICKS]
+    old, new = [], []
+    for _, make_old, make_new in rng.choices(CLICKS, weights, k=n):
+        prod_id, cat_id = rng.randint(1, max_id), rng.randint(1, max_id // 20 or 1)
+        old.append(make_old(prod_id, cat_id))
+        new.append(make_new(prod_id, cat_id))
+    return old, new
+
+
+def regex_dispatch(patterns, data):
+    for index, pattern in enumerate(patterns):
+        if pattern.match(data):
+            # Come facevano gli handler: argomenti letti con split("_")
+            return index, data.split("_")
+    return None
+
+
+def measure(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clicks', type=int, default=200_000)
+    parser.add_argument('--max-id', type=int, default=100_000)
+    args = parser.parse_args()
+
+    old, new = make_clicks(args.clicks, args.max_id)
+    patterns = [re.compile(p) for p in OLD_PATTERNS]
+    router = callbacks.router
+
+    # Ogni azione deve essere riconosciuta, altrimenti il confronto non vale
+    assert all(router.resolve(data) is not None for data in new)
+    router.resolve.cache_clear()
+
+    timings = {
+        'regex': measure(lambda data: regex_dispatch(patterns, data), old),
+        'trie': measure(router._resolve, new),
+        'trie_cached': measure(router.resolve, new),
+    }
+    results = {
+        name: {'seconds': round(seconds, 3), 'ns_per_click': round(seconds / args.clicks * 1e9)}
+        for name, seconds in timings.items()
+    }
+    print(json.dumps({
+        'benchmark': 'callback_router',
+        'clicks': args.clicks,
+        'max_id': args.max_id,
+        'avg_bytes_old': round(sum(len(d.encode()) for d in old) / len(old), 1),
+        'avg_bytes_new': round(sum(len(d.encode()) for d in new) / len(new), 1),
+        'max_bytes_new': max(len(d.encode()) for d in new),
+        'speedup_trie': round(timings['regex'] / timings['trie'], 2),
+        'speedup_trie_cached': round(timings['regex'] / timings['trie_cached'], 2),
+        **results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
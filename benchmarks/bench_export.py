@@ -0,0 +1,105 @@
+"""
+Benchmark dell'export dell'inventario (database.export_products).
+
+Crea una chat con N prodotti e misura, con tracemalloc, il picco di memoria Python di:
+- export a blocchi (cursore letto con fetchmany + SpooledTemporaryFile), in CSV e JSON,
+- il vecchio approccio: fetchall() di tutte le righe e un unico testo in memoria.
+
+Esce con codice 1 se l'export a blocchi supera --max-peak-mb (default MAX_PEAK_MB; 0 = nessun limite):
+la memoria non deve crescere con l'inventario. Lo stesso limite è controllato da tests/test_export.py.
+
+Uso:  python benchmarks/bench_export.py [--products 100000] [--max-peak-mb 8]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+OWNER_ID = 1
+MAX_PEAK_MB = 8.0  # Qualche blocco di righe più il buffer in memoria del file (1 MiB)
+
+
+def populate(products):
+    conn = database.get_connection()
+    with conn:
+        conn.executemany("INSERT INTO categorie (owner_id, nome) VALUES (?, ?)",
+                         [(OWNER_ID, f"Categoria {c}") for c in range(50)])
+        conn.executemany('''
+            INSERT INTO prodotti (owner_id, categoria_id, nome, quantita, soglia_minima)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ((OWNER_ID, 1 + i % 50, f"Prodotto con un nome abbastanza lungo {i}", float(i % 13), float(i % 5))
+              for i in range(products)))
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def streaming(fmt):
+    out, count = database.export_products(OWNER_ID, fmt)
+    out.seek(0, os.SEEK_END)
+    size = out.tell()
+    out.close()
+    return count, size
+
+
+def fetchall_text():
+    # Come faceva la stampa dell'inventario: tutte le righe in memoria e un unico testo
+    rows = database.get_connection().execute(database.PRODUCTS_QUERY, (OWNER_ID,)).fetchall()
+    text = "".join(f"{r['nome']},{r['quantita']},{r['soglia_minima']},{r['nome_categoria']}\n" for r in rows)
+    return len(rows), len(text.encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=100_000)
+    parser.add_argument('--max-peak-mb', type=float, default=MAX_PEAK_MB)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.init_db()
+        try:
+            populate(args.products)
+            results = {}
+            for name, fn in (('stream_csv', lambda: streaming('csv')),
+                             ('stream_json', lambda: streaming('json')),
+                             ('fetchall', fetchall_text)):
+                (rows, size), elapsed, peak = measure(fn)
+                results[name] = {
+                    'rows': rows,
+                    'file_mb': round(size / 2 ** 20, 2),
+                    'seconds': round(elapsed, 3),
+                    'peak_mb': round(peak / 2 ** 20, 2),
+                }
+        finally:
+            database.close_connections()
+
+    peak = max(results['stream_csv']['peak_mb'], results['stream_json']['peak_mb'])
+    ok = not args.max_peak_mb or peak <= args.max_peak_mb
+    print(json.dumps({
+        'benchmark': 'inventory_export',
+        'products': args.products,
+        'max_peak_mb': args.max_peak_mb,
+        'within_limit': ok,
+        **results,
+    }, indent=2))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark del salvataggio della persistenza (persistence.SQLitePersistence).
+
+Simula N chat attive con una conversazione a metà e il loro user_data, come
+le passerebbe l'Application ad ogni intervallo, e misura:
+- flush a blocchi: tutte le modifiche scritte in una sola transazione,
+- scrittura per update: una transazione per chat (il comportamento da evitare),
+- caricamento pigro di una singola chat al riavvio.
+
+Uso:  python benchmarks/bench_persistence.py [--chats 5000] [--rounds 3]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+import repository  # noqa: E402
+from persistence import SQLitePersistence  # noqa: E402
+
+
+def fake_user_data(i):
+    return {'temp_cat_id': str(i % 40), 'temp_nome': f"Prodotto {i}", 'temp_qty': float(i % 9),
+            'current_mod_cat_id': i % 40}
+
+
+async def run(chats, rounds):
+    persistence = SQLitePersistence()
+
+    async def one_round(offset):
+        for i in range(chats):
+            chat_id = 10_000 + i
+            await persistence.update_conversation('conv_prodotti', (chat_id, chat_id), 12)
+            await persistence.update_user_data(chat_id, fake_user_data(i + offset))
+        start = time.perf_counter()
+        await persistence.flush()
+        return time.perf_counter() - start
+
+    batched = [await one_round(r) for r in range(rounds)]
+
+    start = time.perf_counter()
+    for i in range(chats):
+        chat_id = 10_000 + i
+        await repository.save_bot_state([('conv_prodotti', (chat_id, chat_id), 13)], {chat_id: fake_user_data(i)})
+    per_update = time.perf_counter() - start
+
+    # Riavvio: si caricano solo gli stati delle conversazioni, poi i dati della chat che scrive
+    restarted = SQLitePersistence()
+    start = time.perf_counter()
+    conversations = await restarted.get_conversations('conv_prodotti')
+    load_conversations = time.perf_counter() - start
+    user_data = {}
+    start = time.perf_counter()
+    await restarted.refresh_user_data(10_000, user_data)
+    lazy_load = time.perf_counter() - start
+
+    return {
+        'benchmark': 'persistence_flush',
+        'chats': chats,
+        'batched_flush_ms': [round(t * 1000, 2) for t in batched],
+        'per_update_commits_ms': round(per_update * 1000, 2),
+        'speedup': round(per_update / min(batched), 1),
+        'startup_load_conversations_ms': round(load_conversations * 1000, 2),
+        'conversations_loaded': len(conversations),
+        'lazy_load_one_chat_ms': round(lazy_load * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.init_db()
+        try:
+            result = asyncio.run(run(args.chats, args.rounds))
+        finally:
+            repository.shutdown()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark del rendering dell'inventario a blocchi.
+
+Genera N prodotti finti (default 10.000) divisi in categorie e misura:
+- il tempo per produrre tutti i messaggi con utils.iter_inventory_chunks,
+- il tempo per il solo primo messaggio (quello mostrato nella schermata),
+- numero e lunghezza massima dei messaggi (devono stare sotto il limite di Telegram).
+
+Uso:  python benchmarks/bench_render.py [--products 10000] [--categories 40] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils  # noqa: E402
+
+
+def fake_products(n_products, n_categories):
+    products = []
+    for i in range(n_products):
+        cat = i % n_categories
+        products.append({
+            'id': i + 1,
+            'nome': f"Prodotto {i:05d}",
+            'nome_categoria': f"Categoria {cat:03d}" if cat else None,
+            'quantita': float(i % 7),
+            'soglia_minima': float(i % 3),
+        })
+    # Stesso ordine di database.get_products (categoria, nome)
+    products.sort(key=lambda p: (p['nome_categoria'] is not None, p['nome_categoria'] or "", p['nome']))
+    return products
+
+
+def best_of(repeat, func):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=10_000)
+    parser.add_argument('--categories', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    products = fake_products(args.products, args.categories)
+
+    all_time, chunks = best_of(args.repeat, lambda: list(utils.iter_inventory_chunks(products)))
+    first_time, _ = best_of(args.repeat, lambda: next(utils.iter_inventory_chunks(products)))
+
+    print(json.dumps({
+        'benchmark': 'render_inventory',
+        'products': args.products,
+        'categories': args.categories,
+        'chunks': len(chunks),
+        'max_chunk_len': max(utils.tg_len(c) for c in chunks),
+        'limit': utils.MAX_MESSAGE_LENGTH,
+        'all_chunks_ms': round(all_time * 1000, 3),
+        'first_chunk_ms': round(first_time * 1000, 3),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
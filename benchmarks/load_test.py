@@ -0,0 +1,290 @@
+"""
+Test di carico offline: la vera Application di main.py (build_application) pilotata con
+Update finti, senza rete e su un database temporaneo.
+
+Il layer HTTP del bot è sostituito da StubRequest, che registra ogni chiamata a Telegram
+e risponde subito con un risultato plausibile. Ogni chat simulata ha M prodotti e percorre:
+- aggiunta di un prodotto (conversazione completa, 5 passi),
+- apertura del pannello di un prodotto e una raffica di tocchi ➕/➖ sullo stock,
+- inventario completo e lista della spesa (prima e dopo le modifiche).
+Gli update arrivano come da getUpdates, le chat mescolate (il passo 1 di ogni chat, poi il
+passo 2, ...), e passano dal processore di update dell'Application come in produzione:
+con --concurrency N si servono N chat in parallelo, con 1 si torna a un update alla volta.
+--latency aggiunge un ritardo ad ogni chiamata a Telegram (la rete vera non risponde in 0 ms).
+--burst invece manda tutti i passi di una chat di seguito (utenti che cliccano a raffica):
+gli update della stessa chat si accodano e devono comunque essere eseguiti in ordine.
+
+Stampa un JSON con throughput e latenza p50/p95/p99 per handler (dall'arrivo dell'update alla
+fine), chiamate API per metodo ed eventuali errori, così due esecuzioni si possono confrontare.
+ordered_chats conta le chat arrivate allo stato atteso (prodotto aggiunto e stock finale
+giusto), che richiede che i passi di ogni chat siano stati eseguiti in ordine.
+
+Uso:  python benchmarks/load_test.py [--chats 200] [--products 100] [--taps 5]
+                                     [--concurrency 16] [--latency 0.05] [--burst]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:LOADTEST")
+
+from telegram import Update  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+from telegram.warnings import PTBUserWarning  # noqa: E402
+
+import callbacks  # noqa: E402
+import database  # noqa: E402
+import edits  # noqa: E402
+import main  # noqa: E402
+from handlers import products  # noqa: E402
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'HomeStock', 'username': 'homestock_bot'}
+
+
+class StubRequest(BaseRequest):
+    """Finto layer HTTP: niente rete, ogni chiamata viene contata e riceve una risposta valida"""
+
+    def __init__(self, latency=0.0):
+        self.calls = Counter()
+        self.latency = latency
+        self._message_ids = itertools.count(1_000_000)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint in ('sendMessage', 'editMessageText', 'sendDocument'):
+            result = {
+                'message_id': params.get('message_id') or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': params.get('chat_id', 0), 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class Chat:
+    """Costruisce gli Update di una chat simulata (utente privato: chat_id = user_id)"""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, chat_id, bot):
+        self.chat_id = chat_id
+        self.bot = bot
+        self.user = {'id': chat_id, 'is_bot': False, 'first_name': f"Utente {chat_id}"}
+        self.chat = {'id': chat_id, 'type': 'private'}
+        self._message_ids = itertools.count(1)
+        # I pulsanti stanno sull'ultimo messaggio del bot, che gli handler modificano sul posto;
+        # ogni messaggio dell'utente riceve invece una risposta nuova
+        self._menu = self._message("menu", BOT_USER)
+
+    def _message(self, text, from_user):
+        return {'message_id': next(self._message_ids), 'date': int(time.time()), 'chat': self.chat,
+                'from': from_user, 'text': text}
+
+    def text(self, text):
+        message = self._message(text, self.user)
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        self._menu = self._message("menu", BOT_USER)
+        return Update.de_json({'update_id': next(self._update_ids), 'message': message}, self.bot)
+
+    def callback(self, data):
+        query = {'id': str(next(self._update_ids)), 'from': self.user, 'chat_instance': str(self.chat_id),
+                 'data': data, 'message': self._menu}
+        return Update.de_json({'update_id': next(self._update_ids), 'callback_query': query}, self.bot)
+
+
+def flow(cat_id, prod_id, taps):
+    """Passi di una chat: (nome handler, tipo, contenuto)"""
+    steps = [
+        ('show_full_inventory', 'callback', callbacks.FULL_INVENTORY()),
+        ('show_shopping_list', 'callback', callbacks.SHOPPING_LIST()),
+        # Aggiunta prodotto
+        ('step_1_ask_category', 'callback', callbacks.ADD_PRODUCT()),
+        ('step_2_ask_name', 'callback', callbacks.PICK_CATEGORY(cat_id)),
+        ('step_3_ask_qty', 'text', 'Prodotto di prova'),
+        ('step_4_ask_threshold', 'text', '3'),
+        ('step_5_save_final', 'text', '1'),
+        # Pannello e tocchi sullo stock
+        ('start_modify_flow', 'callback', callbacks.MODIFY_START()),
+        ('open_category', 'callback', callbacks.OPEN_CATEGORY(cat_id)),
+        ('open_product', 'callback', callbacks.OPEN_PRODUCT(prod_id)),
+    ]
+    steps += [('tap_adjust', 'callback', callbacks.ADJUST_STOCK(prod_id, 1))] * taps
+    steps += [('tap_adjust', 'callback', callbacks.ADJUST_STOCK(prod_id, -1))]
+    steps += [
+        ('show_full_inventory', 'callback', callbacks.FULL_INVENTORY()),
+        ('show_shopping_list', 'callback', callbacks.SHOPPING_LIST()),
+    ]
+    return steps
+
+
+def populate(chats, products_per_chat):
+    """Inventari iniziali: M prodotti per chat, 10 per categoria, circa 1 su 4 in esaurimento"""
+    targets = {}
+    for chat_id in chats:
+        items = [(f"Prodotto {i:04d}", float(i % 4), 1.0, f"Categoria {i // 10:03d}")
+                 for i in range(products_per_chat)]
+        database.import_products(chat_id, items)
+        prod = database.get_products(chat_id)[0]
+        targets[chat_id] = (prod['categoria_id'], prod['id'], prod['quantita'])
+    return targets
+
+
+def check_order(targets, taps):
+    """Chat in cui tutti i passi hanno avuto effetto, nell'ordine giusto"""
+    ok = 0
+    for chat_id, (_, prod_id, quantity) in targets.items():
+        prod = database.get_product_by_id(prod_id)
+        added = any(p['nome'] == 'Prodotto di prova' for p in database.get_products(chat_id))
+        ok += added and prod['quantita'] == max(0.0, quantity + taps - 1)
+    return ok
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def arrivals(steps, burst):
+    """Ordine di arrivo degli update: (chat_id, passo)"""
+    if burst:
+        return [(chat_id, step) for chat_id, chat_steps in steps.items() for step in chat_steps]
+    return [(chat_id, step) for round_ in zip(*steps.values()) for chat_id, step in zip(steps, round_)]
+
+
+async def run(n_chats, products_per_chat, taps, concurrency=16, latency=0.0, burst=False):
+    stub = StubRequest(latency)
+    app = main.build_application(request=stub, updates_request=StubRequest(), rate_limiter=None,
+                                 concurrent_updates=concurrency)
+    errors = Counter()
+
+    async def count_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    app.error_handlers.clear()
+    app.add_error_handler(count_error)
+
+    chat_ids = list(range(10_000, 10_000 + n_chats))
+    start = time.perf_counter()
+    targets = populate(chat_ids, products_per_chat)
+    setup_seconds = time.perf_counter() - start
+
+    latencies = defaultdict(list)
+
+    async def timed(label, arrived, coroutine):
+        await coroutine
+        latencies[label].append(time.perf_counter() - arrived)
+
+    await app.initialize()
+    try:
+        chats = {chat_id: Chat(chat_id, app.bot) for chat_id in chat_ids}
+        steps = {chat_id: flow(*targets[chat_id][:2], taps) for chat_id in chat_ids}
+        processor = app.update_processor
+
+        start = time.perf_counter()
+        # Come Application.__update_fetcher: un task per update, nell'ordine di arrivo
+        tasks = []
+        for chat_id, (label, kind, payload) in arrivals(steps, burst):
+            chat = chats[chat_id]
+            update = chat.callback(payload) if kind == 'callback' else chat.text(payload)
+            coroutine = timed(label, time.perf_counter(), app.process_update(update))
+            if processor.max_concurrent_updates > 1:
+                tasks.append(asyncio.create_task(processor.process_update(update, coroutine)))
+            else:
+                await processor.process_update(update, coroutine)
+        await asyncio.gather(*tasks)
+        # Tocchi ➕/➖ ancora in attesa: li scriviamo subito (come allo spegnimento)
+        await products.stock_taps.flush()
+        elapsed = time.perf_counter() - start
+        processor_stats = processor.stats()
+    finally:
+        await app.shutdown()
+
+    total = sum(len(v) for v in latencies.values())
+    handlers = {}
+    for label, values in sorted(latencies.items()):
+        values.sort()
+        handlers[label] = {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 50) * 1000, 3),
+            'p95_ms': round(percentile(values, 95) * 1000, 3),
+            'p99_ms': round(percentile(values, 99) * 1000, 3),
+            'max_ms': round(values[-1] * 1000, 3),
+        }
+    return {
+        'benchmark': 'load_test',
+        'chats': n_chats,
+        'products_per_chat': products_per_chat,
+        'taps_per_chat': taps,
+        'concurrency': concurrency,
+        'api_latency_ms': latency * 1000,
+        'arrival': 'burst' if burst else 'interleaved',
+        'setup_seconds': round(setup_seconds, 3),
+        'updates': total,
+        'seconds': round(elapsed, 3),
+        'updates_per_second': round(total / elapsed, 1),
+        'api_calls': dict(sorted(stub.calls.items())),
+        'debounced_taps': products.stock_taps.stats(),
+        'edits': edits.tracker.stats(),
+        'errors': dict(errors),
+        'ordered_chats': check_order(targets, taps),
+        'update_processor': processor_stats,
+        'handlers': handlers,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--products', type=int, default=100)
+    parser.add_argument('--taps', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.0, help="secondi per ogni chiamata a Telegram")
+    parser.add_argument('--burst', action='store_true', help="tutti i passi di una chat di seguito")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # Avvisi di PTB sulla configurazione delle ConversationHandler: noti, non servono qui
+    warnings.filterwarnings('ignore', category=PTBUserWarning)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "load_test.db")
+        database.init_db()
+        result = asyncio.run(run(args.chats, args.products, args.taps, args.concurrency, args.latency,
+                                 args.burst))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,309 @@
+"""
+Cache in memoria dell'inventario di ogni chat (categorie + prodotti).
+
+- Chiave: owner_id (la chat). Al massimo MAX_CHATS inventari, i meno usati escono per primi (LRU).
+- Ogni inventario scade dopo TTL secondi e viene ricaricato da SQLite.
+- Write-through: le funzioni di database.py che modificano i dati aggiornano anche la cache.
+- Ogni modifica assegna alla chat un nuovo numero di versione, utile a chi deve
+  capire se qualcosa è cambiato (es. testi già renderizzati).
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+MAX_CHATS = 1000   # Inventari tenuti in memoria
+TTL = 300          # Secondi prima di ricaricare un inventario da SQLite
+MAX_RENDERED = 2000  # Messaggi già formattati tenuti in memoria
+
+
+def as_id(value):
+    """Gli ID arrivano spesso come stringhe dai callback_data: li normalizziamo a int"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _real(prod):
+    # RETURNING può restituire 2 invece di 2.0 per le colonne REAL: riallineiamo a SELECT
+    for key in ('quantita', 'soglia_minima', 'margine'):
+        if prod.get(key) is not None:
+            prod[key] = float(prod[key])
+    return prod
+
+
+def shopping_state(prod):
+    """'da_comprare' sotto soglia, 'opzionale' alla soglia, None se la scorta è ok"""
+    if prod['quantita'] < prod['soglia_minima']:
+        return 'da_comprare'
+    if prod['quantita'] == prod['soglia_minima']:
+        return 'opzionale'
+    return None
+
+
+def _product_key(p):
+    # Stesso ordine di "ORDER BY c.nome, p.nome" (in SQLite i NULL vengono prima)
+    return (p['nome_categoria'] is not None, p['nome_categoria'] or "", p['nome'])
+
+
+def sorted_products(products):
+    return sorted(products, key=_product_key)
+
+
+class _Entry:
+    """Fotografia dell'inventario di una chat"""
+
+    def __init__(self, categories, products):
+        self.categories = {c['id']: dict(c) for c in categories}
+        self.products = {p['id']: dict(p) for p in products}
+        # Lista della spesa materializzata: id prodotto -> stato, aggiornata prodotto per prodotto
+        self.low = {}
+        for p in self.products.values():
+            self._track(p)
+        self.views = {}  # Liste derivate (ordinate/filtrate), azzerate ad ogni modifica
+        self.loaded_at = time.monotonic()
+
+    def set_product(self, prod):
+        self.products[prod['id']] = prod
+        self._track(prod)
+
+    def pop_product(self, product_id):
+        self.low.pop(product_id, None)
+        return self.products.pop(product_id, None)
+
+    def _track(self, prod):
+        state = shopping_state(prod)
+        if state:
+            self.low[prod['id']] = state
+        else:
+            self.low.pop(prod['id'], None)
+
+    def view(self, key, builder):
+        if key not in self.views:
+            self.views[key] = builder()
+        return self.views[key]
+
+
+class InventoryCache:
+    def __init__(self, max_chats=MAX_CHATS, ttl=TTL):
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._counter = itertools.count(1)
+        self._product_owner = {}
+        self._category_owner = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    # --- LETTURA ---
+
+    def get(self, owner_id):
+        """Restituisce l'inventario in cache (o None), aggiornando le statistiche"""
+        with self._lock:
+            entry = self._entries.get(owner_id)
+            if entry is not None and time.monotonic() - entry.loaded_at > self.ttl:
+                self._drop(owner_id)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(owner_id)
+            self.hits += 1
+            return entry
+
+    def view(self, entry, key, builder):
+        """Lista derivata dall'inventario (es. prodotti ordinati), ricalcolata solo dopo una modifica"""
+        with self._lock:
+            return entry.view(key, builder)
+
+    def cached_view(self, entry, key):
+        """Lista derivata se è già stata calcolata, altrimenti None (senza calcolarla)"""
+        with self._lock:
+            return entry.views.get(key)
+
+    def owner_of_product(self, product_id):
+        return self._product_owner.get(as_id(product_id))
+
+    def owner_of_category(self, cat_id):
+        return self._category_owner.get(as_id(cat_id))
+
+    def version(self, owner_id):
+        """Versione corrente dei dati di una chat (cambia ad ogni modifica)"""
+        with self._lock:
+            if owner_id not in self._versions:
+                self._versions[owner_id] = next(self._counter)
+            return self._versions[owner_id]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'chats': len(self._entries),
+        }
+
+    # --- CARICAMENTO ---
+
+    def store(self, owner_id, categories, products, version):
+        """
+        Salva un inventario appena letto da SQLite.
+        Se nel frattempo la chat è cambiata (versione diversa) i dati sono già vecchi:
+        li restituiamo al chiamante ma non li mettiamo in cache.
+        """
+        entry = _Entry(categories, products)
+        with self._lock:
+            if self.version(owner_id) != version:
+                return entry
+            self._drop(owner_id)
+            self._entries[owner_id] = entry
+            for pid in entry.products:
+                self._product_owner[pid] = owner_id
+            for cid in entry.categories:
+                self._category_owner[cid] = owner_id
+            while len(self._entries) > self.max_chats:
+                self._drop(next(iter(self._entries)))
+        return entry
+
+    # --- WRITE-THROUGH ---
+
+    def upsert_category(self, owner_id, category):
+        with self._lock:
+            entry = self._touch(owner_id)
+            if entry is None:
+                return
+            cat = dict(category)
+            entry.categories[cat['id']] = cat
+            self._category_owner[cat['id']] = owner_id
+            # Il nome della categoria è copiato su ogni prodotto (come nella JOIN)
+            for pid, p in entry.products.items():
+                if p['categoria_id'] == cat['id']:
+                    entry.products[pid] = {**p, 'nome_categoria': cat['nome']}
+
+    def remove_category(self, owner_id, cat_id):
+        cat_id = as_id(cat_id)
+        with self._lock:
+            entry = self._touch(owner_id)
+            if entry is None:
+                return
+            entry.categories.pop(cat_id, None)
+            self._category_owner.pop(cat_id, None)
+            # I prodotti diventano orfani, come fa delete_category su SQLite
+            for pid, p in entry.products.items():
+                if p['categoria_id'] == cat_id:
+                    entry.products[pid] = {**p, 'categoria_id': None, 'nome_categoria': None}
+
+    def upsert_product(self, owner_id, product):
+        """Salva in cache un prodotto appena scritto; lo restituisce come dict (anche se la chat non è in cache)"""
+        prod = _real(dict(product))
+        with self._lock:
+            entry = self._touch(owner_id)
+            if entry is not None:
+                entry.set_product(prod)
+                self._product_owner[prod['id']] = owner_id
+        return prod
+
+    def patch_product(self, owner_id, product_id, **changes):
+        """Applica a un prodotto in cache gli stessi campi appena scritti su SQLite"""
+        product_id = as_id(product_id)
+        with self._lock:
+            entry = self._touch(owner_id)
+            if entry is None or product_id not in entry.products:
+                return
+            # Le righe non vengono mai modificate sul posto: chi le sta leggendo non vede cambi a metà
+            prod = _real({**entry.products[product_id], **changes})
+            if 'categoria_id' in changes:
+                prod['categoria_id'] = as_id(prod['categoria_id'])
+                cat = entry.categories.get(prod['categoria_id'])
+                prod['nome_categoria'] = cat['nome'] if cat else None
+            if 'quantita' in changes or 'soglia_minima' in changes:
+                prod['margine'] = prod['quantita'] - prod['soglia_minima']
+            entry.set_product(prod)
+
+    def remove_product(self, owner_id, product_id):
+        product_id = as_id(product_id)
+        with self._lock:
+            entry = self._touch(owner_id)
+            if entry is None:
+                return
+            entry.pop_product(product_id)
+            self._product_owner.pop(product_id, None)
+
+    def invalidate(self, owner_id):
+        """Scarta l'inventario di una chat (verrà ricaricato alla prossima lettura)"""
+        with self._lock:
+            self._versions[owner_id] = next(self._counter)
+            self._drop(owner_id)
+
+    def clear(self):
+        with self._lock:
+            for owner_id in list(self._entries):
+                self.invalidate(owner_id)
+
+    # --- INTERNI ---
+
+    def _touch(self, owner_id):
+        """Nuova versione per la chat; restituisce l'inventario in cache da aggiornare"""
+        self._versions[owner_id] = next(self._counter)
+        entry = self._entries.get(owner_id)
+        if entry is not None:
+            entry.views.clear()
+        return entry
+
+    def _drop(self, owner_id):
+        entry = self._entries.pop(owner_id, None)
+        if entry is None:
+            return
+        for pid in entry.products:
+            self._product_owner.pop(pid, None)
+        for cid in entry.categories:
+            self._category_owner.pop(cid, None)
+
+
+class RenderCache:
+    """
+    Testi e tastiere già formattati, per chat e per vista (es. 'inventory', 'shopping').
+    Ogni voce ricorda la versione dei dati con cui è stata costruita: se nel frattempo
+    la chat è cambiata (vedi InventoryCache.version) la voce non vale più.
+    """
+
+    def __init__(self, max_items=MAX_RENDERED):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, owner_id, view, version):
+        with self._lock:
+            item = self._items.get((owner_id, view))
+            if item is None or item[0] != version:
+                self.misses += 1
+                return None
+            self._items.move_to_end((owner_id, view))
+            self.hits += 1
+            return item[1]
+
+    def put(self, owner_id, view, version, value):
+        with self._lock:
+            self._items[(owner_id, view)] = (version, value)
+            self._items.move_to_end((owner_id, view))
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'items': len(self._items),
+        }
+
+
+# Istanze uniche: inventory è usata da database.py, rendered dagli handler
+inventory = InventoryCache()
+rendered = RenderCache()
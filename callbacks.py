@@ -0,0 +1,217 @@
+"""
+Callback dei pulsanti inline: azioni tipizzate, codec compatto e router a prefissi.
+
+- Route: un tipo di azione. Chiamarla costruisce il callback_data del pulsante,
+  es. OPEN_PRODUCT(42) -> "op.AVQ" invece di "mod_prod_42".
+  Le azioni senza argomenti restano stringhe leggibili ("main_menu").
+- Codec: gli argomenti (interi) sono varint zigzag preceduti da un byte di versione,
+  in base64 url-safe senza padding. Telegram accetta al massimo 64 byte.
+- Router: un trie sui prefissi; una sola visita della stringa trova il tipo di azione.
+  I pulsanti di versioni precedenti (vecchio formato o VERSION diversa) non vengono
+  riconosciuti: li gestisce common.stale_button invece di finire in un handler sbagliato.
+- ActionHandler: CallbackQueryHandler che smista su {Route: callback} e mette l'azione
+  decodificata in context.action.
+"""
+import base64
+import binascii
+import functools
+from collections import Counter, namedtuple
+
+from telegram import Update
+from telegram.ext import CallbackQueryHandler
+
+# Da cambiare se cambiano gli argomenti di una Route: i vecchi pulsanti diventano "scaduti"
+VERSION = 1
+SEPARATOR = "."
+MAX_DATA_BYTES = 64  # Limite di Telegram per callback_data
+RESOLVE_CACHE_SIZE = 4096
+
+stats = Counter()  # Pulsanti non riconosciuti (vedi common.stale_button)
+
+
+class InvalidCallback(ValueError):
+    """callback_data illeggibile o di un'altra versione del codec"""
+
+
+# --- CODEC ---
+
+def _pack(values):
+    out = bytearray([VERSION])
+    for value in values:
+        value = int(value)
+        value = (value << 1) ^ (value >> 63)  # zigzag: i negativi piccoli restano corti
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return base64.urlsafe_b64encode(bytes(out)).rstrip(b"=").decode()
+
+
+def _unpack(payload, count):
+    try:
+        raw = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+    except (binascii.Error, ValueError):
+        raise InvalidCallback(f"payload non valido: {payload!r}")
+    if not raw or raw[0] != VERSION:
+        raise InvalidCallback(f"versione diversa: {raw[:1]!r}")
+
+    values, value, shift = [], 0, 0
+    for byte in raw[1:]:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append((value >> 1) ^ -(value & 1))
+            value, shift = 0, 0
+    if shift or len(values) != count:
+        raise InvalidCallback(f"attesi {count} argomenti: {payload!r}")
+    return values
+
+
+class Route:
+    def __init__(self, prefix, name, *fields):
+        # Con argomenti il prefisso termina col separatore, seguito dal payload
+        self.prefix = f"{prefix}{SEPARATOR}" if fields else prefix
+        self.fields = fields
+        self.type = namedtuple(name, fields)
+        self.type.route = self
+        self._static = None if fields else self.type()
+
+    def __call__(self, *args):
+        """callback_data del pulsante"""
+        if not self.fields:
+            return self.prefix
+        data = self.prefix + _pack(args)
+        if len(data.encode()) > MAX_DATA_BYTES:
+            raise ValueError(f"callback_data oltre {MAX_DATA_BYTES} byte: {data}")
+        return data
+
+    def decode(self, payload):
+        if not self.fields:
+            return self._static
+        return self.type(*_unpack(payload, len(self.fields)))
+
+    def __repr__(self):
+        return f"Route({self.type.__name__})"
+
+
+# --- ROUTER ---
+
+class Router:
+    """Trie sui prefissi: ogni nodo è un dict carattere -> figlio, la chiave None è la Route"""
+
+    def __init__(self, cache_size=RESOLVE_CACHE_SIZE):
+        self._root = {}
+        # Lo stesso callback viene controllato da più handler (stati, fallback): lo decodifichiamo una volta
+        self.resolve = functools.lru_cache(maxsize=cache_size)(self._resolve)
+
+    def add(self, route):
+        node = self._root
+        for char in route.prefix:
+            node = node.setdefault(char, {})
+        if None in node:
+            raise ValueError(f"prefisso già usato: {route.prefix}")
+        node[None] = route
+        self.resolve.cache_clear()
+        return route
+
+    def match(self, data):
+        """(Route, resto della stringa) del prefisso registrato più lungo, o (None, data)"""
+        node, best, end = self._root, None, 0
+        for position, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            route = node.get(None)
+            if route is not None:
+                best, end = route, position + 1
+        return best, data[end:]
+
+    def _resolve(self, data):
+        """Azione decodificata, oppure None se il pulsante non è (più) valido"""
+        route, rest = self.match(data)
+        # Le azioni senza argomenti devono coincidere per intero
+        if route is None or (rest and not route.fields):
+            return None
+        try:
+            return route.decode(rest)
+        except InvalidCallback:
+            return None
+
+
+router = Router()
+
+
+def route(prefix, name, *fields):
+    return router.add(Route(prefix, name, *fields))
+
+
+class ActionHandler(CallbackQueryHandler):
+    """Un handler per più tipi di azione: una ricerca nel trie, poi il callback della Route"""
+
+    def __init__(self, callbacks, block=True):
+        super().__init__(self._dispatch, block=block)
+        self.callbacks = dict(callbacks)
+
+    def check_update(self, update):
+        if not isinstance(update, Update) or not update.callback_query:
+            return None
+        data = update.callback_query.data
+        if not isinstance(data, str):
+            return None
+        action = router.resolve(data)
+        if action is not None and action.route in self.callbacks:
+            return action
+        return None
+
+    def collect_additional_context(self, context, update, application, check_result):
+        context.action = check_result
+
+    async def _dispatch(self, update, context):
+        return await self.callbacks[context.action.route](update, context)
+
+
+# ==========================
+# AZIONI
+# ==========================
+
+# --- Navigazione e viste ---
+MAIN_MENU = route('main_menu', 'MainMenu')
+MENU_PRODUCTS = route('menu_prodotti', 'MenuProducts')
+MENU_CATEGORIES = route('menu_categorie', 'MenuCategories')
+SHOPPING_LIST = route('show_shopping_list', 'ShoppingList')
+FULL_INVENTORY = route('show_full_inventory', 'FullInventory')
+PRINT_SHOPPING_LIST = route('print_shopping_list', 'PrintShoppingList')
+PRINT_FULL_INVENTORY = route('print_full_inventory', 'PrintFullInventory')
+CANCEL_FLOW = route('cancel_flow', 'CancelFlow')
+
+# --- Categorie ---
+ADD_CATEGORY = route('add_cat', 'AddCategory')
+EDIT_CATEGORY_LIST = route('edit_cat_list', 'EditCategoryList')
+BACK_TO_CATEGORY_MENU = route('back_to_cat_menu', 'BackToCategoryMenu')
+BACK_TO_CATEGORY_PANEL = route('back_to_cat_panel', 'BackToCategoryPanel')
+RENAME_CATEGORY = route('act_cat_rename', 'RenameCategory')
+DELETE_CATEGORY = route('act_cat_delete', 'DeleteCategory')
+EDIT_CATEGORY = route('ec', 'EditCategory', 'category_id')
+EDIT_CATEGORY_PAGE = route('ep', 'EditCategoryPage', 'forward', 'anchor_id')
+
+# --- Aggiunta prodotto ---
+ADD_PRODUCT = route('add_prod_start', 'AddProduct')
+BACK_TO_STEP_1 = route('back_to_step_1', 'BackToStep1')
+BACK_TO_STEP_2 = route('back_to_step_2', 'BackToStep2')
+BACK_TO_STEP_3 = route('back_to_step_3', 'BackToStep3')
+PICK_CATEGORY = route('pc', 'PickCategory', 'category_id')
+PICK_CATEGORY_PAGE = route('pp', 'PickCategoryPage', 'forward', 'anchor_id')
+
+# --- Modifica prodotti ---
+MODIFY_START = route('mod_start', 'ModifyStart')
+MODIFY_CATEGORY_PAGE = route('mp', 'ModifyCategoryPage', 'forward', 'anchor_id')
+OPEN_CATEGORY = route('oc', 'OpenCategory', 'category_id')  # category_id 0 = senza categoria
+PRODUCT_PAGE = route('lp', 'ProductPage', 'forward', 'anchor_id')
+BACK_TO_PRODUCT_LIST = route('back_to_prod_list', 'BackToProductList')
+OPEN_PRODUCT = route('op', 'OpenProduct', 'product_id')
+ADJUST_STOCK = route('as', 'AdjustStock', 'product_id', 'delta')
+ADJUST_THRESHOLD = route('at', 'AdjustThreshold', 'product_id', 'delta')
+MOVE_START = route('ms', 'MoveStart', 'product_id')
+MOVE_PAGE = route('mg', 'MovePage', 'product_id', 'forward', 'anchor_id')
+MOVE_TO = route('mt', 'MoveTo', 'product_id', 'category_id')
+DELETE_PRODUCT = route('dp', 'DeleteProduct', 'product_id')
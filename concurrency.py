@@ -0,0 +1,90 @@
+"""
+Elaborazione concorrente degli update, in ordine all'interno di ogni chat.
+
+Con PerChatUpdateProcessor chat diverse vengono servite in parallelo (fino a
+max_concurrent_updates alla volta), mentre gli update di una stessa chat restano in fila:
+le macchine a stati delle conversazioni e le letture/scritture sull'inventario
+(owner_id = id della chat) vedono gli update nell'ordine in cui sono arrivati.
+
+Come funziona: il primo update di una chat diventa il suo "worker" e occupa un posto;
+gli update che arrivano mentre il worker è attivo si accodano e liberano subito il loro
+posto (non tengono fermi i posti in attesa del proprio turno). Il worker esegue la coda
+della sua chat in ordine, poi termina.
+"""
+import logging
+from collections import Counter, deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def owner_key(update):
+    """Chat (= inventario) dell'update; per le query inline è l'utente (inventario personale)"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._queues = {}  # chiave della chat -> update in attesa dietro a quello in corso
+        self.counts = Counter()
+        self.max_backlog = 0
+
+    async def do_process_update(self, update, coroutine):
+        key = owner_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        queue = self._queues.get(key)
+        if queue is not None:
+            # La chat ha già un worker: l'update aspetta il suo turno senza occupare un posto
+            queue.append(coroutine)
+            self.counts['queued'] += 1
+            self.max_backlog = max(self.max_backlog, len(queue))
+            return
+
+        self._queues[key] = queue = deque()
+        self.counts['workers'] += 1
+        try:
+            await self._run(coroutine)
+            while queue:
+                await self._run(queue.popleft())
+        finally:
+            del self._queues[key]
+            # Solo se il worker viene cancellato (spegnimento): gli update rimasti non partiranno più
+            for pending in queue:
+                pending.close()
+
+    async def _run(self, coroutine):
+        self.counts['processed'] += 1
+        try:
+            await coroutine
+        except Exception:
+            # Application.process_update gestisce già gli errori degli handler: qui non si
+            # deve fermare la coda della chat per un errore imprevisto
+            logger.exception("Errore non gestito durante l'elaborazione di un update")
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        return {
+            'limit': self.max_concurrent_updates,
+            'running': self.current_concurrent_updates,
+            'busy_chats': len(self._queues),
+            'backlog': sum(len(queue) for queue in self._queues.values()),
+            'max_backlog': self.max_backlog,
+            **self.counts,
+        }
@@ -1,4 +1,5 @@
 import os
+import secrets
 from dotenv import load_dotenv
 
 # Carica le variabili dal file .env
@@ -9,4 +10,50 @@ TOKEN = os.getenv("TELEGRAM_TOKEN")
 
 # Se non lo trova, ferma tutto e ti avvisa
 if not TOKEN:
-    raise ValueError("ERRORE: Nessun Token trovato! Controlla il file .env")
\ No newline at end of file
+    raise ValueError("ERRORE: Nessun Token trovato! Controlla il file .env")
+
+# Quanti elementi (categorie o prodotti) mostrare per pagina nelle tastiere
+PAGE_SIZE = int(os.getenv("HOMESTOCK_PAGE_SIZE", 20))
+
+# --- WEBHOOK (opzionale) ---
+# Se WEBHOOK_URL è impostato il bot riceve gli aggiornamenti via webhook invece del polling.
+# WEBHOOK_URL è l'indirizzo pubblico (es. https://bot.example.com) che inoltra a WEBHOOK_LISTEN:WEBHOOK_PORT
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+# Telegram lo invia nell'header X-Telegram-Bot-Api-Secret-Token: le richieste senza vengono scartate.
+# Se manca se ne genera uno casuale ad ogni avvio.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+
+# Errori di rete consecutivi tollerati prima di chiudere il processo (e farlo riavviare da start.sh)
+NETWORK_FAILURE_BUDGET = int(os.getenv("NETWORK_FAILURE_BUDGET", 50))
+
+# Ogni quanti secondi salvare su SQLite conversazioni e dati utente/chat
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", 30))
+
+# Secondi di attesa dopo l'ultimo tocco su ➕/➖ prima di salvare e aggiornare il pannello
+TAP_WINDOW = float(os.getenv("TAP_WINDOW", 0.8))
+
+# --- RIEPILOGO SCORTE ---
+# Ogni DIGEST_INTERVAL_HOURS ore (a partire dalle DIGEST_TIME, ora UTC) ogni chat riceve la lista
+# dei prodotti in esaurimento, solo se è cambiata dall'ultimo invio. 0 = disattivato.
+DIGEST_TIME = os.getenv("DIGEST_TIME", "09:00")
+DIGEST_INTERVAL_HOURS = float(os.getenv("DIGEST_INTERVAL_HOURS", 24))
+# Pausa tra una chat e l'altra, per non mandare migliaia di messaggi nello stesso secondo
+DIGEST_SPACING = float(os.getenv("DIGEST_SPACING", 0.1))
+
+# Secondi per cui Telegram può riusare i risultati di una ricerca inline
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 10))
+
+# --- METRICHE ---
+# ID Telegram (separati da virgola) degli utenti che possono usare /stats
+ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x]
+# Porta dell'endpoint Prometheus (GET /metrics). 0 = disattivato
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+# Query più lente di così (in ms) vengono loggate con il loro piano di esecuzione
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 50))
+
+# Quante chat servire in parallelo (gli update di una stessa chat restano sempre in ordine). 1 = uno alla volta
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 16))
\ No newline at end of file
@@ -1,42 +1,542 @@
+import bisect
+import csv
+import io
+import itertools
+import json
+import logging
 import sqlite3
+import tempfile
+import threading
+import time
+
+import cache
+import forecast
+import metrics
+
+logger = logging.getLogger(__name__)
 
 DB_NAME = "homestock.db"
 
-def get_connection():
-    conn = sqlite3.connect(DB_NAME)
+# --- PARAMETRI CONNESSIONE ---
+# WAL: i lettori non bloccano lo scrittore e il commit scrive solo sul log.
+# synchronous=NORMAL in WAL fa fsync solo al checkpoint: il commit resta atomico,
+# al massimo si perdono le ultime transazioni in caso di blackout.
+CACHE_SIZE_KB = 8192               # Cache pagine per connessione (in KiB)
+MMAP_SIZE = 64 * 1024 * 1024       # Letture via memory-map (64 MB)
+STATEMENT_CACHE_SIZE = 128         # Statement preparati tenuti in cache da sqlite3
+BUSY_TIMEOUT = 10                  # Secondi di attesa se il db è bloccato
+
+# Una connessione per thread, aperta una volta e riutilizzata.
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_generation = 0  # Cambia ad ogni close_connections(): invalida le connessioni dei thread
+
+# --- MISURA DELLE QUERY ---
+# Ogni query registra in metrics il suo tempo (execute + fetch) e le righe lette o modificate.
+# Oltre SLOW_QUERY_MS viene loggata con il suo piano di esecuzione (main.py lo legge da config).
+SLOW_QUERY_MS = 50
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursore che misura la query in corso: la registra quando è finita (righe esaurite,
+    execute successivo o cursore abbandonato)"""
+
+    _sql = None
+
+    def _begin(self, sql, params, elapsed, many=False):
+        self._finish()
+        self._sql, self._params, self._many = sql, params, many
+        self._elapsed, self._rows = elapsed, 0
+        if self.description is None:
+            # INSERT/UPDATE/DELETE senza RETURNING: niente da leggere
+            self._rows = max(self.rowcount, 0)
+            self._finish()
+
+    def _finish(self):
+        sql, self._sql = self._sql, None
+        if sql is None or sql.lstrip()[:7].upper() == 'EXPLAIN':
+            return
+        metrics.observe_query(sql, self._elapsed, self._rows)
+        elapsed_ms = self._elapsed * 1000
+        if elapsed_ms >= SLOW_QUERY_MS:
+            plan = []
+            if not self._many:
+                try:
+                    plan = explain(sql, self._params)
+                except sqlite3.Error:
+                    pass
+            logger.warning(f"🐢 Query lenta ({elapsed_ms:.0f} ms, {self._rows} righe): "
+                           f"{' '.join(sql.split())} | piano: {plan}")
+
+    def _timed(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        if self._sql is not None:
+            self._elapsed += time.perf_counter() - start
+        return result
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        super().execute(sql, params)
+        self._begin(sql, params, time.perf_counter() - start)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_params)
+        self._begin(sql, None, time.perf_counter() - start, many=True)
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        elif self._sql is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        if not rows:
+            self._finish()
+        elif self._sql is not None:
+            self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        if self._sql is not None:
+            self._rows += len(rows)
+            self._finish()
+        return rows
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class TimedConnection(sqlite3.Connection):
+    # Connection.execute() di sqlite3 non passa da cursor(): va ridefinito qui
+    def execute(self, sql, params=()):
+        return self.cursor(TimedCursor).execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor(TimedCursor).executemany(sql, seq_of_params)
+
+
+def _open_connection():
+    conn = sqlite3.connect(DB_NAME, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE, factory=TimedConnection)
     conn.row_factory = sqlite3.Row
+    # Usate dai trigger di consumi (migrazione 8): chi scrive sul database deve passare da qui
+    conn.create_function("decadimento", 1, lambda days: float(forecast.decay(days)), deterministic=True)
+    conn.create_function("finestra", 1, lambda days: float(forecast.window_days(days)), deterministic=True)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def get_connection():
+    """Restituisce la connessione del thread corrente (la apre solo la prima volta)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.generation != _generation or _local.db_name != DB_NAME:
+        conn = _open_connection()
+        with _connections_lock:
+            _connections.append(conn)
+        _local.conn = conn
+        _local.generation = _generation
+        _local.db_name = DB_NAME
     return conn
 
+
+def close_connections():
+    """Hook di chiusura: ottimizza, fa il checkpoint del WAL e chiude tutte le connessioni"""
+    global _generation
+    with _connections_lock:
+        _generation += 1
+        for conn in _connections:
+            try:
+                conn.execute("PRAGMA optimize")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+
 def init_db():
     conn = get_connection()
-    cursor = conn.cursor()
-
-    # Tabella Categorie
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS categorie (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        owner_id INTEGER NOT NULL,
-        nome TEXT NOT NULL,
-        UNIQUE(owner_id, nome)
-    )
-    ''')
-
-    # Tabella Prodotti
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS prodotti (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        owner_id INTEGER NOT NULL,
-        categoria_id INTEGER,
-        nome TEXT NOT NULL,
-        quantita REAL DEFAULT 0,
-        unita_misura TEXT DEFAULT 'pz',
-        soglia_minima REAL DEFAULT 1,
-        tipo_scadenza TEXT, 
-        FOREIGN KEY (categoria_id) REFERENCES categorie (id) ON DELETE SET NULL
-    )
-    ''')
-    conn.commit()
-    conn.close()
+
+    with conn:
+        # Tabella Categorie
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS categorie (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            owner_id INTEGER NOT NULL,
+            nome TEXT NOT NULL,
+            UNIQUE(owner_id, nome)
+        )
+        ''')
+
+        # Tabella Prodotti
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS prodotti (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            owner_id INTEGER NOT NULL,
+            categoria_id INTEGER,
+            nome TEXT NOT NULL,
+            quantita REAL DEFAULT 0,
+            unita_misura TEXT DEFAULT 'pz',
+            soglia_minima REAL DEFAULT 1,
+            tipo_scadenza TEXT, 
+            FOREIGN KEY (categoria_id) REFERENCES categorie (id) ON DELETE SET NULL
+        )
+        ''')
+
+    # Aggiornamenti di schema successivi alla creazione delle tabelle
+    migrate(conn)
+
+# ==========================
+# SEZIONE MIGRAZIONI
+# ==========================
+
+# La posizione nella lista è la versione dello schema (salvata in PRAGMA user_version).
+# Una migrazione già rilasciata non si modifica mai: se serve altro se ne aggiunge una in fondo.
+MIGRATIONS = [
+    # 1. Indici per le ricerche per chat/categoria e per la lista della spesa.
+    #    (categorie(owner_id, nome) è già coperto dall'indice del vincolo UNIQUE)
+    [
+        "CREATE INDEX IF NOT EXISTS idx_prodotti_owner_cat_nome ON prodotti (owner_id, categoria_id, nome)",
+        "CREATE INDEX IF NOT EXISTS idx_prodotti_categoria ON prodotti (categoria_id)",
+        # margine <= 0 significa "da comprare" (rosso) o "al limite" (giallo)
+        "ALTER TABLE prodotti ADD COLUMN margine REAL GENERATED ALWAYS AS (quantita - soglia_minima) VIRTUAL",
+        "CREATE INDEX IF NOT EXISTS idx_prodotti_owner_margine ON prodotti (owner_id, margine)",
+    ],
+    # 2. Lista della spesa materializzata, tenuta allineata da trigger su prodotti.
+    #    stato: 'da_comprare' (quantita < soglia) oppure 'opzionale' (quantita = soglia)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS lista_spesa (
+            product_id INTEGER PRIMARY KEY,
+            owner_id INTEGER NOT NULL,
+            stato TEXT NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_lista_spesa_owner ON lista_spesa (owner_id, stato)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_lista_spesa_insert AFTER INSERT ON prodotti
+        WHEN NEW.quantita <= NEW.soglia_minima
+        BEGIN
+            INSERT OR REPLACE INTO lista_spesa (product_id, owner_id, stato)
+            VALUES (NEW.id, NEW.owner_id,
+                    CASE WHEN NEW.quantita < NEW.soglia_minima THEN 'da_comprare' ELSE 'opzionale' END);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_lista_spesa_update AFTER UPDATE OF quantita, soglia_minima ON prodotti
+        BEGIN
+            DELETE FROM lista_spesa WHERE product_id = OLD.id AND NEW.quantita > NEW.soglia_minima;
+            INSERT OR REPLACE INTO lista_spesa (product_id, owner_id, stato)
+            SELECT NEW.id, NEW.owner_id,
+                   CASE WHEN NEW.quantita < NEW.soglia_minima THEN 'da_comprare' ELSE 'opzionale' END
+            WHERE NEW.quantita <= NEW.soglia_minima;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_lista_spesa_delete AFTER DELETE ON prodotti
+        BEGIN
+            DELETE FROM lista_spesa WHERE product_id = OLD.id;
+        END
+        ''',
+        '''
+        INSERT OR REPLACE INTO lista_spesa (product_id, owner_id, stato)
+        SELECT id, owner_id, CASE WHEN quantita < soglia_minima THEN 'da_comprare' ELSE 'opzionale' END
+        FROM prodotti WHERE quantita <= soglia_minima
+        ''',
+    ],
+    # 3. Persistenza delle conversazioni e dei dati utente/chat (vedi persistence.py)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS conversazioni (
+            nome TEXT NOT NULL,
+            chiave TEXT NOT NULL,
+            stato TEXT NOT NULL,
+            PRIMARY KEY (nome, chiave)
+        )
+        ''',
+        "CREATE TABLE IF NOT EXISTS dati_utente (user_id INTEGER PRIMARY KEY, dati TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS dati_chat (chat_id INTEGER PRIMARY KEY, dati TEXT NOT NULL)",
+    ],
+    # 4. Ultimo riepilogo scorte inviato ad ogni chat (impronta della lista, per non ripetersi)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS notifiche (
+            owner_id INTEGER PRIMARY KEY,
+            impronta TEXT NOT NULL,
+            inviata_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ],
+    # 5. Ricerca full-text su nome prodotto e nome categoria (rowid = id del prodotto),
+    #    tenuta allineata da trigger su prodotti e categorie.
+    #    chat contiene un token per chat (vedi _fts_chat): il filtro per chat lo fa l'indice stesso.
+    [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS prodotti_fts USING fts5(
+            nome, categoria, chat,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_fts_prodotti_insert AFTER INSERT ON prodotti
+        BEGIN
+            INSERT INTO prodotti_fts (rowid, nome, categoria, chat)
+            VALUES (NEW.id, NEW.nome, (SELECT nome FROM categorie WHERE id = NEW.categoria_id),
+                    'chat' || replace(NEW.owner_id, '-', 'm'));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_fts_prodotti_update AFTER UPDATE OF nome, categoria_id ON prodotti
+        BEGIN
+            UPDATE prodotti_fts
+            SET nome = NEW.nome, categoria = (SELECT nome FROM categorie WHERE id = NEW.categoria_id)
+            WHERE rowid = NEW.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_fts_prodotti_delete AFTER DELETE ON prodotti
+        BEGIN
+            DELETE FROM prodotti_fts WHERE rowid = OLD.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_fts_categorie_update AFTER UPDATE OF nome ON categorie
+        BEGIN
+            UPDATE prodotti_fts SET categoria = NEW.nome
+            WHERE rowid IN (SELECT id FROM prodotti WHERE categoria_id = NEW.id);
+        END
+        ''',
+        '''
+        INSERT INTO prodotti_fts (rowid, nome, categoria, chat)
+        SELECT p.id, p.nome, c.nome, 'chat' || replace(p.owner_id, '-', 'm')
+        FROM prodotti p LEFT JOIN categorie c ON p.categoria_id = c.id
+        ''',
+    ],
+    # 6. Storico delle quantità (solo aggiunte) e aggregati dei consumi per le previsioni
+    #    (vedi forecast.py). Li scrivono i trigger nella stessa transazione dell'UPDATE:
+    #    quando = julianday, variazione = quantità nuova - vecchia (all'inserimento, la quantità iniziale).
+    #    consumi.consumato somma solo i cali: un rifornimento non abbassa il tasso di consumo.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS storico (
+            id INTEGER PRIMARY KEY,
+            product_id INTEGER NOT NULL,
+            owner_id INTEGER NOT NULL,
+            quando REAL NOT NULL DEFAULT (julianday('now')),
+            quantita REAL NOT NULL,
+            variazione REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_storico_owner ON storico (owner_id, product_id, quando)",
+        '''
+        CREATE TABLE IF NOT EXISTS consumi (
+            product_id INTEGER PRIMARY KEY,
+            owner_id INTEGER NOT NULL,
+            consumato REAL NOT NULL DEFAULT 0,
+            dal REAL NOT NULL DEFAULT (julianday('now'))
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_consumi_owner ON consumi (owner_id)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_storico_insert AFTER INSERT ON prodotti
+        BEGIN
+            INSERT INTO storico (product_id, owner_id, quantita, variazione)
+            VALUES (NEW.id, NEW.owner_id, NEW.quantita, NEW.quantita);
+            INSERT OR REPLACE INTO consumi (product_id, owner_id) VALUES (NEW.id, NEW.owner_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_storico_update AFTER UPDATE OF quantita ON prodotti
+        WHEN NEW.quantita != OLD.quantita
+        BEGIN
+            INSERT INTO storico (product_id, owner_id, quantita, variazione)
+            VALUES (NEW.id, NEW.owner_id, NEW.quantita, NEW.quantita - OLD.quantita);
+            INSERT INTO consumi (product_id, owner_id, consumato)
+            VALUES (NEW.id, NEW.owner_id, MAX(OLD.quantita - NEW.quantita, 0))
+            ON CONFLICT (product_id) DO UPDATE
+            SET consumato = consumato + excluded.consumato;
+        END
+        ''',
+        # Lo storico resta; l'aggregato di un prodotto eliminato non serve più
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_storico_delete AFTER DELETE ON prodotti
+        BEGIN
+            DELETE FROM consumi WHERE product_id = OLD.id;
+        END
+        ''',
+        # I prodotti esistenti partono da oggi, con la quantità attuale
+        '''
+        INSERT INTO storico (product_id, owner_id, quantita, variazione)
+        SELECT id, owner_id, quantita, quantita FROM prodotti
+        ''',
+        "INSERT OR IGNORE INTO consumi (product_id, owner_id) SELECT id, owner_id FROM prodotti",
+    ],
+    # 7. Lo storico non cresce più all'infinito: ad ogni variazione si tolgono le righe del prodotto
+    #    più vecchie di 90 giorni (ricerca sull'indice owner_id, product_id, quando), e si cancella
+    #    con il prodotto. Le previsioni usano gli aggregati di consumi, non queste righe.
+    [
+        "DROP TRIGGER IF EXISTS trg_storico_update",
+        '''
+        CREATE TRIGGER trg_storico_update AFTER UPDATE OF quantita ON prodotti
+        WHEN NEW.quantita != OLD.quantita
+        BEGIN
+            INSERT INTO storico (product_id, owner_id, quantita, variazione)
+            VALUES (NEW.id, NEW.owner_id, NEW.quantita, NEW.quantita - OLD.quantita);
+            DELETE FROM storico
+            WHERE owner_id = NEW.owner_id AND product_id = NEW.id AND quando < julianday('now') - 90;
+            INSERT INTO consumi (product_id, owner_id, consumato)
+            VALUES (NEW.id, NEW.owner_id, MAX(OLD.quantita - NEW.quantita, 0))
+            ON CONFLICT (product_id) DO UPDATE
+            SET consumato = consumato + excluded.consumato;
+        END
+        ''',
+        "DROP TRIGGER IF EXISTS trg_storico_delete",
+        '''
+        CREATE TRIGGER trg_storico_delete AFTER DELETE ON prodotti
+        BEGIN
+            DELETE FROM consumi WHERE product_id = OLD.id;
+            DELETE FROM storico WHERE owner_id = OLD.owner_id AND product_id = OLD.id;
+        END
+        ''',
+        "DELETE FROM storico WHERE quando < julianday('now') - 90",
+        "DELETE FROM storico WHERE product_id NOT IN (SELECT id FROM prodotti)",
+    ],
+    # 8. Consumo recente per le previsioni (vedi forecast.py): consumi.recente è la somma dei cali
+    #    pesata con decadimento() (funzione registrata in _open_connection), aggiornato è quando è
+    #    stata pesata. consumato resta il totale di sempre. I valori esistenti partono come se il
+    #    consumo fosse stato costante da `dal` a oggi.
+    [
+        "ALTER TABLE consumi ADD COLUMN recente REAL NOT NULL DEFAULT 0",
+        "ALTER TABLE consumi ADD COLUMN aggiornato REAL",
+        '''
+        UPDATE consumi
+        SET recente = CASE WHEN julianday('now') > dal
+                      THEN consumato / (julianday('now') - dal) * finestra(julianday('now') - dal)
+                      ELSE 0 END,
+            aggiornato = julianday('now')
+        ''',
+        "DROP TRIGGER IF EXISTS trg_storico_insert",
+        '''
+        CREATE TRIGGER trg_storico_insert AFTER INSERT ON prodotti
+        BEGIN
+            INSERT INTO storico (product_id, owner_id, quantita, variazione)
+            VALUES (NEW.id, NEW.owner_id, NEW.quantita, NEW.quantita);
+            INSERT OR REPLACE INTO consumi (product_id, owner_id, aggiornato)
+            VALUES (NEW.id, NEW.owner_id, julianday('now'));
+        END
+        ''',
+        "DROP TRIGGER IF EXISTS trg_storico_update",
+        '''
+        CREATE TRIGGER trg_storico_update AFTER UPDATE OF quantita ON prodotti
+        WHEN NEW.quantita != OLD.quantita
+        BEGIN
+            INSERT INTO storico (product_id, owner_id, quantita, variazione)
+            VALUES (NEW.id, NEW.owner_id, NEW.quantita, NEW.quantita - OLD.quantita);
+            DELETE FROM storico
+            WHERE owner_id = NEW.owner_id AND product_id = NEW.id AND quando < julianday('now') - 90;
+            INSERT INTO consumi (product_id, owner_id, consumato, recente, aggiornato)
+            VALUES (NEW.id, NEW.owner_id, MAX(OLD.quantita - NEW.quantita, 0),
+                    MAX(OLD.quantita - NEW.quantita, 0), julianday('now'))
+            ON CONFLICT (product_id) DO UPDATE
+            SET consumato = consumato + excluded.consumato,
+                recente = recente * decadimento(excluded.aggiornato - IFNULL(aggiornato, excluded.aggiornato))
+                          + excluded.recente,
+                aggiornato = excluded.aggiornato;
+        END
+        ''',
+    ],
+]
+
+
+def migrate(conn):
+    """Applica in ordine le migrazioni mancanti, ognuna nella sua transazione"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def explain(query, params=()):
+    """Restituisce il piano di esecuzione di una query (righe 'detail' di EXPLAIN QUERY PLAN)"""
+    conn = get_connection()
+    curs = conn.execute(f"EXPLAIN QUERY PLAN {query}", params)
+    return [row['detail'] for row in curs.fetchall()]
+
+# ==========================
+# SEZIONE CACHE
+# ==========================
+
+PRODUCTS_QUERY = '''
+    SELECT p.*, c.nome as nome_categoria 
+    FROM prodotti p
+    LEFT JOIN categorie c ON p.categoria_id = c.id
+    WHERE p.owner_id = ?
+    ORDER BY c.nome, p.nome
+'''
+
+def _inventory(owner_id):
+    """Inventario della chat dalla cache; se manca lo carica da SQLite (2 query)"""
+    entry = cache.inventory.get(owner_id)
+    if entry is None:
+        version = cache.inventory.version(owner_id)
+        conn = get_connection()
+        categories = conn.execute("SELECT * FROM categorie WHERE owner_id = ?", (owner_id,)).fetchall()
+        products = conn.execute(PRODUCTS_QUERY, (owner_id,)).fetchall()
+        entry = cache.inventory.store(owner_id, categories, products, version)
+    return entry
+
+def _inventory_of_product(product_id):
+    owner_id = cache.inventory.owner_of_product(product_id)
+    if owner_id is None:
+        row = get_connection().execute("SELECT owner_id FROM prodotti WHERE id = ?", (product_id,)).fetchone()
+        if row is None:
+            return None
+        owner_id = row['owner_id']
+    return _inventory(owner_id)
+
+def _inventory_of_category(cat_id):
+    owner_id = cache.inventory.owner_of_category(cat_id)
+    if owner_id is None:
+        row = get_connection().execute("SELECT owner_id FROM categorie WHERE id = ?", (cat_id,)).fetchone()
+        if row is None:
+            return None
+        owner_id = row['owner_id']
+    return _inventory(owner_id)
+
+def _view(entry, key, builder):
+    return cache.inventory.view(entry, key, builder)
+
+def _name_key(row):
+    return row['nome'], row['id']
 
 # ==========================
 # SEZIONE CATEGORIE
@@ -45,60 +545,46 @@ def init_db():
 def add_category(owner_id, nome_categoria):
     conn = get_connection()
     try:
-        conn.execute("INSERT INTO categorie (owner_id, nome) VALUES (?, ?)", (owner_id, nome_categoria))
-        conn.commit()
+        with conn:
+            curs = conn.execute("INSERT INTO categorie (owner_id, nome) VALUES (?, ?)", (owner_id, nome_categoria))
+        cache.inventory.upsert_category(owner_id, {'id': curs.lastrowid, 'owner_id': owner_id, 'nome': nome_categoria})
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def get_categories(owner_id):
-    conn = get_connection()
-    curs = conn.execute("SELECT * FROM categorie WHERE owner_id = ?", (owner_id,))
-    result = curs.fetchall()
-    conn.close()
-    return result
+    entry = _inventory(owner_id)
+    return _view(entry, 'categories', lambda: sorted(entry.categories.values(), key=_name_key))
 
 # --- LE FUNZIONI CHE TI MANCAVANO ---
 
 def get_category_by_id(cat_id):
     """Recupera una singola categoria per ID"""
-    conn = get_connection()
-    curs = conn.execute("SELECT * FROM categorie WHERE id = ?", (cat_id,))
-    res = curs.fetchone()
-    conn.close()
-    return res
-
-def count_products_in_category(cat_id):
-    """Conta quanti prodotti ci sono in una categoria"""
-    conn = get_connection()
-    curs = conn.execute("SELECT COUNT(*) FROM prodotti WHERE categoria_id = ?", (cat_id,))
-    count = curs.fetchone()[0]
-    conn.close()
-    return count
+    entry = _inventory_of_category(cat_id)
+    return entry.categories.get(cache.as_id(cat_id)) if entry else None
 
 def update_category_name(cat_id, new_name):
     """Rinomina una categoria"""
     conn = get_connection()
     try:
-        conn.execute("UPDATE categorie SET nome = ? WHERE id = ?", (new_name, cat_id))
-        conn.commit()
+        with conn:
+            row = conn.execute("UPDATE categorie SET nome = ? WHERE id = ? RETURNING *", (new_name, cat_id)).fetchone()
+        if row:
+            cache.inventory.upsert_category(row['owner_id'], row)
         return True
     except sqlite3.IntegrityError:
         return False # Nome già esistente
-    finally:
-        conn.close()
 
 def delete_category(cat_id):
     """Elimina una categoria e imposta i suoi prodotti come 'Senza Categoria'"""
     conn = get_connection()
-    # 1. Prima scolleghiamo i prodotti (li rendiamo orfani manualmente)
-    conn.execute("UPDATE prodotti SET categoria_id = NULL WHERE categoria_id = ?", (cat_id,))
-    # 2. Poi cancelliamo la categoria
-    conn.execute("DELETE FROM categorie WHERE id = ?", (cat_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        # 1. Prima scolleghiamo i prodotti (li rendiamo orfani manualmente)
+        conn.execute("UPDATE prodotti SET categoria_id = NULL WHERE categoria_id = ?", (cat_id,))
+        # 2. Poi cancelliamo la categoria
+        row = conn.execute("DELETE FROM categorie WHERE id = ? RETURNING owner_id", (cat_id,)).fetchone()
+    if row:
+        cache.inventory.remove_category(row['owner_id'], cat_id)
 
 # ==========================
 # SEZIONE PRODOTTI
@@ -106,91 +592,555 @@ def delete_category(cat_id):
 
 def add_product(owner_id, categoria_id, nome, quantita, soglia):
     conn = get_connection()
-    conn.execute('''
-        INSERT INTO prodotti (owner_id, categoria_id, nome, quantita, soglia_minima)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (owner_id, categoria_id, nome, quantita, soglia))
-    conn.commit()
-    conn.close()
+    with conn:
+        row = conn.execute('''
+            INSERT INTO prodotti (owner_id, categoria_id, nome, quantita, soglia_minima)
+            VALUES (?, ?, ?, ?, ?)
+            RETURNING *, (SELECT nome FROM categorie WHERE id = categoria_id) as nome_categoria
+        ''', (owner_id, categoria_id, nome, quantita, soglia)).fetchone()
+    cache.inventory.upsert_product(owner_id, row)
 
-def get_products(owner_id):
+def import_products(owner_id, items):
+    """
+    Importazione in blocco: items è una lista di (nome, quantita, soglia, nome_categoria o None).
+    Le categorie mancanti vengono create (il confronto ignora maiuscole/minuscole) e tutti i
+    prodotti sono inseriti in un'unica transazione.
+    Restituisce (prodotti inseriti, nomi delle categorie create).
+    """
     conn = get_connection()
-    query = '''
-        SELECT p.*, c.nome as nome_categoria 
-        FROM prodotti p
-        LEFT JOIN categorie c ON p.categoria_id = c.id
-        WHERE p.owner_id = ?
-        ORDER BY c.nome, p.nome
-    '''
-    curs = conn.execute(query, (owner_id,))
-    result = curs.fetchall()
-    conn.close()
-    return result
+    with conn:
+        def category_ids():
+            rows = conn.execute("SELECT id, nome FROM categorie WHERE owner_id = ?", (owner_id,)).fetchall()
+            return {row['nome'].casefold(): row['id'] for row in rows}
+
+        known = category_ids()
+        new_categories = {}
+        for _, _, _, cat_name in items:
+            if cat_name and cat_name.casefold() not in known:
+                new_categories.setdefault(cat_name.casefold(), cat_name)
+
+        if new_categories:
+            conn.executemany("INSERT OR IGNORE INTO categorie (owner_id, nome) VALUES (?, ?)",
+                             [(owner_id, nome) for nome in new_categories.values()])
+            known = category_ids()
+
+        conn.executemany('''
+            INSERT INTO prodotti (owner_id, categoria_id, nome, quantita, soglia_minima)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(owner_id, known[cat_name.casefold()] if cat_name else None, nome, qty, soglia)
+              for nome, qty, soglia, cat_name in items])
+
+    # Troppe righe per aggiornarle una a una: la cache della chat si ricarica alla prossima lettura
+    cache.inventory.invalidate(owner_id)
+    return len(items), list(new_categories.values())
+
+def get_products(owner_id):
+    entry = _inventory(owner_id)
+    return _view(entry, 'products', lambda: cache.sorted_products(entry.products.values()))
 
 def get_low_stock_products(owner_id):
+    entry = _inventory(owner_id)
+    return _view(entry, 'low_stock', lambda: cache.sorted_products(entry.products[pid] for pid in entry.low))
+
+def get_shopping_list(owner_id):
+    """
+    Lista della spesa già divisa in (da_comprare, opzionali).
+    Legge solo i prodotti in lista (cache o tabella lista_spesa), mai l'intero inventario.
+    """
+    entry = cache.inventory.get(owner_id)
+    if entry is not None:
+        # L'ordine per urgenza cambia anche solo col passare dei giorni: il giorno è nella chiave
+        key = ('shopping', forecast.today())
+        lists = cache.inventory.cached_view(entry, key)
+        if lists is not None:
+            return lists
+        # La previsione è una query: va fatta prima, fuori dal lock della cache (che è di tutte le chat)
+        days = _shopping_forecast(owner_id)
+        return _view(entry, key, lambda: _split_shopping(
+            cache.sorted_products({**entry.products[pid], 'stato': stato} for pid, stato in entry.low.items()),
+            days))
+
     conn = get_connection()
     query = '''
-        SELECT p.*, c.nome as nome_categoria 
-        FROM prodotti p
+        SELECT p.*, c.nome as nome_categoria, l.stato
+        FROM lista_spesa l
+        JOIN prodotti p ON p.id = l.product_id
         LEFT JOIN categorie c ON p.categoria_id = c.id
-        WHERE p.owner_id = ? AND p.quantita <= p.soglia_minima
+        WHERE l.owner_id = ?
         ORDER BY c.nome, p.nome
     '''
-    curs = conn.execute(query, (owner_id,))
-    result = curs.fetchall()
-    conn.close()
-    return result
+    return _split_shopping(conn.execute(query, (owner_id,)).fetchall(), _shopping_forecast(owner_id))
+
+def _split_shopping(products, days):
+    # Dentro ogni gruppo, prima quello che finisce prima (a pari previsione resta l'ordine per categoria)
+    products = forecast.by_urgency(products, days)
+    da_comprare = [p for p in products if p['stato'] == 'da_comprare']
+    opzionali = [p for p in products if p['stato'] == 'opzionale']
+    return da_comprare, opzionali
 
 def get_orphaned_products(owner_id):
     """Recupera i prodotti che non hanno una categoria (orfani)"""
-    conn = get_connection()
-    curs = conn.execute("SELECT * FROM prodotti WHERE owner_id = ? AND categoria_id IS NULL", (owner_id,))
-    result = curs.fetchall()
-    conn.close()
-    return result
+    entry = _inventory(owner_id)
+    return _view(entry, 'orphans', lambda: sorted(
+        (p for p in entry.products.values() if p['categoria_id'] is None), key=_name_key))
 
 # ==========================
 # SEZIONE MODIFICA PRODOTTI
 # ==========================
 
 def get_products_by_category(category_id):
-    conn = get_connection()
-    query = "SELECT * FROM prodotti WHERE categoria_id = ?"
-    curs = conn.execute(query, (category_id,))
-    result = curs.fetchall()
-    conn.close()
-    return result
+    entry = _inventory_of_category(category_id)
+    if entry is None:
+        return []
+    cat_id = cache.as_id(category_id)
+    return _view(entry, ('category', cat_id), lambda: sorted(
+        (p for p in entry.products.values() if p['categoria_id'] == cat_id), key=_name_key))
 
 def get_product_by_id(product_id):
-    conn = get_connection()
-    curs = conn.execute("SELECT * FROM prodotti WHERE id = ?", (product_id,))
-    result = curs.fetchone()
-    conn.close()
-    return result
+    entry = _inventory_of_product(product_id)
+    return entry.products.get(cache.as_id(product_id)) if entry else None
 
 def update_product_quantity(product_id, new_quantity):
     conn = get_connection()
-    conn.execute("UPDATE prodotti SET quantita = ? WHERE id = ?", (new_quantity, product_id))
-    conn.commit()
-    conn.close()
+    with conn:
+        row = conn.execute("UPDATE prodotti SET quantita = ? WHERE id = ? RETURNING owner_id, quantita",
+                           (new_quantity, product_id)).fetchone()
+    if row:
+        cache.inventory.patch_product(row['owner_id'], product_id, quantita=row['quantita'])
 
 def update_product_threshold(product_id, new_threshold):
     conn = get_connection()
-    conn.execute("UPDATE prodotti SET soglia_minima = ? WHERE id = ?", (new_threshold, product_id))
-    conn.commit()
-    conn.close()
+    with conn:
+        row = conn.execute("UPDATE prodotti SET soglia_minima = ? WHERE id = ? RETURNING owner_id, soglia_minima",
+                           (new_threshold, product_id)).fetchone()
+    if row:
+        cache.inventory.patch_product(row['owner_id'], product_id, soglia_minima=row['soglia_minima'])
+
+def adjust_quantity(product_id, delta):
+    """Aggiunge delta alla quantità (mai sotto zero). Restituisce il prodotto aggiornato o None"""
+    return adjust_product(product_id, quantity_delta=delta)
+
+def adjust_threshold(product_id, delta):
+    """Aggiunge delta alla soglia minima (mai sotto zero). Restituisce il prodotto aggiornato o None"""
+    return adjust_product(product_id, threshold_delta=delta)
+
+def adjust_product(product_id, quantity_delta=0, threshold_delta=0):
+    """
+    Variazione di quantità e soglia in un solo UPDATE: il calcolo lo fa SQLite sul valore
+    corrente, quindi due membri del gruppo che toccano insieme non si sovrascrivono.
+    """
+    conn = get_connection()
+    with conn:
+        row = conn.execute('''
+            UPDATE prodotti
+            SET quantita = MAX(0.0, quantita + ?), soglia_minima = MAX(0.0, soglia_minima + ?)
+            WHERE id = ?
+            RETURNING *, (SELECT nome FROM categorie WHERE id = categoria_id) as nome_categoria
+        ''', (quantity_delta, threshold_delta, product_id)).fetchone()
+    if row is None:
+        return None
+    return cache.inventory.upsert_product(row['owner_id'], row)
 
 def update_product_category(product_id, new_category_id):
     conn = get_connection()
-    conn.execute("UPDATE prodotti SET categoria_id = ? WHERE id = ?", (new_category_id, product_id))
-    conn.commit()
-    conn.close()
+    with conn:
+        row = conn.execute("UPDATE prodotti SET categoria_id = ? WHERE id = ? RETURNING owner_id, categoria_id",
+                           (new_category_id, product_id)).fetchone()
+    if row:
+        cache.inventory.patch_product(row['owner_id'], product_id, categoria_id=row['categoria_id'])
 
 def delete_product(product_id):
     conn = get_connection()
-    conn.execute("DELETE FROM prodotti WHERE id = ?", (product_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        row = conn.execute("DELETE FROM prodotti WHERE id = ? RETURNING owner_id", (product_id,)).fetchone()
+    if row:
+        cache.inventory.remove_product(row['owner_id'], product_id)
+
+# ==========================
+# SEZIONE PREVISIONI
+# ==========================
+# Giorni rimasti prima che un prodotto finisca, dagli aggregati di consumi (vedi forecast.py).
+
+FORECAST_QUERY = '''
+    SELECT c.product_id, p.quantita, c.recente, c.aggiornato, c.dal
+    FROM consumi c
+    JOIN prodotti p ON p.id = c.product_id
+'''
+
+def _shopping_forecast(owner_id=None):
+    # Solo i prodotti in lista della spesa (di una chat, o di tutte per il riepilogo)
+    query = FORECAST_QUERY + " JOIN lista_spesa l ON l.product_id = c.product_id"
+    if owner_id is None:
+        return forecast.forecast(get_connection().execute(query).fetchall())
+    return forecast.forecast(get_connection().execute(query + " WHERE l.owner_id = ?", (owner_id,)).fetchall())
+
+# ==========================
+# SEZIONE PAGINAZIONE
+# ==========================
+# Paginazione "keyset": ogni pagina riparte dall'ultimo elemento visto, ordinando per (nome, id),
+# invece di usare OFFSET. Si leggono solo le righe mostrate e l'indice dà già l'ordine giusto.
+# Ogni funzione restituisce (righe, c'è_una_pagina_prima, c'è_una_pagina_dopo).
+
+PAGE_SIZE = 20
+
+def get_categories_page(owner_id, after_id=None, before_id=None, limit=PAGE_SIZE):
+    """Una pagina di categorie della chat, dopo after_id o prima di before_id"""
+    entry = cache.inventory.get(owner_id)
+    if entry is not None:
+        items = _view(entry, 'categories', lambda: sorted(entry.categories.values(), key=_name_key))
+        return _list_page(items, entry.categories, after_id, before_id, limit)
+    return _keyset_page("categorie", "owner_id = ?", (owner_id,), after_id, before_id, limit)
+
+def get_products_page(owner_id, category_id, after_id=None, before_id=None, limit=PAGE_SIZE):
+    """Una pagina di prodotti di una categoria (category_id=None: prodotti senza categoria)"""
+    entry = cache.inventory.get(owner_id)
+    if entry is not None:
+        items = get_orphaned_products(owner_id) if category_id is None else get_products_by_category(category_id)
+        return _list_page(items, entry.products, after_id, before_id, limit)
+    if category_id is None:
+        return _keyset_page("prodotti", "owner_id = ? AND categoria_id IS NULL", (owner_id,),
+                            after_id, before_id, limit)
+    return _keyset_page("prodotti", "owner_id = ? AND categoria_id = ?", (owner_id, category_id),
+                        after_id, before_id, limit)
+
+def _keyset_page(table, where, params, after_id, before_id, limit):
+    backward = before_id is not None
+    anchor_id = before_id if backward else after_id
+    order = "DESC" if backward else "ASC"
+
+    query = f"SELECT * FROM {table} WHERE {where}"
+    args = list(params)
+    if anchor_id is not None:
+        query += f" AND (nome, id) {'<' if backward else '>'} (SELECT nome, id FROM {table} WHERE id = ?)"
+        args.append(anchor_id)
+    query += f" ORDER BY nome {order}, id {order} LIMIT ?"
+    args.append(limit + 1)  # Una riga in più per sapere se esiste la pagina seguente
+
+    rows = get_connection().execute(query, args).fetchall()
+    if not rows and anchor_id is not None:
+        # L'elemento di riferimento è stato eliminato (o era l'ultimo): ripartiamo dall'inizio
+        return _keyset_page(table, where, params, None, None, limit)
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+        return rows, more, True
+    return rows, anchor_id is not None, more
+
+def _list_page(items, by_id, after_id, before_id, limit):
+    """Stessa paginazione di _keyset_page, ma su una lista già ordinata presa dalla cache"""
+    backward = before_id is not None
+    anchor = by_id.get(cache.as_id(before_id if backward else after_id))
+
+    if backward and anchor is not None:
+        end = bisect.bisect_left(items, _name_key(anchor), key=_name_key)
+        start = max(0, end - limit)
+        return items[start:end], start > 0, True
+    if after_id is not None and anchor is not None:
+        start = bisect.bisect_right(items, _name_key(anchor), key=_name_key)
+        if start < len(items):
+            return items[start:start + limit], True, start + limit < len(items)
+    return items[:limit], False, len(items) > limit
+
+# ==========================
+# SEZIONE SCHERMATE
+# ==========================
+# Tutto quello che serve per disegnare una schermata, in una sola chiamata (un solo passaggio
+# sul thread del database) e con una sola query, o nessuna se la chat è in cache.
+# Conteggi per categoria: n_prodotti e n_bassi (quanti sono in lista della spesa).
+
+PRODUCT_PANEL_QUERY = '''
+    SELECT p.*, c.nome as nome_categoria, p.id as product_id, f.recente, f.aggiornato, f.dal
+    FROM prodotti p
+    LEFT JOIN categorie c ON p.categoria_id = c.id
+    LEFT JOIN consumi f ON f.product_id = p.id
+    WHERE p.id = ?
+'''
+
+CATEGORY_PANEL_QUERY = '''
+    SELECT c.*, COUNT(p.id) as n_prodotti, IFNULL(SUM(p.margine <= 0), 0) as n_bassi
+    FROM categorie c
+    LEFT JOIN prodotti p ON p.categoria_id = c.id
+    WHERE c.id = ?
+    GROUP BY c.id
+'''
+
+def get_product_panel(product_id):
+    """Pannello del prodotto: il prodotto con nome_categoria e giorni_rimasti (previsione o None)"""
+    owner_id = cache.inventory.owner_of_product(product_id)
+    entry = cache.inventory.get(owner_id) if owner_id is not None else None
+    if entry is not None:
+        prod = entry.products.get(cache.as_id(product_id))
+        if prod is None:
+            return None
+        row = {**_consumption(entry, prod['id']), 'product_id': prod['id'], 'quantita': prod['quantita']}
+        return {**prod, 'giorni_rimasti': forecast.forecast([row]).get(prod['id'])}
+
+    row = get_connection().execute(PRODUCT_PANEL_QUERY, (product_id,)).fetchone()
+    if row is None:
+        return None
+    prod = dict(row)
+    prod['giorni_rimasti'] = forecast.forecast([row]).get(row['id'])
+    for key in ('product_id', 'recente', 'aggiornato', 'dal'):
+        del prod[key]
+    return prod
+
+def _consumption(entry, product_id):
+    """
+    Riga di consumi del prodotto, tenuta tra le viste della chat: cambia solo insieme alla quantità,
+    cioè con una scrittura che le azzera. La previsione si ricalcola ogni volta (dipende da adesso).
+    La query (per chiave primaria) si fa fuori dal lock della cache, come per la lista della spesa.
+    """
+    key = ('consumi', product_id)
+    row = cache.inventory.cached_view(entry, key)
+    if row is None:
+        found = get_connection().execute("SELECT recente, aggiornato, dal FROM consumi WHERE product_id = ?",
+                                         (product_id,)).fetchone()
+        # Senza riga in consumi (nessun consumo registrato) la previsione semplicemente non c'è
+        now = forecast.julian_now()
+        row = _view(entry, key, lambda: dict(found) if found else {'recente': 0.0, 'aggiornato': now, 'dal': now})
+    return row
+
+def get_category_panel(cat_id):
+    """Pannello della categoria: la categoria con i suoi conteggi, o None se non esiste"""
+    owner_id = cache.inventory.owner_of_category(cat_id)
+    entry = cache.inventory.get(owner_id) if owner_id is not None else None
+    if entry is not None:
+        cat = entry.categories.get(cache.as_id(cat_id))
+        return _with_counts(cat, _category_counts(entry)) if cat else None
+    row = get_connection().execute(CATEGORY_PANEL_QUERY, (cat_id,)).fetchone()
+    return dict(row) if row else None
+
+def get_category_overview(owner_id, after_id=None, before_id=None, limit=PAGE_SIZE):
+    """
+    Scelta della categoria: una pagina di categorie con i loro conteggi e quanti prodotti sono
+    senza categoria. Restituisce ((righe, c'è_una_pagina_prima, c'è_una_pagina_dopo), orfani).
+    """
+    entry = cache.inventory.get(owner_id)
+    if entry is not None:
+        counts = _category_counts(entry)
+        items = _view(entry, 'categories', lambda: sorted(entry.categories.values(), key=_name_key))
+        rows, has_prev, has_next = _list_page(items, entry.categories, after_id, before_id, limit)
+    else:
+        rows, has_prev, has_next = _keyset_page("categorie", "owner_id = ?", (owner_id,),
+                                                after_id, before_id, limit)
+        # Conteggi della pagina e degli orfani con un solo GROUP BY (solo le categorie mostrate)
+        ids = [row['id'] for row in rows]
+        query = f'''
+            SELECT categoria_id, COUNT(*) as n_prodotti, SUM(margine <= 0) as n_bassi
+            FROM prodotti
+            WHERE owner_id = ? AND (categoria_id IS NULL OR categoria_id IN ({', '.join('?' * len(ids))}))
+            GROUP BY categoria_id
+        '''
+        counts = {row['categoria_id']: (row['n_prodotti'], row['n_bassi'])
+                  for row in get_connection().execute(query, (owner_id, *ids))}
+    page = ([_with_counts(row, counts) for row in rows], has_prev, has_next)
+    return page, counts.get(None, (0, 0))[0]
+
+def _category_counts(entry):
+    """{id categoria (None = senza categoria): (n_prodotti, n_bassi)}, ricalcolato solo dopo una modifica"""
+    def build():
+        counts = {}
+        for prod_id, prod in entry.products.items():
+            n_prodotti, n_bassi = counts.get(prod['categoria_id'], (0, 0))
+            counts[prod['categoria_id']] = (n_prodotti + 1, n_bassi + (prod_id in entry.low))
+        return counts
+    return _view(entry, 'category_counts', build)
+
+def _with_counts(cat, counts):
+    n_prodotti, n_bassi = counts.get(cat['id'], (0, 0))
+    return {**cat, 'n_prodotti': n_prodotti, 'n_bassi': n_bassi}
+
+# ==========================
+# SEZIONE PERSISTENZA BOT
+# ==========================
+# Stati delle conversazioni e user_data/chat_data, salvati come JSON.
+
+def load_conversations(name):
+    """Tutti gli stati salvati di una conversazione: {chiave (tupla): stato}"""
+    conn = get_connection()
+    curs = conn.execute("SELECT chiave, stato FROM conversazioni WHERE nome = ?", (name,))
+    return {tuple(json.loads(row['chiave'])): json.loads(row['stato']) for row in curs.fetchall()}
+
+def load_user_data(user_id):
+    conn = get_connection()
+    row = conn.execute("SELECT dati FROM dati_utente WHERE user_id = ?", (user_id,)).fetchone()
+    return json.loads(row['dati']) if row else {}
+
+def load_chat_data(chat_id):
+    conn = get_connection()
+    row = conn.execute("SELECT dati FROM dati_chat WHERE chat_id = ?", (chat_id,)).fetchone()
+    return json.loads(row['dati']) if row else {}
+
+def _encode_entries(kind, entries):
+    """[(id, valore), ...] -> [(id, JSON), ...]; quello che JSON non sa rappresentare viene scartato, con un log"""
+    encoded = []
+    for key, value in entries:
+        try:
+            encoded.append((key, json.dumps(value)))
+        except (TypeError, ValueError) as e:  # Oggetti non serializzabili, riferimenti circolari
+            logger.error(f"❌ {kind} {key} non salvabile, scartato: {e}")
+    return encoded
+
+def save_bot_state(conversations=(), user_data=None, chat_data=None, dropped_users=(), dropped_chats=()):
+    """
+    Scrive in un'unica transazione tutto quello che è cambiato dall'ultimo salvataggio.
+    - conversations: lista di (nome, chiave, stato); stato None = conversazione terminata
+    - user_data / chat_data: {id: dict}
+    Tutto viene convertito in JSON prima della transazione, una voce alla volta: una voce non
+    serializzabile viene scartata (resta l'ultima versione salvata) e non blocca le altre.
+    """
+    ended = [(name, json.dumps(key)) for name, key, state in conversations if state is None]
+    active = [(name, json.dumps(key), state) for (name, key), state in _encode_entries(
+        "Stato della conversazione", [((name, key), state) for name, key, state in conversations if state is not None])]
+    users = _encode_entries("user_data dell'utente", (user_data or {}).items())
+    chats = _encode_entries("chat_data della chat", (chat_data or {}).items())
+
+    conn = get_connection()
+    with conn:
+        conn.executemany("DELETE FROM conversazioni WHERE nome = ? AND chiave = ?", ended)
+        conn.executemany("INSERT OR REPLACE INTO conversazioni (nome, chiave, stato) VALUES (?, ?, ?)", active)
+        conn.executemany("INSERT OR REPLACE INTO dati_utente (user_id, dati) VALUES (?, ?)", users)
+        conn.executemany("INSERT OR REPLACE INTO dati_chat (chat_id, dati) VALUES (?, ?)", chats)
+        conn.executemany("DELETE FROM dati_utente WHERE user_id = ?", [(uid,) for uid in dropped_users])
+        conn.executemany("DELETE FROM dati_chat WHERE chat_id = ?", [(cid,) for cid in dropped_chats])
+
+# ==========================
+# SEZIONE RICERCA
+# ==========================
+
+SEARCH_LIMIT = 10
+# Peso di nome e categoria nel punteggio bm25: conta di più trovare la parola nel nome
+SEARCH_WEIGHTS = (10.0, 2.0)
+
+def _fts_chat(owner_id):
+    # Token della chat nell'indice: i gruppi hanno ID negativi e il '-' spezzerebbe il token
+    return f"chat{owner_id}".replace('-', 'm')
+
+def _fts_query(owner_id, text):
+    """
+    'lat fre' -> 'chat : "chat1" AND {nome categoria} : ("lat"* "fre"*)':
+    ogni parola è un prefisso, devono esserci tutte, solo tra i prodotti della chat.
+    """
+    words = ["".join(ch for ch in word if ch.isalnum()) for word in text.split()]
+    terms = " ".join(f'"{word}"*' for word in words if word)
+    if not terms:
+        return None
+    return f'chat : "{_fts_chat(owner_id)}" AND {{nome categoria}} : ({terms})'
+
+def search_products(owner_id, text, limit=SEARCH_LIMIT):
+    """Prodotti di una chat che contengono (come prefisso) tutte le parole cercate, i più pertinenti prima"""
+    match = _fts_query(owner_id, text)
+    if match is None:
+        return []
+    conn = get_connection()
+    query = '''
+        SELECT p.*, c.nome as nome_categoria
+        FROM prodotti_fts f
+        JOIN prodotti p ON p.id = f.rowid
+        LEFT JOIN categorie c ON p.categoria_id = c.id
+        WHERE prodotti_fts MATCH ?
+        ORDER BY bm25(prodotti_fts, ?, ?, 0.0)
+        LIMIT ?
+    '''
+    return conn.execute(query, (match, *SEARCH_WEIGHTS, limit)).fetchall()
+
+# ==========================
+# SEZIONE EXPORT
+# ==========================
+# L'export legge direttamente da SQLite (non dalla cache) a blocchi di EXPORT_BATCH righe e
+# scrive su un file temporaneo che resta in RAM fino a EXPORT_SPOOL_SIZE e poi passa su disco:
+# la memoria usata non cresce con la dimensione dell'inventario.
+
+EXPORT_BATCH = 500
+EXPORT_SPOOL_SIZE = 1024 * 1024
+# Stesse colonne accettate dall'importazione (handlers/imports.py)
+EXPORT_COLUMNS = ('nome', 'quantita', 'soglia', 'categoria', 'unita_misura')
+
+def iter_export_rows(owner_id, batch_size=EXPORT_BATCH):
+    """Prodotti di una chat ordinati per categoria e nome, letti dal cursore a blocchi"""
+    conn = get_connection()
+    curs = conn.execute('''
+        SELECT p.nome, p.quantita, p.soglia_minima as soglia, c.nome as categoria, p.unita_misura
+        FROM prodotti p
+        LEFT JOIN categorie c ON p.categoria_id = c.id
+        WHERE p.owner_id = ?
+        ORDER BY c.nome, p.nome
+    ''', (owner_id,))
+    while True:
+        rows = curs.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+def export_products(owner_id, fmt='csv'):
+    """
+    Scrive l'inventario in CSV o JSON su un SpooledTemporaryFile (binario, riavvolto).
+    Restituisce (file, numero di prodotti): il file va chiuso da chi lo usa.
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE, mode='w+b')
+    text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    count = 0
+    if fmt == 'json':
+        text.write("[")
+        for row in iter_export_rows(owner_id):
+            text.write(",\n" if count else "\n")
+            text.write(json.dumps(dict(row), ensure_ascii=False))
+            count += 1
+        text.write("\n]\n")
+    else:
+        writer = csv.writer(text)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in iter_export_rows(owner_id):
+            writer.writerow(row)
+            count += 1
+    text.flush()
+    text.detach()  # Il file resta aperto per chi lo deve inviare
+    out.seek(0)
+    return out, count
+
+# ==========================
+# SEZIONE NOTIFICHE
+# ==========================
+
+def get_all_shopping_lists():
+    """
+    Lista della spesa di tutte le chat con una sola query (ordinata per chat):
+    restituisce [(owner_id, da_comprare, opzionali), ...] solo per le chat con qualcosa in lista.
+    """
+    conn = get_connection()
+    query = '''
+        SELECT p.*, c.nome as nome_categoria, l.stato
+        FROM lista_spesa l
+        JOIN prodotti p ON p.id = l.product_id
+        LEFT JOIN categorie c ON p.categoria_id = c.id
+        ORDER BY l.owner_id, c.nome, p.nome
+    '''
+    rows = conn.execute(query).fetchall()
+    days = _shopping_forecast()
+    return [(owner_id, *_split_shopping(list(group), days))
+            for owner_id, group in itertools.groupby(rows, key=lambda r: r['owner_id'])]
+
+def get_digest_fingerprints():
+    """Impronta dell'ultimo riepilogo inviato ad ogni chat: {owner_id: impronta}"""
+    conn = get_connection()
+    return {row['owner_id']: row['impronta'] for row in conn.execute("SELECT owner_id, impronta FROM notifiche")}
+
+def save_digest_fingerprints(sent=None, cleared=()):
+    """
+    In un'unica transazione:
+    - sent: {owner_id: impronta} dei riepiloghi appena inviati
+    - cleared: chat la cui lista si è svuotata (al prossimo prodotto in esaurimento si riparte)
+    """
+    conn = get_connection()
+    with conn:
+        conn.executemany('''
+            INSERT INTO notifiche (owner_id, impronta) VALUES (?, ?)
+            ON CONFLICT(owner_id) DO UPDATE SET impronta = excluded.impronta, inviata_il = CURRENT_TIMESTAMP
+        ''', list((sent or {}).items()))
+        conn.executemany("DELETE FROM notifiche WHERE owner_id = ?", [(owner_id,) for owner_id in cleared])
 
 if __name__ == '__main__':
-    init_db()
\ No newline at end of file
+    init_db()
+    close_connections()
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""
+Raggruppa i tocchi ripetuti su "➕/➖" dello stesso prodotto.
+
+Ogni tocco aggiorna subito un totale provvisorio (da mostrare con query.answer()),
+ma la scrittura sul database e il nuovo disegno del pannello partono una sola volta,
+quando per WINDOW secondi non arrivano altri tocchi su quel prodotto.
+
+I tocchi appartengono a un gruppo (la chat): prima di ogni altro update del gruppo si chiama
+flush_group, così l'update vede già la quantità scritta e il pannello ridisegnato in ritardo
+non copre la schermata che l'update sta per mostrare.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 0.8  # Secondi di silenzio dopo cui i tocchi vengono applicati
+
+
+class _Pending:
+    """Tocchi in attesa su un prodotto"""
+
+    def __init__(self):
+        self.base = {}    # Valore di ogni campo prima del primo tocco
+        self.values = {}  # Valore provvisorio dopo l'ultimo tocco
+        self.context = None
+        self.group = None
+        self.timer = None
+
+
+class TapDebouncer:
+    def __init__(self, apply, window=WINDOW):
+        """
+        apply: coroutine apply(product_id, base, values, context) chiamata una volta per raffica,
+        con i valori di partenza e quelli finali dei campi toccati.
+        """
+        self._apply = apply
+        self.window = window
+        self._pending = {}
+        self._running = {}  # gruppo -> scritture partite dal timer e non ancora finite
+        self.taps = 0
+        self.flushes = 0
+        self.early_flushes = 0
+
+    def pending_value(self, product_id, field):
+        """Valore provvisorio di un campo, se ci sono tocchi in attesa (altrimenti None)"""
+        pending = self._pending.get(product_id)
+        return pending.values.get(field) if pending else None
+
+    def tap(self, product_id, field, delta, current_value, context=None, group=None):
+        """
+        Registra un tocco e restituisce il nuovo totale provvisorio (mai sotto zero).
+        current_value serve solo al primo tocco su quel campo; context (es. l'ultima query)
+        viene passato ad apply; group è la chat (vedi flush_group).
+        """
+        pending = self._pending.get(product_id)
+        if pending is None:
+            pending = self._pending[product_id] = _Pending()
+
+        if field not in pending.values:
+            pending.base[field] = current_value
+            pending.values[field] = current_value
+        pending.values[field] = max(0, pending.values[field] + delta)
+        pending.context = context
+        pending.group = group
+        self.taps += 1
+
+        # Ogni tocco fa ripartire la finestra
+        if pending.timer is not None:
+            pending.timer.cancel()
+        pending.timer = asyncio.get_running_loop().call_later(self.window, self._fire, product_id)
+        return pending.values[field]
+
+    def _fire(self, product_id):
+        pending = self._pending.get(product_id)
+        if pending is None:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(product_id))
+        running = self._running.setdefault(pending.group, set())
+        running.add(task)
+        task.add_done_callback(lambda _: self._done(pending.group, task))
+
+    def _done(self, group, task):
+        running = self._running.get(group)
+        if running is not None:
+            running.discard(task)
+            if not running:
+                del self._running[group]
+
+    async def _run(self, product_id, redraw=True):
+        pending = self._pending.pop(product_id, None)
+        if pending is None:
+            return
+        self.flushes += 1
+        try:
+            # Senza ridisegno apply riceve context=None: scrive e basta
+            await self._apply(product_id, pending.base, pending.values, pending.context if redraw else None)
+        except Exception as e:
+            logger.error(f"⚠️ Errore applicando i tocchi sul prodotto {product_id}: {e}")
+
+    def busy(self, group):
+        """True se il gruppo ha tocchi in attesa o in scrittura"""
+        return group in self._running or any(p.group == group for p in self._pending.values())
+
+    async def flush_group(self, group, keep=None, redraw=None):
+        """
+        Applica subito i tocchi in attesa del gruppo e aspetta le scritture già partite.
+        keep: prodotto da lasciare in attesa (la raffica continua);
+        redraw(context): False se il pannello non va ridisegnato (ci pensa l'update in arrivo).
+        """
+        running = self._running.get(group)
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        for product_id, pending in list(self._pending.items()):
+            if pending.group != group or product_id == keep:
+                continue
+            if pending.timer is not None:
+                pending.timer.cancel()
+            self.early_flushes += 1
+            await self._run(product_id, redraw=redraw(pending.context) if redraw else True)
+
+    async def flush(self):
+        """Applica subito tutti i tocchi in attesa (es. allo spegnimento)"""
+        for product_id, pending in list(self._pending.items()):
+            if pending.timer is not None:
+                pending.timer.cancel()
+            await self._run(product_id)
+        running = [task for tasks in self._running.values() for task in tasks]
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    def stats(self):
+        return {
+            'taps': self.taps,
+            'writes': self.flushes,
+            'early_writes': self.early_flushes,
+            'pending': len(self._pending),
+        }
@@ -0,0 +1,91 @@
+"""
+Modifiche dei messaggi senza chiamate inutili a Telegram.
+
+Per ogni messaggio ricordiamo l'impronta dell'ultimo contenuto inviato con edit_message_text
+(testo, tastiera e parse_mode). Se il nuovo render è identico (es. "➖ Stock" a zero, o lo
+stesso pulsante premuto due volte) la modifica non parte: Telegram risponderebbe soltanto
+"message is not modified", dopo un round trip e consumando budget del rate limiter.
+
+Gli handler rispondono comunque alla query con query.answer(): per un render invariato
+quella resta l'unica chiamata.
+"""
+from collections import Counter, OrderedDict
+
+from telegram.error import BadRequest
+
+MAX_MESSAGES = 10_000  # Messaggi ricordati (oltre, escono i meno recenti)
+
+
+class EditTracker:
+    def __init__(self, max_messages=MAX_MESSAGES):
+        self.max_messages = max_messages
+        self._last = OrderedDict()  # messaggio -> impronta dell'ultimo contenuto inviato
+        self.counts = Counter()
+
+    @staticmethod
+    def key(query):
+        """Messaggio della query: (chat, id) o id del messaggio inline; None se non si sa"""
+        if query.inline_message_id:
+            return query.inline_message_id
+        if query.message is None:
+            return None
+        return query.message.chat.id, query.message.message_id
+
+    @staticmethod
+    def fingerprint(text, reply_markup, parse_mode):
+        markup = reply_markup.to_json() if reply_markup is not None else None
+        return hash((text, markup, parse_mode))
+
+    def unchanged(self, key, digest):
+        if key is None or self._last.get(key) != digest:
+            return False
+        self._last.move_to_end(key)
+        return True
+
+    def remember(self, key, digest):
+        if key is None:
+            return
+        self._last[key] = digest
+        self._last.move_to_end(key)
+        while len(self._last) > self.max_messages:
+            self._last.popitem(last=False)
+
+    def forget(self, key):
+        self._last.pop(key, None)
+
+    def stats(self):
+        return {
+            'edits': self.counts['edits'],
+            'skipped': self.counts['skipped'],  # Chiamate risparmiate
+            'not_modified': self.counts['not_modified'],  # Chiamate a vuoto (impronta non ancora nota)
+            'messages': len(self._last),
+        }
+
+
+tracker = EditTracker()
+
+
+async def edit_message_text(query, text, reply_markup=None, parse_mode=None):
+    """query.edit_message_text, ma senza chiamata se il messaggio mostra già questo contenuto"""
+    key = tracker.key(query)
+    digest = tracker.fingerprint(text, reply_markup, parse_mode)
+    if tracker.unchanged(key, digest):
+        tracker.counts['skipped'] += 1
+        return
+
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    except BadRequest as e:
+        if 'not modified' not in e.message.lower():
+            # Non sappiamo più cosa mostra il messaggio
+            tracker.forget(key)
+            raise
+        # Era già così ma non lo sapevamo (es. dopo un riavvio): da ora lo sappiamo
+        tracker.counts['not_modified'] += 1
+    except Exception:
+        # Timeout, rete...: la modifica può essere arrivata oppure no
+        tracker.forget(key)
+        raise
+    else:
+        tracker.counts['edits'] += 1
+    tracker.remember(key, digest)
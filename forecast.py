@@ -0,0 +1,93 @@
+"""
+Previsioni di esaurimento delle scorte, calcolate dallo storico dei consumi.
+
+- storico: ogni variazione di quantità (solo aggiunte, mai modifiche). La scrive un trigger
+  dentro lo stesso UPDATE del prodotto: nessun commit in più, e i tocchi ➕/➖ che il debouncer
+  raggruppa restano un solo UPDATE, quindi una sola riga. Lo stesso trigger toglie le righe del
+  prodotto più vecchie di 90 giorni: lo storico resta limitato.
+- consumi: aggregati per prodotto aggiornati dallo stesso trigger. `recente` è la somma dei consumi
+  pesata per quanto sono recenti: ad ogni variazione il valore vecchio viene moltiplicato per
+  decay(giorni passati) e poi si aggiunge il nuovo calo. Una previsione legge una riga per prodotto,
+  non tutto lo storico, e segue i consumi delle ultime settimane invece della media di sempre.
+
+Tasso di consumo = recente (pesato fino ad adesso) / giorni osservati, pesati allo stesso modo
+(window_days): con un consumo costante il risultato è proprio quel consumo al giorno, sia per un
+prodotto appena aggiunto sia per uno osservato da mesi. Giorni rimasti = quantità / tasso.
+I conti sono fatti con NumPy su tutti i prodotti richiesti in un colpo solo.
+Le date sono giorni giuliani (julianday() di SQLite), così le differenze sono già in giorni.
+"""
+import math
+import time
+
+import numpy as np
+
+MIN_DAYS = 2.0  # Con meno giorni di storico il tasso è solo rumore: nessuna previsione
+MAX_DAYS = 365.0  # Oltre un anno la previsione non serve a nessuno
+TAU_DAYS = 14.0  # Un consumo di TAU_DAYS giorni fa pesa 1/e (~37%) di uno di oggi
+
+_UNIX_EPOCH_JULIAN = 2440587.5
+
+
+def julian_now():
+    """Adesso, come julianday('now') di SQLite"""
+    return time.time() / 86400.0 + _UNIX_EPOCH_JULIAN
+
+
+def today():
+    """Giorno corrente (UTC, cambia a mezzanotte): le viste che dipendono dalle previsioni lo usano nella chiave"""
+    return int(julian_now() + 0.5)
+
+
+def decay(days):
+    """Peso di un consumo di `days` giorni fa (1 adesso). Registrata su SQLite come decadimento()"""
+    return np.exp(-np.asarray(days, dtype=float) / TAU_DAYS)
+
+
+def window_days(days):
+    """Giorni osservati pesati come i consumi: ~days all'inizio, al massimo TAU_DAYS"""
+    return TAU_DAYS * (1.0 - decay(days))
+
+
+def run_out_days(quantita, recente, aggiornato, dal, now=None):
+    """
+    Giorni stimati prima che ogni prodotto finisca (array paralleli, uno per prodotto).
+    recente e aggiornato: consumo pesato e quando è stato pesato l'ultima volta; dal: inizio osservazione.
+    NaN dove non si può dire: storico troppo breve, nessun consumo o previsione oltre MAX_DAYS.
+    I prodotti già finiti valgono 0.
+    """
+    now = julian_now() if now is None else now
+    quantita = np.asarray(quantita, dtype=float)
+    recente = np.asarray(recente, dtype=float) * decay(now - np.asarray(aggiornato, dtype=float))
+    giorni = now - np.asarray(dal, dtype=float)
+
+    osservati = window_days(giorni)
+    tasso = np.divide(recente, osservati, out=np.zeros_like(recente), where=giorni >= MIN_DAYS)
+    days = np.divide(quantita, tasso, out=np.full_like(quantita, np.nan), where=tasso > 0)
+    days[days > MAX_DAYS] = np.nan
+    days[quantita <= 0] = 0.0
+    return days
+
+
+def forecast(rows, now=None):
+    """{id prodotto: giorni rimasti} dalle righe (product_id, quantita, recente, aggiornato, dal); solo quelli stimabili"""
+    if not rows:
+        return {}
+    ids, quantita, recente, aggiornato, dal = zip(*(
+        (r['product_id'], r['quantita'], r['recente'], r['aggiornato'], r['dal']) for r in rows))
+    days = run_out_days(quantita, recente, aggiornato, dal, now)
+    return {prod_id: float(d) for prod_id, d in zip(ids, days) if not math.isnan(d)}
+
+
+def by_urgency(products, days):
+    """Prodotti in ordine di esaurimento previsto; quelli senza previsione in fondo, nell'ordine di prima"""
+    return sorted(products, key=lambda p: days.get(p['id'], math.inf))
+
+
+def describe(days):
+    """Testo per il pannello del prodotto, o None se non c'è una previsione da mostrare"""
+    if days is None or days <= 0:
+        return None
+    if days < 1:
+        return "⏳ Finisce entro oggi"
+    n = round(days)
+    return f"⏳ Finisce tra ~{n} {'giorno' if n == 1 else 'giorni'}"
@@ -0,0 +1,32 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import edits
+import metrics
+
+TOP = 8            # Handler e query mostrati da /stats
+QUERY_CHARS = 70   # Le query sono lunghe: in chat ne basta l'inizio
+
+
+# --- /stats (solo ADMIN_IDS, il filtro è in main.py) ---
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handler più lenti (per p95) e query più costose (per tempo totale) dall'avvio"""
+    snap = metrics.snapshot(top=TOP)
+
+    lines = ["📈 Handler (p50 / p95 / max ms, chiamate)"]
+    for name, h in snap['handlers'].items():
+        lines.append(f"• {name}: {h['p50_ms']} / {h['p95_ms']} / {h['max_ms']} ({h['count']})")
+    if not snap['handlers']:
+        lines.append("• nessuno ancora")
+
+    lines.append("\n🗄 Query (totale ms, p95 ms, esecuzioni, righe)")
+    for sql, q in snap['queries'].items():
+        short = sql if len(sql) <= QUERY_CHARS else sql[:QUERY_CHARS - 1] + "…"
+        lines.append(f"• {q['total_ms']} · {q['p95_ms']} · {q['count']}x · {q['rows']} righe\n  {short}")
+
+    saved = edits.tracker.stats()
+    lines.append(f"\n✂️ Modifiche evitate (messaggio già uguale): {saved['skipped']} su "
+                 f"{saved['skipped'] + saved['edits'] + saved['not_modified']}")
+
+    # Testo semplice: le query contengono * e _ che romperebbero il Markdown
+    await update.message.reply_text("\n".join(lines))
@@ -1,6 +1,10 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, filters
-import database
+import callbacks
+import config
+import edits
+import repository
 import constants
 import utils
 
@@ -12,7 +16,7 @@ async def menu_categorie(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # MODIFICA: Usiamo la CHAT (gruppo o privato) come proprietario
     owner_id = update.effective_chat.id
-    categorie = database.get_categories(owner_id)
+    categorie = await repository.get_categories(owner_id)
 
     text = "📂 **Gestione Categorie**\n\nEcco le categorie di questo inventario:"
     if not categorie:
@@ -22,13 +26,13 @@ async def menu_categorie(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text += f"\n• {cat['nome']}"
 
     buttons = [
-        InlineKeyboardButton("➕ Nuova Categoria", callback_data='add_cat'),
-        InlineKeyboardButton("✏️ Modifica / Elimina", callback_data='edit_cat_list')
+        InlineKeyboardButton("➕ Nuova Categoria", callback_data=callbacks.ADD_CATEGORY()),
+        InlineKeyboardButton("✏️ Modifica / Elimina", callback_data=callbacks.EDIT_CATEGORY_LIST())
     ]
 
-    markup = utils.create_smart_grid(buttons, back_button_data='main_menu', cols=1)
+    markup = utils.create_smart_grid(buttons, back_button_data=callbacks.MAIN_MENU(), cols=1)
 
-    await query.edit_message_text(text, reply_markup=markup, parse_mode='Markdown')
+    await edits.edit_message_text(query, text, reply_markup=markup, parse_mode='Markdown')
     return ConversationHandler.END
 
 
@@ -36,8 +40,9 @@ async def menu_categorie(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def ask_category_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data='back_to_cat_menu')]]
-    await query.edit_message_text("✍️ **Scrivi il nome della categoria:**", reply_markup=InlineKeyboardMarkup(keyboard),
+    keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data=callbacks.BACK_TO_CATEGORY_MENU())]]
+    await edits.edit_message_text(query, "✍️ **Scrivi il nome della categoria:**",
+                                  reply_markup=InlineKeyboardMarkup(keyboard),
                                   parse_mode='Markdown')
     return constants.INSERIMENTO_NOME_CATEGORIA
 
@@ -47,13 +52,13 @@ async def save_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # MODIFICA: Usiamo la CHAT come proprietario
     owner_id = update.effective_chat.id
 
-    if database.add_category(owner_id, nome):
+    if await repository.add_category(owner_id, nome):
         msg = f"✅ Categoria **{nome}** creata!"
     else:
         msg = f"❌ La categoria **{nome}** esiste già!"
 
-    buttons = [InlineKeyboardButton("➕ Ancora una", callback_data='add_cat')]
-    markup = utils.create_smart_grid(buttons, back_button_data='back_to_cat_menu')
+    buttons = [InlineKeyboardButton("➕ Ancora una", callback_data=callbacks.ADD_CATEGORY())]
+    markup = utils.create_smart_grid(buttons, back_button_data=callbacks.BACK_TO_CATEGORY_MENU())
 
     await update.message.reply_text(msg, reply_markup=markup, parse_mode='Markdown')
     return constants.SCELTA_DOPO_CATEGORIA
@@ -68,7 +73,9 @@ async def list_categories_for_edit(update: Update, context: ContextTypes.DEFAULT
 
     query = update.callback_query if update.callback_query else None
 
-    categorie = database.get_categories(chat_id)
+    after_id, before_id = utils.page_bounds(context)
+    page, _ = await repository.get_category_overview(chat_id, after_id, before_id, limit=config.PAGE_SIZE)
+    categorie = page[0]
     flash_message = context.user_data.pop('flash_msg', None)
 
     base_text = "✏️ **Quale categoria vuoi modificare?**"
@@ -84,15 +91,16 @@ async def list_categories_for_edit(update: Update, context: ContextTypes.DEFAULT
 
     buttons = []
     for cat in categorie:
-        buttons.append(InlineKeyboardButton(f"📂 {cat['nome']}", callback_data=f"sel_edit_cat_{cat['id']}"))
+        buttons.append(InlineKeyboardButton(utils.category_button_text(cat), callback_data=callbacks.EDIT_CATEGORY(cat['id'])))
 
-    markup = utils.create_smart_grid(buttons, back_button_data='back_to_cat_menu')
+    markup = utils.create_paginated_grid(buttons, callbacks.EDIT_CATEGORY_PAGE, page,
+                                         back_button_data=callbacks.BACK_TO_CATEGORY_MENU())
 
     if query:
         await query.answer()
         try:
-            await query.edit_message_text(text, reply_markup=markup, parse_mode='Markdown')
-        except Exception:
+            await edits.edit_message_text(query, text, reply_markup=markup, parse_mode='Markdown')
+        except BadRequest:  # Messaggio non più modificabile (es. troppo vecchio): ne mandiamo uno nuovo
             await query.message.reply_text(text, reply_markup=markup, parse_mode='Markdown')
     else:
         await update.message.reply_text(text, reply_markup=markup, parse_mode='Markdown')
@@ -102,26 +110,26 @@ async def list_categories_for_edit(update: Update, context: ContextTypes.DEFAULT
 
 # --- FUNZIONE HELPER PER DISEGNARE IL PANNELLO ---
 async def render_category_panel(query, cat_id):
-    cat = database.get_category_by_id(cat_id)
+    # Categoria e conteggi in una sola chiamata
+    cat = await repository.get_category_panel(cat_id)
 
     if not cat:
         return False
 
-    n_prod = database.count_products_in_category(cat_id)
-
+    low = f" ({cat['n_bassi']} in esaurimento)" if cat['n_bassi'] else ""
     text = (
         f"📂 **Modifica: {cat['nome']}**\n"
-        f"Contiene {n_prod} prodotti.\n\n"
+        f"Contiene {cat['n_prodotti']} prodotti{low}.\n\n"
         f"Cosa vuoi fare?"
     )
 
     buttons = [
-        InlineKeyboardButton("✏️ Rinomina", callback_data='act_cat_rename'),
-        InlineKeyboardButton("🗑️ Elimina", callback_data='act_cat_delete')
+        InlineKeyboardButton("✏️ Rinomina", callback_data=callbacks.RENAME_CATEGORY()),
+        InlineKeyboardButton("🗑️ Elimina", callback_data=callbacks.DELETE_CATEGORY())
     ]
-    markup = utils.create_smart_grid(buttons, back_button_data='edit_cat_list')
+    markup = utils.create_smart_grid(buttons, back_button_data=callbacks.EDIT_CATEGORY_LIST())
 
-    await query.edit_message_text(text, reply_markup=markup, parse_mode='Markdown')
+    await edits.edit_message_text(query, text, reply_markup=markup, parse_mode='Markdown')
     return True
 
 
@@ -129,8 +137,7 @@ async def show_category_panel(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
 
-    parts = query.data.split("_")
-    cat_id = parts[-1]
+    cat_id = context.action.category_id
     context.user_data['edit_cat_id'] = cat_id
 
     if not await render_category_panel(query, cat_id):
@@ -142,25 +149,26 @@ async def show_category_panel(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def handle_category_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    action = query.data
+    action = context.action.route
     cat_id = context.user_data.get('edit_cat_id')
 
-    if action == 'edit_cat_list':
+    if action is callbacks.EDIT_CATEGORY_LIST:
         return await list_categories_for_edit(update, context)
 
-    if action == 'act_cat_delete':
-        database.delete_category(cat_id)
+    if action is callbacks.DELETE_CATEGORY:
+        await repository.delete_category(cat_id)
         context.user_data['flash_msg'] = "🗑️ **Categoria eliminata con successo!**"
         return await list_categories_for_edit(update, context)
 
-    if action == 'act_cat_rename':
+    if action is callbacks.RENAME_CATEGORY:
         await query.answer()
-        keyboard = [[InlineKeyboardButton("🔙 Annulla", callback_data='back_to_cat_panel')]]
-        await query.edit_message_text("✍️ **Scrivi il nuovo nome:**", reply_markup=InlineKeyboardMarkup(keyboard),
+        keyboard = [[InlineKeyboardButton("🔙 Annulla", callback_data=callbacks.BACK_TO_CATEGORY_PANEL())]]
+        await edits.edit_message_text(query, "✍️ **Scrivi il nuovo nome:**",
+                                      reply_markup=InlineKeyboardMarkup(keyboard),
                                       parse_mode='Markdown')
         return constants.RINOMINA_CATEGORIA
 
-    if action == 'back_to_cat_panel':
+    if action is callbacks.BACK_TO_CATEGORY_PANEL:
         await query.answer()
         if not await render_category_panel(query, cat_id):
             return await list_categories_for_edit(update, context)
@@ -171,7 +179,7 @@ async def save_renamed_category(update: Update, context: ContextTypes.DEFAULT_TY
     new_name = update.message.text
     cat_id = context.user_data['edit_cat_id']
 
-    if database.update_category_name(cat_id, new_name):
+    if await repository.update_category_name(cat_id, new_name):
         context.user_data['flash_msg'] = f"✅ Rinomina completata: **{new_name}**"
         return await list_categories_for_edit(update, context)
     else:
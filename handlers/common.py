@@ -1,5 +1,7 @@
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
+import callbacks
+import edits
 import utils
 
 
@@ -8,7 +10,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = f"Ciao {user.first_name}! 👋\nBenvenuto su HomeStock.\nCosa vuoi fare?"
 
     if update.callback_query:
-        await update.callback_query.edit_message_text(text, reply_markup=utils.get_main_menu_keyboard())
+        await update.callback_query.answer()
+        await edits.edit_message_text(update.callback_query, text, reply_markup=utils.get_main_menu_keyboard())
     else:
         await update.message.reply_text(text, reply_markup=utils.get_main_menu_keyboard())
     return ConversationHandler.END
@@ -17,8 +20,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.callback_query:
         await update.callback_query.answer()
-        await update.callback_query.edit_message_text("❌ Operazione annullata.",
-                                                      reply_markup=utils.get_main_menu_keyboard())
+        await edits.edit_message_text(update.callback_query, "❌ Operazione annullata.",
+                                      reply_markup=utils.get_main_menu_keyboard())
     else:
         await update.message.reply_text("❌ Operazione annullata.", reply_markup=utils.get_main_menu_keyboard())
+    return ConversationHandler.END
+
+
+async def stale_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pulsante non riconosciuto (vecchio formato o altra versione, vedi callbacks): si riparte dal menu"""
+    callbacks.stats['stale_buttons'] += 1
+    query = update.callback_query
+    await query.answer("⌛ Questo pulsante non è più valido.")
+    await edits.edit_message_text(query, "Cosa vuoi fare?", reply_markup=utils.get_main_menu_keyboard())
     return ConversationHandler.END
\ No newline at end of file
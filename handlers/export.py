@@ -0,0 +1,32 @@
+from datetime import date
+
+from telegram import InputFile, Update
+from telegram.ext import ContextTypes
+
+import ratelimit
+import repository
+
+FORMATS = ('csv', 'json')
+
+
+async def export_inventory(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export [csv|json]: invia l'inventario della chat come file"""
+    fmt = context.args[0].lower() if context.args else 'csv'
+    if fmt not in FORMATS:
+        await update.message.reply_text("⚠️ Formato non valido. Usa /export csv oppure /export json")
+        return
+
+    out, count = await repository.export_products(update.effective_chat.id, fmt)
+    try:
+        if not count:
+            await update.message.reply_text("📦 Nessun prodotto da esportare.")
+            return
+        # read_file_handle=False: il file viene letto a pezzi durante l'upload, non caricato tutto in memoria
+        # (httpx lo riavvolge prima di ogni invio, quindi anche un nuovo tentativo parte dall'inizio)
+        await update.message.reply_document(
+            document=InputFile(out, filename=f"homestock_{date.today().isoformat()}.{fmt}", read_file_handle=False),
+            caption=f"📤 Inventario esportato: {count} prodotti",
+            rate_limit_args=ratelimit.BULK
+        )
+    finally:
+        out.close()
@@ -0,0 +1,156 @@
+import csv
+import io
+import json
+import math
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import repository
+import utils
+
+MAX_IMPORT_BYTES = 1024 * 1024  # File più grandi vengono rifiutati
+MAX_IMPORT_ROWS = 2000
+MAX_ERRORS_SHOWN = 5
+
+USAGE = (
+    "📥 **Aggiunta veloce**\n"
+    "Scrivi /add seguito da un prodotto per riga:\n"
+    "`nome, quantità, minimo, categoria`\n\n"
+    "Esempio:\n"
+    "`/add\nLatte, 2, 1, Frigo\nPasta; 1,5; 1; Dispensa`\n\n"
+    "Minimo e categoria sono facoltativi. Puoi anche inviare un file .csv o .json con le stesse colonne."
+)
+
+# Nomi accettati per le colonne dei file JSON
+JSON_KEYS = {
+    'nome': ('nome', 'name'),
+    'quantita': ('quantita', 'quantità', 'quantity', 'qty'),
+    'soglia': ('soglia', 'soglia_minima', 'minimo', 'threshold'),
+    'categoria': ('categoria', 'nome_categoria', 'category'),
+}
+
+
+# --- LETTURA RIGHE ---
+
+def _number(text):
+    value = float(str(text).strip().replace(',', '.'))
+    if not math.isfinite(value) or value < 0:  # float() accetta anche "nan" e "inf"
+        raise ValueError
+    return value
+
+
+def parse_row(fields):
+    """[nome, quantità, soglia?, categoria?] -> (nome, quantita, soglia, categoria o None)"""
+    fields = [str(f).strip() if f is not None else "" for f in fields]
+    fields += [""] * (4 - len(fields))
+    nome, qty, soglia, categoria = fields[:4]
+    if not nome:
+        raise ValueError("nome mancante")
+    try:
+        qty = _number(qty)
+        soglia = _number(soglia) if soglia else 1.0
+    except ValueError:
+        raise ValueError("quantità o minimo non validi")
+    return nome, qty, soglia, categoria or None
+
+
+def _split_line(line):
+    # Con il punto e virgola la virgola resta libera per i decimali (es. "1,5")
+    return line.split(';') if ';' in line else line.split(',')
+
+
+def rows_from_text(text):
+    return [_split_line(line) for line in text.splitlines() if line.strip()]
+
+
+def rows_from_csv(text):
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    rows = [row for row in csv.reader(io.StringIO(text), dialect) if any(cell.strip() for cell in row)]
+    # Riga di intestazione (es. "nome,quantita,...") se la quantità non è un numero
+    if rows and len(rows[0]) > 1:
+        try:
+            _number(rows[0][1])
+        except ValueError:
+            rows = rows[1:]
+    return rows
+
+
+def rows_from_json(text):
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get('prodotti') or data.get('products') or []
+    rows = []
+    for item in data:
+        if isinstance(item, dict):
+            rows.append([next((item[k] for k in keys if k in item), None) for keys in JSON_KEYS.values()])
+        else:
+            rows.append(list(item))
+    return rows
+
+
+def parse_rows(rows):
+    """Restituisce (prodotti validi, [(numero riga, errore), ...])"""
+    items, errors = [], []
+    for number, fields in enumerate(rows, start=1):
+        try:
+            items.append(parse_row(fields))
+        except ValueError as e:
+            errors.append((number, str(e)))
+    return items, errors
+
+
+# --- HANDLER ---
+
+async def bulk_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/add con un prodotto per riga"""
+    # La prima riga contiene il comando (ed eventualmente già un prodotto)
+    text = update.message.text.split(maxsplit=1)
+    if len(text) < 2:
+        await update.message.reply_text(USAGE, parse_mode='Markdown')
+        return
+    await _import(update, rows_from_text(text[1]))
+
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """File .csv o .json inviato in chat"""
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+        await update.message.reply_text("⚠️ File troppo grande (massimo 1 MB).")
+        return
+
+    tg_file = await document.get_file()
+    data = bytes(await tg_file.download_as_bytearray())
+    try:
+        text = data.decode('utf-8-sig')
+        if (document.file_name or "").lower().endswith('.json'):
+            rows = rows_from_json(text)
+        else:
+            rows = rows_from_csv(text)
+    except (UnicodeDecodeError, ValueError, TypeError):
+        await update.message.reply_text("⚠️ Non riesco a leggere il file. Usa un CSV o un JSON in UTF-8.")
+        return
+    await _import(update, rows)
+
+
+async def _import(update, rows):
+    if len(rows) > MAX_IMPORT_ROWS:
+        await update.message.reply_text(f"⚠️ Troppi prodotti: massimo {MAX_IMPORT_ROWS} per volta.")
+        return
+
+    items, errors = parse_rows(rows)
+    added, new_categories = 0, []
+    if items:
+        added, new_categories = await repository.import_products(update.effective_chat.id, items)
+
+    # Un solo messaggio di riepilogo
+    text = f"📥 **Importazione completata**\n✅ Prodotti aggiunti: {added}\n"
+    if new_categories:
+        text += f"📂 Nuove categorie: {', '.join(new_categories)}\n"
+    if errors:
+        text += f"⚠️ Righe ignorate: {len(errors)}\n"
+        text += "".join(f"  • riga {number}: {error}\n" for number, error in errors[:MAX_ERRORS_SHOWN])
+    await update.message.reply_text(text, reply_markup=utils.get_main_menu_keyboard(), parse_mode='Markdown')
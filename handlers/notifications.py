@@ -0,0 +1,64 @@
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from telegram.error import Forbidden, TelegramError
+from telegram.ext import ContextTypes
+
+import config
+import ratelimit
+import repository
+import utils
+
+logger = logging.getLogger(__name__)
+
+DIGEST_TITLE = "🔔 Promemoria scorte"
+
+
+def fingerprint(da_comprare, opzionali):
+    """Impronta della lista: cambia solo se entra/esce un prodotto o cambia il suo stato"""
+    items = sorted((p['id'], p['stato']) for p in [*da_comprare, *opzionali])
+    return hashlib.sha1(repr(items).encode()).hexdigest()
+
+
+# --- RIEPILOGO PERIODICO ---
+async def send_low_stock_digest(context: ContextTypes.DEFAULT_TYPE):
+    """Job periodico: manda ad ogni chat la sua lista della spesa, se è cambiata dall'ultima volta"""
+    # Una query per tutte le chat, non una per chat
+    lists = await repository.get_all_shopping_lists()
+    previous = await repository.get_digest_fingerprints()
+
+    sent = {}
+    # Chat con la lista ormai vuota: al prossimo prodotto in esaurimento riceveranno di nuovo l'avviso
+    cleared = set(previous) - {owner_id for owner_id, _, _ in lists}
+
+    for owner_id, da_comprare, opzionali in lists:
+        digest = fingerprint(da_comprare, opzionali)
+        if previous.get(owner_id) == digest:
+            continue
+        try:
+            for chunk in utils.iter_shopping_list_chunks(da_comprare, opzionali, title=DIGEST_TITLE):
+                await context.bot.send_message(chat_id=owner_id, text=chunk, parse_mode='Markdown',
+                                               rate_limit_args=ratelimit.BULK)
+        except Forbidden:
+            # Bot rimosso dal gruppo o bloccato: segniamo comunque, così non riproviamo ad ogni giro
+            pass
+        except TelegramError as e:
+            logger.warning(f"⚠️ Riepilogo scorte non inviato alla chat {owner_id}: {e}")
+            continue
+        sent[owner_id] = digest
+        # Invii distribuiti nel tempo invece che tutti nello stesso secondo
+        await asyncio.sleep(config.DIGEST_SPACING)
+
+    await repository.save_digest_fingerprints(sent, cleared)
+    logger.info(f"🔔 Riepilogo scorte: {len(sent)} chat avvisate, {len(lists) - len(sent)} senza novità")
+
+
+def schedule_digest(job_queue):
+    """Registra il job del riepilogo (se attivo) a partire dal prossimo DIGEST_TIME"""
+    if not config.DIGEST_INTERVAL_HOURS:
+        return None
+    first = datetime.strptime(config.DIGEST_TIME, "%H:%M").time()
+    return job_queue.run_repeating(send_low_stock_digest, interval=timedelta(hours=config.DIGEST_INTERVAL_HOURS),
+                                   first=first, name='low_stock_digest')
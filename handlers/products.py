@@ -1,6 +1,14 @@
+import functools
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-import database
+import cache
+import callbacks
+import config
+import debounce
+import edits
+import forecast
+import repository
 import constants
 import utils
 
@@ -11,33 +19,107 @@ async def menu_prodotti(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     buttons = [
-        InlineKeyboardButton("➕ Aggiungi Prodotto", callback_data='add_prod_start'),
-        InlineKeyboardButton("✏️ Modifica / Aggiorna", callback_data='mod_start')
+        InlineKeyboardButton("➕ Aggiungi Prodotto", callback_data=callbacks.ADD_PRODUCT()),
+        InlineKeyboardButton("✏️ Modifica / Aggiorna", callback_data=callbacks.MODIFY_START())
     ]
-    markup = utils.create_smart_grid(buttons, back_button_data='main_menu')
+    markup = utils.create_smart_grid(buttons, back_button_data=callbacks.MAIN_MENU())
 
-    await query.edit_message_text("🛒 **Gestione Prodotti**\nQui puoi aggiungere o modificare le scorte.",
+    await edits.edit_message_text(query, "🛒 **Gestione Prodotti**\nQui puoi aggiungere o modificare le scorte.",
                                   reply_markup=markup, parse_mode='Markdown')
     return ConversationHandler.END
 
 
 # --- VISUALIZZAZIONE ---
 
+async def cached_view(owner_id, view, builder, daily=False):
+    """
+    Restituisce il render (testo, tastiera) di una vista, ricostruendolo solo se
+    i prodotti o le categorie della chat sono cambiati dall'ultima volta.
+    daily=True per le viste ordinate per previsione: scadono anche al cambio di giorno.
+    """
+    # La versione va letta PRIMA dei dati: se cambiano durante il render la voce nasce già scaduta
+    version = cache.inventory.version(owner_id)
+    if daily:
+        version = (version, forecast.today())
+    result = cache.rendered.get(owner_id, view, version)
+    if result is None:
+        result = await builder(owner_id)
+        cache.rendered.put(owner_id, view, version, result)
+    return result
+
+
+# Aggiunto in fondo alla schermata quando l'inventario non ci sta in un solo messaggio
+TRUNCATED_NOTE = "\n_…continua: usa 📤 Invia in Chat per vedere tutto._"
+
+
+def first_chunk(chunks):
+    """Prima parte di un testo a blocchi, con l'avviso se ce ne sono altre"""
+    first = next(chunks)
+    if next(chunks, None) is not None:
+        first += TRUNCATED_NOTE
+    return first
+
+
+async def render_full_inventory(owner_id):
+    products = await repository.get_products(owner_id)
+
+    # La schermata è un solo messaggio: mostriamo il primo blocco (lasciando spazio all'avviso)
+    chunks = utils.iter_inventory_chunks(products, title="📋 **Situazione Dispensa**",
+                                         limit=utils.MAX_MESSAGE_LENGTH - utils.tg_len(TRUNCATED_NOTE))
+    message_text = first_chunk(chunks)
+
+    buttons = [InlineKeyboardButton("📤 Invia in Chat", callback_data=callbacks.PRINT_FULL_INVENTORY())]
+    markup = utils.create_smart_grid(buttons, back_button_data=callbacks.MAIN_MENU())
+    return message_text, markup
+
+
+async def render_shopping_list(owner_id):
+    # Lista già divisa in Rossi (da comprare) e Gialli (opzionali)
+    da_comprare, opzionali = await repository.get_shopping_list(owner_id)
+
+    if not da_comprare and not opzionali:
+        message_text = "🎉 **Ottimo! Hai tutto quello che ti serve.**"
+        buttons = []
+    else:
+        chunks = utils.iter_shopping_list_chunks(da_comprare, opzionali, title="🚨 **Prodotti in Esaurimento**",
+                                                 limit=utils.MAX_MESSAGE_LENGTH - utils.tg_len(TRUNCATED_NOTE))
+        message_text = first_chunk(chunks)
+        buttons = [InlineKeyboardButton("📤 Invia in Chat", callback_data=callbacks.PRINT_SHOPPING_LIST())]
+
+    markup = utils.create_smart_grid(buttons, back_button_data=callbacks.MAIN_MENU())
+    return message_text, markup
+
+
+async def render_shopping_list_print(owner_id):
+    da_comprare, opzionali = await repository.get_shopping_list(owner_id)
+
+    # Lista vuota: niente da stampare
+    if not da_comprare and not opzionali:
+        return [], None
+
+    return list(utils.iter_shopping_list_chunks(da_comprare, opzionali, title="🛒 **LISTA DELLA SPESA**")), None
+
+
+async def render_full_inventory_print(owner_id):
+    products = await repository.get_products(owner_id)
+    return list(utils.iter_inventory_chunks(products, title="📦 **INVENTARIO TOTALE**")), None
+
+
+async def send_chunks(context, chat_id, chunks):
+    """Invia in ordine i messaggi di un testo diviso a blocchi"""
+    for chunk in chunks:
+        await context.bot.send_message(chat_id=chat_id, text=chunk, parse_mode='Markdown')
+
+
 async def show_full_inventory(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     # MODIFICA: Chat ID
     owner_id = update.effective_chat.id
-    products = database.get_products(owner_id)
-
-    # shopping_list_mode=False (default) -> Inventario standard
-    message_text = utils.format_inventory_message(products, title="📋 **Situazione Dispensa**", shopping_list_mode=False)
-
-    buttons = [InlineKeyboardButton("📤 Invia in Chat", callback_data='print_full_inventory')]
-    markup = utils.create_smart_grid(buttons, back_button_data='main_menu')
+    message_text, markup = await cached_view(owner_id, 'inventory', render_full_inventory)
 
-    await query.edit_message_text(message_text, reply_markup=markup, parse_mode='Markdown')
+    await edits.edit_message_text(query, message_text, reply_markup=markup, parse_mode='Markdown')
 
 
 async def show_shopping_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -46,20 +128,9 @@ async def show_shopping_list(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     # MODIFICA: Chat ID
     owner_id = update.effective_chat.id
-    # Nota: get_low_stock_products restituisce tutto ciò che è <= soglia (quindi Rossi e Gialli)
-    products = database.get_low_stock_products(owner_id)
-
-    if not products:
-        message_text = "🎉 **Ottimo! Hai tutto quello che ti serve.**"
-        buttons = []
-    else:
-        # shopping_list_mode=True -> Divide Rossi e Gialli
-        message_text = utils.format_inventory_message(products, title="🚨 **Prodotti in Esaurimento**", shopping_list_mode=True)
-        buttons = [InlineKeyboardButton("📤 Invia in Chat", callback_data='print_shopping_list')]
-
-    markup = utils.create_smart_grid(buttons, back_button_data='main_menu')
+    message_text, markup = await cached_view(owner_id, 'shopping', render_shopping_list, daily=True)
 
-    await query.edit_message_text(message_text, reply_markup=markup, parse_mode='Markdown')
+    await edits.edit_message_text(query, message_text, reply_markup=markup, parse_mode='Markdown')
 
 
 # --- FUNZIONI DI STAMPA ---
@@ -70,15 +141,12 @@ async def print_shopping_list_text(update: Update, context: ContextTypes.DEFAULT
 
     # MODIFICA: Chat ID per recuperare i dati
     chat_id = update.effective_chat.id
-    products = database.get_low_stock_products(chat_id)
+    chunks, _ = await cached_view(chat_id, 'shopping_print', render_shopping_list_print, daily=True)
 
-    if not products: return
-
-    # shopping_list_mode=True -> Divide Rossi e Gialli
-    message_text = utils.format_inventory_message(products, title="🛒 **LISTA DELLA SPESA**", shopping_list_mode=True)
+    if not chunks: return
 
     await query.message.delete()
-    await context.bot.send_message(chat_id=chat_id, text=message_text, parse_mode='Markdown')
+    await send_chunks(context, chat_id, chunks)
 
     menu_text = f"Eccoci tornati al menu principale."
     menu_markup = utils.get_main_menu_keyboard()
@@ -91,12 +159,10 @@ async def print_full_inventory_text(update: Update, context: ContextTypes.DEFAUL
 
     # MODIFICA: Chat ID
     chat_id = update.effective_chat.id
-    products = database.get_products(chat_id)
-
-    message_text = utils.format_inventory_message(products, title="📦 **INVENTARIO TOTALE**")
+    chunks, _ = await cached_view(chat_id, 'inventory_print', render_full_inventory_print)
 
     await query.message.delete()
-    await context.bot.send_message(chat_id=chat_id, text=message_text, parse_mode='Markdown')
+    await send_chunks(context, chat_id, chunks)
 
     menu_text = f"Eccoci tornati al menu principale."
     menu_markup = utils.get_main_menu_keyboard()
@@ -110,31 +176,36 @@ async def step_1_ask_category(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     # MODIFICA: Chat ID
     owner_id = update.effective_chat.id
-    categorie = database.get_categories(owner_id)
+    after_id, before_id = utils.page_bounds(context)
+    page = await repository.get_categories_page(owner_id, after_id, before_id, limit=config.PAGE_SIZE)
+    categorie = page[0]
 
     if not categorie:
-        await query.edit_message_text("⚠️ Non hai categorie!", reply_markup=utils.get_main_menu_keyboard())
+        await edits.edit_message_text(query, "⚠️ Non hai categorie!", reply_markup=utils.get_main_menu_keyboard())
         return ConversationHandler.END
 
     buttons = []
     for cat in categorie:
-        buttons.append(InlineKeyboardButton(cat['nome'], callback_data=f"sel_cat_{cat['id']}"))
+        buttons.append(InlineKeyboardButton(cat['nome'], callback_data=callbacks.PICK_CATEGORY(cat['id'])))
 
-    markup = utils.create_smart_grid(buttons, back_button_data='menu_prodotti')
+    markup = utils.create_paginated_grid(buttons, callbacks.PICK_CATEGORY_PAGE, page,
+                                         back_button_data=callbacks.MENU_PRODUCTS())
 
     if query.message:
-        await query.edit_message_text("1️⃣ **Scegli la categoria:**", reply_markup=markup, parse_mode='Markdown')
+        await edits.edit_message_text(query, "1️⃣ **Scegli la categoria:**",
+                                      reply_markup=markup, parse_mode='Markdown')
     return constants.SCELTA_CATEGORIA_PRODOTTO
 
 
 async def step_2_ask_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    if query.data.startswith("sel_cat_"):
-        context.user_data['temp_cat_id'] = query.data.split("_")[2]
+    if context.action.route is callbacks.PICK_CATEGORY:
+        context.user_data['temp_cat_id'] = context.action.category_id
 
-    keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data='back_to_step_1')]]
-    await query.edit_message_text("2️⃣ **Come si chiama il prodotto?**", reply_markup=InlineKeyboardMarkup(keyboard),
+    keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data=callbacks.BACK_TO_STEP_1())]]
+    await edits.edit_message_text(query, "2️⃣ **Come si chiama il prodotto?**",
+                                  reply_markup=InlineKeyboardMarkup(keyboard),
                                   parse_mode='Markdown')
     return constants.NOME_PRODOTTO
 
@@ -142,15 +213,16 @@ async def step_2_ask_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def step_3_ask_qty(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:
         context.user_data['temp_nome'] = update.message.text
-        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data='back_to_step_2')]]
+        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data=callbacks.BACK_TO_STEP_2())]]
         await update.message.reply_text(
             f"Ok, **{context.user_data['temp_nome']}**.\n3️⃣ **Quantità attuale?**\n(Scrivi solo il numero)",
             reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
     elif update.callback_query:
         query = update.callback_query
         await query.answer()
-        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data='back_to_step_2')]]
-        await query.edit_message_text(
+        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data=callbacks.BACK_TO_STEP_2())]]
+        await edits.edit_message_text(
+            query,
             f"Ok, **{context.user_data.get('temp_nome')}**.\n3️⃣ **Quantità attuale?**\n(Scrivi solo il numero)",
             reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
     return constants.QUANTITA_PRODOTTO
@@ -164,7 +236,7 @@ async def step_4_ask_threshold(update: Update, context: ContextTypes.DEFAULT_TYP
             context.user_data['temp_qty'] = float(update.message.text)
         except ValueError:
             # ERRORE: Non è un numero. Aggiungiamo il tasto indietro!
-            keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data='back_to_step_2')]]
+            keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data=callbacks.BACK_TO_STEP_2())]]
             await update.message.reply_text(
                 "⚠️ **Devi inserire un numero!**\n(Es: 1, 5, 10)\n\nRiprova o torna indietro:",
                 reply_markup=InlineKeyboardMarkup(keyboard),
@@ -174,7 +246,7 @@ async def step_4_ask_threshold(update: Update, context: ContextTypes.DEFAULT_TYP
             return constants.QUANTITA_PRODOTTO
 
         # Se è andato tutto bene, procediamo a chiedere la soglia
-        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data='back_to_step_3')]]
+        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data=callbacks.BACK_TO_STEP_3())]]
         await update.message.reply_text("4️⃣ **Quantità Minima?**\n(Sotto questo numero ti avviserò)",
                                         reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
@@ -182,8 +254,9 @@ async def step_4_ask_threshold(update: Update, context: ContextTypes.DEFAULT_TYP
     elif update.callback_query:
         query = update.callback_query
         await query.answer()
-        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data='back_to_step_3')]]
-        await query.edit_message_text("4️⃣ **Quantità Minima?**", reply_markup=InlineKeyboardMarkup(keyboard),
+        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data=callbacks.BACK_TO_STEP_3())]]
+        await edits.edit_message_text(query, "4️⃣ **Quantità Minima?**",
+                                      reply_markup=InlineKeyboardMarkup(keyboard),
                                       parse_mode='Markdown')
 
     return constants.SOGLIA_PRODOTTO
@@ -194,7 +267,7 @@ async def step_5_save_final(update: Update, context: ContextTypes.DEFAULT_TYPE):
         input_soglia = float(update.message.text)
     except ValueError:
         # ERRORE: Non è un numero. Aggiungiamo il tasto indietro!
-        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data='back_to_step_3')]]
+        keyboard = [[InlineKeyboardButton("🔙 Indietro", callback_data=callbacks.BACK_TO_STEP_3())]]
         await update.message.reply_text(
             "⚠️ **Devi inserire un numero!**\nRiprova o torna indietro:",
             reply_markup=InlineKeyboardMarkup(keyboard),
@@ -208,7 +281,7 @@ async def step_5_save_final(update: Update, context: ContextTypes.DEFAULT_TYPE):
     qty = context.user_data['temp_qty']
 
     # Salvataggio nel DB
-    database.add_product(
+    await repository.add_product(
         owner_id,
         context.user_data['temp_cat_id'],
         context.user_data['temp_nome'],
@@ -222,8 +295,8 @@ async def step_5_save_final(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     msg = f"✅ **{context.user_data['temp_nome']}** aggiunto!\n(Stock: {real_qty} | Minimo: {real_soglia})"
 
-    keyboard = [[InlineKeyboardButton("➕ Altro", callback_data='add_prod_start')],
-                [InlineKeyboardButton("🏠 Menu", callback_data='main_menu')]]
+    keyboard = [[InlineKeyboardButton("➕ Altro", callback_data=callbacks.ADD_PRODUCT())],
+                [InlineKeyboardButton("🏠 Menu", callback_data=callbacks.MAIN_MENU())]]
 
     await update.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
     return constants.FINE_PRODOTTO
@@ -231,57 +304,60 @@ async def step_5_save_final(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # --- MODIFICA PRODOTTI ---
 
-async def list_products_for_category(query, context, cat_id):
+async def list_products_for_category(query, context, cat_id, after_id=None, before_id=None):
     # MODIFICA: Chat ID (da query.message per i callback)
     owner_id = query.message.chat_id
 
     if cat_id == 'orphan':
-        products = database.get_orphaned_products(owner_id)
+        page = await repository.get_products_page(owner_id, None, after_id, before_id, limit=config.PAGE_SIZE)
         title = "⚠️ Prodotti Senza Categoria"
     else:
-        products = database.get_products_by_category(cat_id)
+        page = await repository.get_products_page(owner_id, cat_id, after_id, before_id, limit=config.PAGE_SIZE)
         title = "📦 Scegli il prodotto:"
+    products = page[0]
 
     buttons = []
     if products:
         for p in products:
-            buttons.append(InlineKeyboardButton(f"{p['nome']}", callback_data=f"mod_prod_{p['id']}"))
+            buttons.append(InlineKeyboardButton(f"{p['nome']}", callback_data=callbacks.OPEN_PRODUCT(p['id'])))
 
-    markup = utils.create_smart_grid(buttons, back_button_data='mod_start')
+    markup = utils.create_paginated_grid(buttons, callbacks.PRODUCT_PAGE, page,
+                                         back_button_data=callbacks.MODIFY_START())
 
     text = f"**{title}**" if products else f"{title}\n\n_Vuoto_"
-    await query.edit_message_text(text, reply_markup=markup, parse_mode='Markdown')
+    await edits.edit_message_text(query, text, reply_markup=markup, parse_mode='Markdown')
 
 
-async def show_move_category_selection(query, context, prod_id):
+async def show_move_category_selection(query, context, prod_id, after_id=None, before_id=None):
     # MODIFICA: Chat ID
     owner_id = query.message.chat_id
-    categorie = database.get_categories(owner_id)
+    page = await repository.get_categories_page(owner_id, after_id, before_id, limit=config.PAGE_SIZE)
+    categorie = page[0]
 
     if not categorie:
         await query.answer("Crea prima delle categorie!", show_alert=True)
         return
+    await query.answer()
 
     buttons = []
     for cat in categorie:
-        buttons.append(InlineKeyboardButton(f"📂 {cat['nome']}", callback_data=f"act_move_do_{prod_id}_{cat['id']}"))
+        buttons.append(InlineKeyboardButton(f"📂 {cat['nome']}", callback_data=callbacks.MOVE_TO(prod_id, cat['id'])))
 
-    markup = utils.create_smart_grid(buttons, back_button_data=f"mod_prod_{prod_id}")
+    markup = utils.create_paginated_grid(buttons, functools.partial(callbacks.MOVE_PAGE, prod_id), page,
+                                         back_button_data=callbacks.OPEN_PRODUCT(prod_id))
 
-    await query.edit_message_text("📍 **Dove vuoi spostare questo prodotto?**", reply_markup=markup,
+    await edits.edit_message_text(query, "📍 **Dove vuoi spostare questo prodotto?**", reply_markup=markup,
                                   parse_mode='Markdown')
 
 
-async def show_control_panel(query, prod):
+def build_control_panel(prod):
+    """Testo e tastiera del pannello di gestione di un prodotto (prod da repository.get_product_panel)"""
     qty = prod['quantita']
     soglia = prod['soglia_minima']
     qty_str = f"{int(qty)}" if qty.is_integer() else f"{qty}"
     soglia_str = f"{int(soglia)}" if soglia.is_integer() else f"{soglia}"
 
-    cat_name = "⚠️ Nessuna"
-    if prod['categoria_id']:
-        cat_info = database.get_category_by_id(prod['categoria_id'])
-        if cat_info: cat_name = cat_info['nome']
+    cat_name = prod['nome_categoria'] or "⚠️ Nessuna"
 
     # --- LOGICA STATI NEL PANNELLO ---
     if qty < soglia:
@@ -300,19 +376,69 @@ async def show_control_panel(query, prod):
         f"Stato: {status}\n"
     )
 
+    # Previsione dallo storico dei consumi (assente finché non ce n'è abbastanza)
+    run_out = forecast.describe(prod['giorni_rimasti'])
+    if run_out:
+        text += f"{run_out}\n"
+
     keyboard = [
-        [InlineKeyboardButton("➖ Stock", callback_data=f"act_stock_minus_{prod['id']}"),
-         InlineKeyboardButton("Stock ➕", callback_data=f"act_stock_plus_{prod['id']}")],
-        [InlineKeyboardButton("➖ Minimo", callback_data=f"act_thr_minus_{prod['id']}"),
-         InlineKeyboardButton("Minimo ➕", callback_data=f"act_thr_plus_{prod['id']}")],
-        [InlineKeyboardButton("📂 Sposta in Categoria", callback_data=f"act_move_start_{prod['id']}")],
-        [InlineKeyboardButton("🗑️ Elimina Prodotto", callback_data=f"act_del_{prod['id']}")],
-        [InlineKeyboardButton("🔙 Indietro", callback_data="back_to_prod_list")]
+        [InlineKeyboardButton("➖ Stock", callback_data=callbacks.ADJUST_STOCK(prod['id'], -1)),
+         InlineKeyboardButton("Stock ➕", callback_data=callbacks.ADJUST_STOCK(prod['id'], 1))],
+        [InlineKeyboardButton("➖ Minimo", callback_data=callbacks.ADJUST_THRESHOLD(prod['id'], -1)),
+         InlineKeyboardButton("Minimo ➕", callback_data=callbacks.ADJUST_THRESHOLD(prod['id'], 1))],
+        [InlineKeyboardButton("📂 Sposta in Categoria", callback_data=callbacks.MOVE_START(prod['id']))],
+        [InlineKeyboardButton("🗑️ Elimina Prodotto", callback_data=callbacks.DELETE_PRODUCT(prod['id']))],
+        [InlineKeyboardButton("🔙 Indietro", callback_data=callbacks.BACK_TO_PRODUCT_LIST())]
     ]
-    try:
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-    except Exception:
-        pass
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def show_control_panel(query, prod_id):
+    """Ridisegna il pannello del prodotto; restituisce il prodotto, o None se non esiste più"""
+    prod = await repository.get_product_panel(prod_id)
+    if prod is None:
+        return None
+    text, markup = build_control_panel(prod)
+    # Pannello invariato (es. "➖ Stock" a zero): nessuna chiamata, vedi edits
+    await edits.edit_message_text(query, text, reply_markup=markup, parse_mode='Markdown')
+    return prod
+
+
+async def apply_taps(prod_id, base, values, query):
+    """Fine di una raffica di ➕/➖: un solo UPDATE con la variazione netta e un solo aggiornamento del pannello"""
+    qty_delta = values.get('quantita', 0) - base.get('quantita', 0)
+    thr_delta = values.get('soglia_minima', 0) - base.get('soglia_minima', 0)
+    # Raffica che si annulla da sola (es. ➕ poi ➖): niente da scrivere né da ridisegnare
+    if not qty_delta and not thr_delta:
+        return
+    # query None: la raffica è stata chiusa da un altro update sullo stesso messaggio, che lo ridisegna lui
+    if await repository.adjust_product(prod_id, quantity_delta=qty_delta, threshold_delta=thr_delta) and query:
+        await show_control_panel(query, prod_id)
+
+
+stock_taps = debounce.TapDebouncer(apply_taps, window=config.TAP_WINDOW)
+
+
+async def flush_pending_taps(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Gira prima di ogni handler (gruppo -1 in main.py), in ordine con gli altri update della chat:
+    un update che non continua la raffica trova i tocchi già scritti. Se arriva dallo stesso
+    messaggio del pannello, il pannello non si ridisegna (l'update sta per mostrare altro).
+    """
+    chat = update.effective_chat
+    if chat is None or not stock_taps.busy(chat.id):
+        return
+
+    query = update.callback_query
+    keep = None
+    if query is not None and isinstance(query.data, str):
+        action = callbacks.router.resolve(query.data)
+        if action is not None and action.route in (callbacks.ADJUST_STOCK, callbacks.ADJUST_THRESHOLD):
+            keep = action.product_id
+    message = edits.tracker.key(query) if query is not None else None
+
+    await stock_taps.flush_group(chat.id, keep=keep,
+                                 redraw=lambda tap_query: message is None or edits.tracker.key(tap_query) != message)
 
 
 async def start_modify_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -321,97 +447,120 @@ async def start_modify_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # MODIFICA: Chat ID
     owner_id = update.effective_chat.id
-    categorie = database.get_categories(owner_id)
-    orphans = database.get_orphaned_products(owner_id)
+    after_id, before_id = utils.page_bounds(context)
+    # Categorie con i conteggi e numero di orfani in una sola chiamata
+    page, orphans = await repository.get_category_overview(owner_id, after_id, before_id, limit=config.PAGE_SIZE)
+    categorie, has_prev, _ = page
 
     buttons = []
 
-    if orphans:
-        buttons.append(InlineKeyboardButton(f"⚠️ Senza Categoria ({len(orphans)})", callback_data="mod_cat_orphan"))
+    # Il pulsante degli orfani compare solo in cima alla prima pagina
+    if orphans and not has_prev:
+        buttons.append(InlineKeyboardButton(f"⚠️ Senza Categoria ({orphans})", callback_data=callbacks.OPEN_CATEGORY(0)))
 
     if not categorie and not orphans:
-        await query.edit_message_text("⚠️ Non hai categorie né prodotti!", reply_markup=utils.get_main_menu_keyboard())
+        await edits.edit_message_text(query, "⚠️ Non hai categorie né prodotti!",
+                                      reply_markup=utils.get_main_menu_keyboard())
         return ConversationHandler.END
 
     for cat in categorie:
-        buttons.append(InlineKeyboardButton(f"📂 {cat['nome']}", callback_data=f"mod_cat_{cat['id']}"))
+        buttons.append(InlineKeyboardButton(utils.category_button_text(cat), callback_data=callbacks.OPEN_CATEGORY(cat['id'])))
 
-    markup = utils.create_smart_grid(buttons, back_button_data='menu_prodotti')
+    markup = utils.create_paginated_grid(buttons, callbacks.MODIFY_CATEGORY_PAGE, page,
+                                         back_button_data=callbacks.MENU_PRODUCTS())
 
-    await query.edit_message_text("✏️ **Scegli una categoria da modificare:**", reply_markup=markup,
+    await edits.edit_message_text(query, "✏️ **Scegli una categoria da modificare:**", reply_markup=markup,
                                   parse_mode='Markdown')
     return constants.MODIFICA_PRODOTTO
 
 
-async def manage_product_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    data = query.data
+# Un handler per tipo di azione (vedi callbacks): gli argomenti arrivano già decodificati in context.action
 
-    if data.startswith("mod_cat_"):
-        cat_id = data.split("_")[2]
-        context.user_data['current_mod_cat_id'] = cat_id
-        await list_products_for_category(query, context, cat_id)
-        return constants.MODIFICA_PRODOTTO
+async def open_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer()
+    cat_id = context.action.category_id or 'orphan'
+    context.user_data['current_mod_cat_id'] = cat_id
+    await list_products_for_category(update.callback_query, context, cat_id)
+    return constants.MODIFICA_PRODOTTO
 
-    if data.startswith("mod_prod_"):
-        prod_id = data.split("_")[2]
-        prod = database.get_product_by_id(prod_id)
-        if prod['categoria_id'] is None:
-            context.user_data['current_mod_cat_id'] = 'orphan'
-        else:
-            context.user_data['current_mod_cat_id'] = prod['categoria_id']
-        await show_control_panel(query, prod)
+
+async def product_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer()
+    after_id, before_id = utils.page_bounds(context)
+    cat_id = context.user_data.get('current_mod_cat_id')
+    await list_products_for_category(update.callback_query, context, cat_id, after_id, before_id)
+    return constants.MODIFICA_PRODOTTO
+
+
+async def back_to_product_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer()
+    cat_id = context.user_data.get('current_mod_cat_id')
+    await list_products_for_category(update.callback_query, context, cat_id)
+    return constants.MODIFICA_PRODOTTO
+
+
+async def open_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    prod = await show_control_panel(query, context.action.product_id)
+    if prod is None:
+        await query.answer("Errore: Prodotto non trovato.", show_alert=True)
         return constants.MODIFICA_PRODOTTO
+    await query.answer()
+    if prod['categoria_id'] is None:
+        context.user_data['current_mod_cat_id'] = 'orphan'
+    else:
+        context.user_data['current_mod_cat_id'] = prod['categoria_id']
+    return constants.MODIFICA_PRODOTTO
 
-    if data.startswith("act_"):
-        parts = data.split("_")
-        action_type = parts[1]
 
-        if action_type == "del":
-            prod_id = parts[2]
-            database.delete_product(prod_id)
-            await query.answer("🗑️ Prodotto eliminato!")
-            cat_id = context.user_data.get('current_mod_cat_id')
-            await list_products_for_category(query, context, cat_id)
-            return constants.MODIFICA_PRODOTTO
+async def delete_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await repository.delete_product(context.action.product_id)
+    await query.answer("🗑️ Prodotto eliminato!")
+    cat_id = context.user_data.get('current_mod_cat_id')
+    await list_products_for_category(query, context, cat_id)
+    return constants.MODIFICA_PRODOTTO
 
-        if action_type == "move" and parts[2] == "start":
-            prod_id = parts[3]
-            await show_move_category_selection(query, context, prod_id)
-            return constants.MODIFICA_PRODOTTO
 
-        if action_type == "move" and parts[2] == "do":
-            prod_id = parts[3]
-            new_cat_id = parts[4]
-            database.update_product_category(prod_id, new_cat_id)
-            await query.answer("✅ Prodotto spostato!")
-            prod = database.get_product_by_id(prod_id)
-            context.user_data['current_mod_cat_id'] = new_cat_id
-            await show_control_panel(query, prod)
-            return constants.MODIFICA_PRODOTTO
+async def move_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await show_move_category_selection(update.callback_query, context, context.action.product_id)
+    return constants.MODIFICA_PRODOTTO
+
+
+async def move_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    after_id, before_id = utils.page_bounds(context)
+    await show_move_category_selection(update.callback_query, context, context.action.product_id,
+                                       after_id, before_id)
+    return constants.MODIFICA_PRODOTTO
 
-        target, action, prod_id = parts[1], parts[2], parts[3]
-        prod = database.get_product_by_id(prod_id)
+
+async def move_to(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    prod_id, new_cat_id = context.action.product_id, context.action.category_id
+    await repository.update_product_category(prod_id, new_cat_id)
+    await query.answer("✅ Prodotto spostato!")
+    context.user_data['current_mod_cat_id'] = new_cat_id
+    await show_control_panel(query, prod_id)
+    return constants.MODIFICA_PRODOTTO
+
+
+async def tap_adjust(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """➕/➖ su stock (ADJUST_STOCK) o soglia (ADJUST_THRESHOLD)"""
+    query = update.callback_query
+    prod_id, delta = context.action.product_id, context.action.delta
+    is_stock = context.action.route is callbacks.ADJUST_STOCK
+    field = 'quantita' if is_stock else 'soglia_minima'
+
+    # Se ci sono già tocchi in attesa si parte dal totale provvisorio, senza rileggere il prodotto
+    current = stock_taps.pending_value(prod_id, field)
+    if current is None:
+        prod = await repository.get_product_by_id(prod_id)
         if not prod:
             await query.answer("Errore: Prodotto non trovato.", show_alert=True)
             return constants.MODIFICA_PRODOTTO
+        current = prod[field]
 
-        if target == "stock":
-            new_val = prod['quantita'] + 1 if action == "plus" else prod['quantita'] - 1
-            if new_val < 0: new_val = 0
-            database.update_product_quantity(prod_id, new_val)
-            await query.answer(f"Stock: {new_val}")
-        elif target == "thr":
-            new_val = prod['soglia_minima'] + 1 if action == "plus" else prod['soglia_minima'] - 1
-            if new_val < 0: new_val = 0
-            database.update_product_threshold(prod_id, new_val)
-            await query.answer(f"Soglia: {new_val}")
-
-        updated_prod = database.get_product_by_id(prod_id)
-        await show_control_panel(query, updated_prod)
-        return constants.MODIFICA_PRODOTTO
-
-    if data == "back_to_prod_list":
-        cat_id = context.user_data.get('current_mod_cat_id')
-        await list_products_for_category(query, context, cat_id)
-        return constants.MODIFICA_PRODOTTO
\ No newline at end of file
+    # Risposta immediata col totale; scrittura e pannello partono a fine raffica (vedi apply_taps)
+    new_val = stock_taps.tap(prod_id, field, delta, current, query, group=update.effective_chat.id)
+    await query.answer(f"Stock: {new_val}" if is_stock else f"Soglia: {new_val}")
+    return constants.MODIFICA_PRODOTTO
@@ -0,0 +1,77 @@
+from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle,
+                      InputTextMessageContent)
+from telegram.ext import ContextTypes, ConversationHandler
+
+import callbacks
+import config
+import constants
+import repository
+import utils
+from handlers import products
+
+LINK_PREFIX = "prod_"  # /start prod_<id>: link diretto al pannello di un prodotto
+
+
+def _summary(prod):
+    cat = prod['nome_categoria'] or "Senza Categoria"
+    return f"{cat} · {utils.fmt_num(prod['quantita'])} (Min: {utils.fmt_num(prod['soglia_minima'])})"
+
+
+# --- /find ---
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/find <testo>: elenco dei prodotti trovati, ognuno porta al suo pannello"""
+    text = " ".join(context.args)
+    if not text:
+        await update.message.reply_text("🔎 Scrivi cosa cercare, es: /find latte")
+        return ConversationHandler.END
+
+    results = await repository.search_products(update.effective_chat.id, text)
+    if not results:
+        await update.message.reply_text(f"🔎 Nessun prodotto trovato per \"{text}\".",
+                                        reply_markup=utils.get_main_menu_keyboard())
+        return ConversationHandler.END
+
+    buttons = [InlineKeyboardButton(f"📦 {p['nome']}", callback_data=callbacks.OPEN_PRODUCT(p['id'])) for p in results]
+    markup = utils.create_smart_grid(buttons, back_button_data=callbacks.MENU_PRODUCTS(), cols=1)
+    await update.message.reply_text(f"🔎 **Risultati per \"{text}\":**", reply_markup=markup, parse_mode='Markdown')
+    return constants.MODIFICA_PRODOTTO
+
+
+# --- LINK DIRETTO (dai risultati inline) ---
+async def open_product_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/start prod_<id>: apre subito il pannello del prodotto, se appartiene a questa chat"""
+    prod_id = context.args[0][len(LINK_PREFIX):]
+    prod = await repository.get_product_panel(prod_id)
+    if not prod or prod['owner_id'] != update.effective_chat.id:
+        await update.message.reply_text("⚠️ Prodotto non trovato.", reply_markup=utils.get_main_menu_keyboard())
+        return ConversationHandler.END
+
+    context.user_data['current_mod_cat_id'] = prod['categoria_id'] if prod['categoria_id'] is not None else 'orphan'
+    text, markup = products.build_control_panel(prod)
+    await update.message.reply_text(text, reply_markup=markup, parse_mode='Markdown')
+    return constants.MODIFICA_PRODOTTO
+
+
+# --- INLINE ---
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    @bot <testo> da qualsiasi chat: cerca nell'inventario personale (chat privata con il bot).
+    Ogni risultato ha un link che apre il pannello del prodotto nella chat privata.
+    """
+    inline_query = update.inline_query
+    owner_id = inline_query.from_user.id
+    results = await repository.search_products(owner_id, inline_query.query) if inline_query.query.strip() else []
+
+    articles = []
+    for prod in results:
+        link = f"https://t.me/{context.bot.username}?start={LINK_PREFIX}{prod['id']}"
+        articles.append(InlineQueryResultArticle(
+            id=str(prod['id']),
+            title=prod['nome'],
+            description=_summary(prod),
+            input_message_content=InputTextMessageContent(f"📦 {prod['nome']}\n{_summary(prod)}"),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("✏️ Gestisci", url=link)]])
+        ))
+
+    # I risultati dipendono da chi cerca: cache di Telegram per utente
+    await inline_query.answer(articles, cache_time=config.INLINE_CACHE_TIME, is_personal=True)
@@ -1,18 +1,27 @@
 import sys
-import os  # <--- FONDAMENTALE per il riavvio forzato
+import os  # <--- Serve per l'uscita forzata quando la rete è giù da troppo
 import logging
 from telegram import Update
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, CallbackQueryHandler,
-    ConversationHandler, MessageHandler, filters, ContextTypes
+    ConversationHandler, MessageHandler, InlineQueryHandler, TypeHandler, filters, ContextTypes
 )
-from telegram.error import TimedOut, NetworkError
-from telegram.request import HTTPXRequest
+from telegram.error import TimedOut, NetworkError, BadRequest, Forbidden, ChatMigrated
 
+import cache
+import callbacks
+import concurrency
 import config
 import database
+import edits
+import metrics
+import network
+import ratelimit
+import repository
 import constants
-from handlers import common, categories, products
+from handlers import common, categories, products, notifications, imports, export, search, admin
+from callbacks import ActionHandler
+from persistence import SQLitePersistence
 
 # 1. Configurazione Logging
 logging.basicConfig(
@@ -26,150 +35,315 @@ logging.getLogger("telegram").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
+# Solo i tipi di aggiornamento che gestiamo davvero: Telegram non ci manda il resto
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.INLINE_QUERY]
 
-# --- FUNZIONE KILLER PER ERRORI DI RETE (CRUCIALE PER START.SH) ---
+
+# --- GESTIONE ERRORI DI RETE (RECUPERO IN-PROCESS) ---
 async def global_error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
-    Questa funzione intercetta gli errori mentra il bot è attivo.
-    Se è un errore di rete, uccide il processo per far scattare start.sh.
+    Questa funzione intercetta gli errori mentre il bot è attivo.
+    Gli errori di rete non riavviano più il processo: ResilientRequest ha già ritentato con
+    backoff e il polling riprova da solo. Si chiude il processo (e start.sh riavvia)
+    solo quando i fallimenti consecutivi superano il budget configurato.
     """
     try:
         logger.error(f"⚠️ Eccezione rilevata: {context.error}")
 
+        # BadRequest è una sottoclasse di NetworkError, ma lì Telegram ha risposto: la rete funziona.
+        # Come Forbidden (bot bloccato) e ChatMigrated riguarda una sola chat e non va nel budget
+        if isinstance(context.error, (BadRequest, Forbidden, ChatMigrated)):
+            network.stats['handler_api_errors'] += 1
+            return
+
         # Se l'errore riguarda la connessione (Timeout, NetworkError, OSError)
         if isinstance(context.error, (TimedOut, NetworkError, OSError)):
-            logger.error("🛑 CRASH DI RETE RILEVATO! Chiudo il processo forzatamente...")
-            # os._exit(1) è brutale: chiude tutto all'istante senza aspettare.
-            os._exit(1)
-    except:
+            network.stats['handler_network_errors'] += 1
+            if not isinstance(context.error, NetworkError):
+                # Gli errori di Telegram sono già contati da ResilientRequest, gli OSError no
+                network.breaker.record_failure()
+
+            if network.breaker.exhausted:
+                network.stats['hard_exit'] += 1
+                logger.error(f"🛑 Budget errori di rete esaurito ({network.breaker.consecutive_failures} consecutivi). "
+                             f"Chiudo il processo forzatamente... Statistiche: {dict(network.stats)}")
+                # os._exit(1) è brutale: chiude tutto all'istante senza aspettare.
+                os._exit(1)
+
+            network.stats['recovered'] += 1
+            logger.warning(f"🌐 Errore di rete assorbito ({network.breaker.consecutive_failures}/"
+                           f"{network.breaker.failure_budget} consecutivi), il bot continua.")
+    except Exception:
         # Se fallisce anche l'handler, chiudiamo comunque
         os._exit(1)
 
 
-if __name__ == '__main__':
-    # Init Database
-    database.init_db()
+async def on_init(application) -> None:
+    """Endpoint Prometheus, se configurato (METRICS_PORT)."""
+    if config.METRICS_PORT:
+        await metrics.start_http_server(config.METRICS_LISTEN, config.METRICS_PORT)
 
+
+async def on_stop(application) -> None:
+    """Prima di chiudere salviamo i tocchi ➕/➖ ancora in attesa (il bot è ancora attivo)."""
+    await products.stock_taps.flush()
+    logger.info(f"📊 Tocchi ➕/➖: {products.stock_taps.stats()}")
+
+
+async def on_shutdown(application) -> None:
+    """Chiusura pulita: ferma i thread del database, checkpoint del WAL e chiusura connessioni."""
+    logger.info(f"📊 Cache inventario: {cache.inventory.stats()}")
+    logger.info(f"📊 Cache messaggi: {cache.rendered.stats()}")
+    logger.info(f"📊 Rete: {dict(network.stats)}")
+    logger.info(f"📊 Coda invii: {ratelimit.limiter.stats()}")
+    logger.info(f"📊 Update per chat: {application.update_processor.stats()}")
+    await metrics.stop_http_server()
+    repository.shutdown()
+
+
+def build_application(request=None, updates_request=None, rate_limiter=ratelimit.limiter,
+                      concurrent_updates=None):
+    """
+    Costruisce l'Application con tutti gli handler registrati.
+    request / updates_request / rate_limiter si possono sostituire (es. benchmarks/load_test.py
+    usa un finto layer HTTP che non va in rete e nessun limite di invio).
+    concurrent_updates: chat servite in parallelo (default config.CONCURRENT_UPDATES).
+    """
     # --- CONFIGURAZIONE RETE ---
-    # Impostiamo i timeout per rendere il bot più tollerante alle reti mobili
-    trequest = HTTPXRequest(
-        connection_pool_size=8,
-        read_timeout=30,
-        write_timeout=30,
-        connect_timeout=30,
-        http_version='1.1'
-    )
+    # Impostiamo i timeout per rendere il bot più tollerante alle reti mobili.
+    # ResilientRequest ritenta da sola le chiamate fallite per problemi di rete.
+    network.breaker.failure_budget = config.NETWORK_FAILURE_BUDGET
+    database.SLOW_QUERY_MS = config.SLOW_QUERY_MS
+    if request is None:
+        request = network.ResilientRequest(
+            connection_pool_size=8,
+            read_timeout=30,
+            write_timeout=30,
+            connect_timeout=30,
+            http_version='1.1'
+        )
+    # Richiesta separata per il long polling (getUpdates), così non occupa il pool delle altre
+    if updates_request is None:
+        updates_request = network.ResilientRequest(
+            connection_pool_size=1,
+            read_timeout=30,
+            write_timeout=30,
+            connect_timeout=30,
+            http_version='1.1'
+        )
 
     # 2. Costruzione App
-    app = (
+    builder = (
         ApplicationBuilder()
         # NOTA: Assicurati che nel tuo config.py la variabile si chiami TOKEN o TELEGRAM_TOKEN
         .token(config.TELEGRAM_TOKEN if hasattr(config, 'TELEGRAM_TOKEN') else config.TOKEN)
-        .request(trequest)
-        .build()
+        .request(request)
+        .get_updates_request(updates_request)
+        # Conversazioni e user_data sopravvivono ai riavvii (salvati su SQLite a blocchi)
+        .persistence(SQLitePersistence(update_interval=config.PERSISTENCE_INTERVAL))
+        .post_init(on_init)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        # Chat diverse in parallelo, ogni chat in ordine (vedi concurrency.py)
+        .concurrent_updates(concurrency.PerChatUpdateProcessor(concurrent_updates or config.CONCURRENT_UPDATES))
     )
+    # Coda con limiti globali e per chat: niente più RetryAfter quando molti gruppi sono attivi
+    if rate_limiter is not None:
+        builder = builder.rate_limiter(rate_limiter)
+    app = builder.build()
 
-    # --- REGISTRAZIONE DEL KILLER (Error Handler) ---
+    # --- REGISTRAZIONE ERROR HANDLER ---
     app.add_error_handler(global_error_handler)
 
     # --- CONVERSATION CATEGORIE ---
+    # I pulsanti sono smistati da callbacks.ActionHandler: una ricerca nel trie dei prefissi per
+    # callback, poi il callback associato alla Route (niente catene di regex)
     conv_cat = ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(categories.ask_category_name, pattern='^add_cat$'),
-            CallbackQueryHandler(categories.list_categories_for_edit, pattern='^edit_cat_list$')
+            ActionHandler({
+                callbacks.ADD_CATEGORY: categories.ask_category_name,
+                callbacks.EDIT_CATEGORY_LIST: categories.list_categories_for_edit,
+            })
         ],
         states={
             constants.INSERIMENTO_NOME_CATEGORIA: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, categories.save_category),
-                CallbackQueryHandler(categories.menu_categorie, pattern='^back_to_cat_menu$')
+                ActionHandler({callbacks.BACK_TO_CATEGORY_MENU: categories.menu_categorie})
             ],
             constants.SCELTA_DOPO_CATEGORIA: [
-                CallbackQueryHandler(categories.ask_category_name, pattern='^add_cat$'),
-                CallbackQueryHandler(categories.menu_categorie, pattern='^back_to_cat_menu$')
+                ActionHandler({
+                    callbacks.ADD_CATEGORY: categories.ask_category_name,
+                    callbacks.BACK_TO_CATEGORY_MENU: categories.menu_categorie,
+                })
             ],
             constants.MODIFICA_CATEGORIA: [
-                CallbackQueryHandler(categories.show_category_panel, pattern='^sel_edit_cat_'),
-                CallbackQueryHandler(categories.menu_categorie, pattern='^back_to_cat_menu$'),
-                CallbackQueryHandler(categories.list_categories_for_edit, pattern='^edit_cat_list$')
+                ActionHandler({
+                    callbacks.EDIT_CATEGORY: categories.show_category_panel,
+                    callbacks.EDIT_CATEGORY_PAGE: categories.list_categories_for_edit,
+                    callbacks.BACK_TO_CATEGORY_MENU: categories.menu_categorie,
+                    callbacks.EDIT_CATEGORY_LIST: categories.list_categories_for_edit,
+                })
             ],
             constants.AZIONI_CATEGORIA: [
-                CallbackQueryHandler(categories.handle_category_actions, pattern='^(act_cat_|edit_cat_list)')
+                ActionHandler({
+                    callbacks.RENAME_CATEGORY: categories.handle_category_actions,
+                    callbacks.DELETE_CATEGORY: categories.handle_category_actions,
+                    callbacks.EDIT_CATEGORY_LIST: categories.handle_category_actions,
+                })
             ],
             constants.RINOMINA_CATEGORIA: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, categories.save_renamed_category),
-                CallbackQueryHandler(categories.handle_category_actions, pattern='^back_to_cat_panel$')
+                ActionHandler({callbacks.BACK_TO_CATEGORY_PANEL: categories.handle_category_actions})
             ]
         },
         fallbacks=[CommandHandler('cancel', common.cancel)],
-        per_message=False
+        per_message=False,
+        name='conv_categorie',
+        persistent=True
     )
 
     # --- CONVERSATION PRODOTTI ---
     conv_prod = ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(products.step_1_ask_category, pattern='^add_prod_start$'),
-            CallbackQueryHandler(products.start_modify_flow, pattern='^mod_start$')
+            ActionHandler({
+                callbacks.ADD_PRODUCT: products.step_1_ask_category,
+                callbacks.MODIFY_START: products.start_modify_flow,
+            }),
+            # Ricerca: /find e link diretti al pannello (/start prod_<id>, dai risultati inline)
+            CommandHandler('find', search.find_command),
+            CommandHandler('start', search.open_product_link, filters.Regex(rf'^/start {search.LINK_PREFIX}\d+$'))
         ],
         states={
             constants.SCELTA_CATEGORIA_PRODOTTO: [
-                CallbackQueryHandler(products.step_2_ask_name, pattern='^sel_cat_'),
-                CallbackQueryHandler(products.menu_prodotti, pattern='^menu_prodotti$')
+                ActionHandler({
+                    callbacks.PICK_CATEGORY: products.step_2_ask_name,
+                    callbacks.PICK_CATEGORY_PAGE: products.step_1_ask_category,
+                    callbacks.MENU_PRODUCTS: products.menu_prodotti,
+                })
             ],
             constants.NOME_PRODOTTO: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, products.step_3_ask_qty),
-                CallbackQueryHandler(products.step_1_ask_category, pattern='^back_to_step_1$')
+                ActionHandler({callbacks.BACK_TO_STEP_1: products.step_1_ask_category})
             ],
             constants.QUANTITA_PRODOTTO: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, products.step_4_ask_threshold),
-                CallbackQueryHandler(products.step_2_ask_name, pattern='^back_to_step_2$')
+                ActionHandler({callbacks.BACK_TO_STEP_2: products.step_2_ask_name})
             ],
             constants.SOGLIA_PRODOTTO: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, products.step_5_save_final),
-                CallbackQueryHandler(products.step_3_ask_qty, pattern='^back_to_step_3$')
+                ActionHandler({callbacks.BACK_TO_STEP_3: products.step_3_ask_qty})
             ],
             constants.FINE_PRODOTTO: [
-                CallbackQueryHandler(products.step_1_ask_category, pattern='^add_prod_start$'),
-                CallbackQueryHandler(common.start, pattern='^main_menu$')
+                ActionHandler({
+                    callbacks.ADD_PRODUCT: products.step_1_ask_category,
+                    callbacks.MAIN_MENU: common.start,
+                })
             ],
             constants.MODIFICA_PRODOTTO: [
-                CallbackQueryHandler(products.manage_product_selection,
-                                     pattern='^(mod_cat_|mod_prod_|act_|back_to_prod_list)'),
-                CallbackQueryHandler(products.start_modify_flow, pattern='^mod_start$'),
-                CallbackQueryHandler(products.menu_prodotti, pattern='^menu_prodotti$')
+                ActionHandler({
+                    callbacks.OPEN_CATEGORY: products.open_category,
+                    callbacks.PRODUCT_PAGE: products.product_page,
+                    callbacks.BACK_TO_PRODUCT_LIST: products.back_to_product_list,
+                    callbacks.OPEN_PRODUCT: products.open_product,
+                    callbacks.ADJUST_STOCK: products.tap_adjust,
+                    callbacks.ADJUST_THRESHOLD: products.tap_adjust,
+                    callbacks.MOVE_START: products.move_start,
+                    callbacks.MOVE_PAGE: products.move_page,
+                    callbacks.MOVE_TO: products.move_to,
+                    callbacks.DELETE_PRODUCT: products.delete_product,
+                    callbacks.MODIFY_START: products.start_modify_flow,
+                    callbacks.MODIFY_CATEGORY_PAGE: products.start_modify_flow,
+                    callbacks.MENU_PRODUCTS: products.menu_prodotti,
+                })
             ]
         },
         fallbacks=[CommandHandler('cancel', common.cancel),
-                   CallbackQueryHandler(common.cancel, pattern='^cancel_flow$')],
-        per_message=False
+                   ActionHandler({callbacks.CANCEL_FLOW: common.cancel})],
+        per_message=False,
+        name='conv_prodotti',
+        persistent=True,
+        # /find e i link diretti funzionano anche a conversazione già iniziata
+        allow_reentry=True
     )
 
     # Aggiunta Handlers
+    # Gruppo -1: prima di tutto il resto, i tocchi ➕/➖ in attesa nella chat vengono scritti
+    app.add_handler(TypeHandler(Update, products.flush_pending_taps), group=-1)
     app.add_handler(conv_cat)
     app.add_handler(conv_prod)
 
     app.add_handler(CommandHandler("start", common.start))
     app.add_handler(CommandHandler("cancel", common.cancel))
 
-    # Menu Navigations
-    app.add_handler(CallbackQueryHandler(common.start, pattern='^main_menu$'))
-    app.add_handler(CallbackQueryHandler(categories.menu_categorie, pattern='^menu_categorie$'))
-    app.add_handler(CallbackQueryHandler(products.menu_prodotti, pattern='^menu_prodotti$'))
+    # Importazione in blocco: /add con un prodotto per riga, oppure un file CSV/JSON
+    app.add_handler(CommandHandler("add", imports.bulk_add))
+    app.add_handler(MessageHandler(filters.Document.FileExtension("csv") | filters.Document.FileExtension("json"),
+                                   imports.import_document))
+    app.add_handler(CommandHandler("export", export.export_inventory))
+    app.add_handler(InlineQueryHandler(search.inline_search))
+    # Statistiche di latenza, solo per gli amministratori (gli altri non ricevono risposta)
+    app.add_handler(CommandHandler("stats", admin.stats_command, filters.User(user_id=config.ADMIN_IDS)))
+
+    # Menu e viste
+    app.add_handler(ActionHandler({
+        callbacks.MAIN_MENU: common.start,
+        callbacks.MENU_CATEGORIES: categories.menu_categorie,
+        callbacks.MENU_PRODUCTS: products.menu_prodotti,
+        callbacks.FULL_INVENTORY: products.show_full_inventory,
+        callbacks.SHOPPING_LIST: products.show_shopping_list,
+        callbacks.PRINT_SHOPPING_LIST: products.print_shopping_list_text,
+        callbacks.PRINT_FULL_INVENTORY: products.print_full_inventory_text,
+    }))
+    # Ultimo: pulsanti che nessuno ha riconosciuto (vecchi messaggi, flusso già chiuso)
+    app.add_handler(CallbackQueryHandler(common.stale_button))
+
+    # Riepilogo periodico dei prodotti in esaurimento
+    notifications.schedule_digest(app.job_queue)
 
-    # Views & Prints
-    app.add_handler(CallbackQueryHandler(products.show_full_inventory, pattern='^show_full_inventory$'))
-    app.add_handler(CallbackQueryHandler(products.show_shopping_list, pattern='^show_shopping_list$'))
-    app.add_handler(CallbackQueryHandler(products.print_shopping_list_text, pattern='^print_shopping_list$'))
-    app.add_handler(CallbackQueryHandler(products.print_full_inventory_text, pattern='^print_full_inventory$'))
+    # Tempi di ogni handler per /stats e /metrics, più le statistiche già raccolte altrove
+    metrics.instrument(app)
+    metrics.gauge_sources.update({
+        'inventory_cache': cache.inventory.stats,
+        'render_cache': cache.rendered.stats,
+        'network': lambda: dict(network.stats),
+        'ratelimit': ratelimit.limiter.stats,
+        'taps': products.stock_taps.stats,
+        'updates': app.update_processor.stats,
+        'callbacks': lambda: dict(callbacks.stats),
+        'edits': edits.tracker.stats,
+    })
+
+    return app
+
+
+def main():
+    # Init Database
+    database.init_db()
+    app = build_application()
 
     print("🚀 HomeStock è in esecuzione...")
     print("Premi Ctrl+C per fermare lo script start.sh")
 
     # 3. AVVIO CON GESTIONE CRASH
-    # Usiamo run_polling "pulito" perché la gestione errori è delegata a global_error_handler
-    # Tuttavia, teniamo il try/except esterno per catturare errori in fase di avvio iniziale.
+    # Webhook se configurato, altrimenti polling "pulito" (la gestione errori è delegata a global_error_handler).
+    # Teniamo comunque il try/except esterno per catturare errori in fase di avvio iniziale.
     try:
-        app.run_polling(allowed_updates=Update.ALL_TYPES)
+        if config.WEBHOOK_URL:
+            app.run_webhook(
+                listen=config.WEBHOOK_LISTEN,
+                port=config.WEBHOOK_PORT,
+                url_path=config.WEBHOOK_PATH,
+                webhook_url=f"{config.WEBHOOK_URL.rstrip('/')}/{config.WEBHOOK_PATH}",
+                secret_token=config.WEBHOOK_SECRET,
+                allowed_updates=ALLOWED_UPDATES
+            )
+        else:
+            app.run_polling(allowed_updates=ALLOWED_UPDATES)
     except Exception as e:
         print(f"\n❌ ERRORE FATALE MAIN: {e}")
         # Se capita qualcosa qui, forziamo l'uscita per start.sh
-        os._exit(1)
\ No newline at end of file
+        os._exit(1)
+
+
+if __name__ == '__main__':
+    main()
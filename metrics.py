@@ -0,0 +1,215 @@
+"""
+Metriche in memoria: tempi degli handler e delle query SQLite.
+
+- Histogram: istogramma a bucket fissi (come Prometheus), con percentili approssimati.
+- handlers / queries: un istogramma per handler e uno per query (testo normalizzato),
+  più il numero di righe lette/scritte da ogni query.
+- timed(): avvolge un callback di un handler e ne misura la durata; instrument(app)
+  lo applica a tutti gli handler registrati (anche dentro le ConversationHandler).
+- render_prometheus(): tutto in formato testo Prometheus; start_http_server() lo espone
+  su /metrics (opzionale, vedi config.METRICS_PORT).
+"""
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from telegram.ext import ConversationHandler
+
+import callbacks
+
+logger = logging.getLogger(__name__)
+
+# Limiti superiori dei bucket, in secondi
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MAX_QUERY_LABEL = 120  # Caratteri del testo della query usati come etichetta
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # L'ultimo è +Inf
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Percentile approssimato: limite superiore del bucket che lo contiene"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            'p50_ms': round(self.quantile(0.50) * 1000, 2),
+            'p95_ms': round(self.quantile(0.95) * 1000, 2),
+            'p99_ms': round(self.quantile(0.99) * 1000, 2),
+            'max_ms': round(self.max * 1000, 2),
+        }
+
+
+_lock = threading.Lock()  # Le query arrivano dai thread di repository.py
+handlers = defaultdict(Histogram)
+queries = defaultdict(Histogram)
+query_rows = defaultdict(int)
+
+# Altre statistiche da esporre (es. cache, rete): nome -> funzione che restituisce un dict di numeri
+gauge_sources = {}
+
+
+# --- REGISTRAZIONE ---
+
+def observe_handler(name, seconds):
+    with _lock:
+        handlers[name].observe(seconds)
+
+
+def observe_query(sql, seconds, rows):
+    label = " ".join(sql.split())[:MAX_QUERY_LABEL]
+    with _lock:
+        queries[label].observe(seconds)
+        query_rows[label] += rows
+
+
+def timed(callback):
+    """Callback di un handler con misura della durata (il valore restituito resta lo stesso)"""
+    name = f"{callback.__module__.rsplit('.', 1)[-1]}.{callback.__name__}"
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            observe_handler(name, time.perf_counter() - start)
+
+    return wrapper
+
+
+def instrument(app):
+    """Misura tutti gli handler registrati nell'Application, anche quelli delle conversazioni"""
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for inner in handler.entry_points + handler.fallbacks:
+                wrap(inner)
+            for state_handlers in handler.states.values():
+                for inner in state_handlers:
+                    wrap(inner)
+        elif isinstance(handler, callbacks.ActionHandler):
+            # Un handler smista più azioni: si misurano i singoli callback
+            handler.callbacks = {route: cb if getattr(cb, '__wrapped__', None) else timed(cb)
+                                 for route, cb in handler.callbacks.items()}
+        elif not getattr(handler.callback, '__wrapped__', None):
+            handler.callback = timed(handler.callback)
+
+    for group in app.handlers.values():
+        for handler in group:
+            wrap(handler)
+
+
+# --- LETTURA ---
+
+def snapshot(top=10):
+    """Riassunto per /stats: handler per p95 e query per tempo totale, i più lenti prima"""
+    with _lock:
+        by_handler = sorted(handlers.items(), key=lambda item: item[1].quantile(0.95), reverse=True)
+        by_query = sorted(queries.items(), key=lambda item: item[1].total, reverse=True)
+        return {
+            'handlers': {name: h.summary() for name, h in by_handler[:top]},
+            'queries': {sql: {**h.summary(), 'rows': query_rows[sql], 'total_ms': round(h.total * 1000, 1)}
+                        for sql, h in by_query[:top]},
+        }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(metric, label, histograms):
+    lines = [f"# TYPE {metric} histogram"]
+    for key, h in histograms.items():
+        tag = f'{label}="{_escape(key)}"'
+        cumulative = 0
+        for bound, n in zip(h.buckets, h.counts):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{{tag},le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{{tag},le="+Inf"}} {h.count}')
+        lines.append(f'{metric}_sum{{{tag}}} {h.total}')
+        lines.append(f'{metric}_count{{{tag}}} {h.count}')
+    return lines
+
+
+def render_prometheus():
+    with _lock:
+        lines = _histogram_lines('homestock_handler_seconds', 'handler', handlers)
+        lines += _histogram_lines('homestock_query_seconds', 'query', queries)
+        lines.append("# TYPE homestock_query_rows_total counter")
+        lines += [f'homestock_query_rows_total{{query="{_escape(sql)}"}} {rows}' for sql, rows in query_rows.items()]
+
+    for source, collect in gauge_sources.items():
+        for key, value in collect().items():
+            # Un livello di annidamento (es. statistiche per priorità)
+            values = value.items() if isinstance(value, dict) else [(None, value)]
+            for sub, number in values:
+                if isinstance(number, bool) or not isinstance(number, (int, float)):
+                    continue
+                name = "_".join(part for part in ('homestock', source, key, sub) if part)
+                lines.append(f"{name} {number}")
+    return "\n".join(lines) + "\n"
+
+
+# --- ENDPOINT HTTP ---
+
+async def _serve(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Il resto della richiesta (header) non ci serve
+        while (await reader.readline()).strip():
+            pass
+        path = request_line.split()[1].decode() if len(request_line.split()) > 1 else ""
+        if path == '/metrics':
+            status, body = "200 OK", render_prometheus().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+_server = None
+
+
+async def start_http_server(host, port):
+    """Espone GET /metrics in formato Prometheus (solo in locale, di default)"""
+    global _server
+    _server = await asyncio.start_server(_serve, host, port)
+    logger.info(f"📈 Metriche su http://{host}:{port}/metrics")
+
+
+async def stop_http_server():
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
@@ -0,0 +1,115 @@
+"""
+Recupero dagli errori di rete senza riavviare il processo.
+
+- ResilientRequest: il layer HTTP del bot. Ripete le chiamate fallite per problemi di rete
+  quando è sicuro farlo, aspettando un backoff esponenziale con jitter.
+- CircuitBreaker: conta i fallimenti consecutivi. Oltre OPEN_AFTER il circuito è "aperto"
+  e ogni chiamata aspetta il backoff prima di partire; superato il budget si esce
+  davvero (start.sh riavvia il bot).
+- stats: contatori di quante volte scatta ogni ramo.
+"""
+import asyncio
+import logging
+import random
+from collections import Counter
+
+import httpx
+from telegram.error import NetworkError
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 3        # Tentativi extra per una singola chiamata
+BACKOFF_BASE = 0.5     # Secondi del primo backoff (poi raddoppia)
+BACKOFF_CAP = 30       # Backoff massimo in secondi
+OPEN_AFTER = 3         # Fallimenti consecutivi dopo cui il circuito si apre
+FAILURE_BUDGET = 50    # Fallimenti consecutivi tollerati prima dell'uscita forzata
+
+# Chiamate idempotenti: ripeterle non produce doppioni in chat.
+# Le altre (es. sendMessage) si ripetono solo se la richiesta non è mai partita.
+SAFE_TO_RETRY = {
+    'getMe', 'getChat', 'getFile', 'getWebhookInfo', 'setWebhook', 'deleteWebhook',
+    'editMessageText', 'editMessageReplyMarkup', 'deleteMessage', 'answerCallbackQuery',
+    'answerInlineQuery',
+}
+# getUpdates ha già il suo ciclo di retry nell'Updater: qui la contiamo soltanto
+NO_RETRY = {'getUpdates'}
+
+# Errori per cui la richiesta non ha mai raggiunto Telegram
+_NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+stats = Counter()
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Backoff esponenziale con "full jitter": casuale tra 0 e base * 2^attempt (massimo cap)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    def __init__(self, open_after=OPEN_AFTER, failure_budget=FAILURE_BUDGET):
+        self.open_after = open_after
+        self.failure_budget = failure_budget
+        self.consecutive_failures = 0
+
+    @property
+    def is_open(self):
+        return self.consecutive_failures >= self.open_after
+
+    @property
+    def exhausted(self):
+        return self.consecutive_failures >= self.failure_budget
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        stats['failures'] += 1
+        if self.consecutive_failures == self.open_after:
+            stats['circuit_opened'] += 1
+            logger.warning(f"🔌 Circuito aperto dopo {self.open_after} errori di rete consecutivi")
+
+    def record_success(self):
+        if self.is_open:
+            stats['circuit_closed'] += 1
+            logger.info("🔌 Rete tornata disponibile, circuito chiuso")
+        self.consecutive_failures = 0
+
+
+breaker = CircuitBreaker()
+
+
+class ResilientRequest(HTTPXRequest):
+    """HTTPXRequest che ripete le chiamate fallite per errori di rete, quando è sicuro farlo"""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        attempt = 0
+        while True:
+            # Circuito aperto: non martelliamo la rete, aspettiamo prima di riprovare
+            if breaker.is_open:
+                stats['backoff_waits'] += 1
+                await asyncio.sleep(backoff_delay(breaker.consecutive_failures - breaker.open_after))
+            try:
+                result = await super().do_request(url, method, request_data, *args, **kwargs)
+            except NetworkError as exc:
+                breaker.record_failure()
+                stats['network_errors'] += 1
+                if not self._can_retry(endpoint, exc) or attempt >= MAX_RETRIES:
+                    stats['gave_up'] += 1
+                    raise
+                attempt += 1
+                stats['retries'] += 1
+                delay = backoff_delay(attempt)
+                logger.warning(f"🔁 {endpoint}: {exc} - nuovo tentativo {attempt}/{MAX_RETRIES} tra {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            breaker.record_success()
+            if attempt:
+                stats['retry_success'] += 1
+            return result
+
+    @staticmethod
+    def _can_retry(endpoint, exc):
+        if endpoint in NO_RETRY:
+            return False
+        return endpoint in SAFE_TO_RETRY or isinstance(exc.__cause__, _NOT_SENT)
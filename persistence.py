@@ -0,0 +1,160 @@
+"""
+Persistenza del bot su SQLite (stesso database dell'inventario).
+
+Salva gli stati delle ConversationHandler e user_data/chat_data, così un riavvio
+non fa perdere a nessuno l'inserimento di un prodotto lasciato a metà.
+
+- Scritture a blocchi: l'Application passa le modifiche ogni `update_interval` secondi;
+  qui le accumuliamo e le scriviamo tutte insieme in una sola transazione.
+- Caricamento pigro: all'avvio si leggono solo gli stati delle conversazioni (poche righe);
+  user_data e chat_data di una chat si leggono la prima volta che la chat scrive al bot.
+"""
+import asyncio
+import sqlite3
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import repository
+
+UPDATE_INTERVAL = 30  # Secondi tra un salvataggio e l'altro
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, update_interval=UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self._loaded_users = set()
+        self._loaded_chats = set()
+        self._loading_users = {}  # Caricamenti in corso: id -> task
+        self._loading_chats = {}
+        self._reset_pending()
+        self._write_task = None
+        self._write_lock = asyncio.Lock()
+
+    def _reset_pending(self):
+        self._conversations = {}
+        self._user_data = {}
+        self._chat_data = {}
+        self._dropped_users = set()
+        self._dropped_chats = set()
+
+    # --- CARICAMENTO ---
+
+    async def get_user_data(self):
+        # Niente caricamento completo all'avvio: vedi refresh_user_data
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return await repository.load_conversations(name)
+
+    async def refresh_user_data(self, user_id, user_data):
+        """Chiamato prima di ogni update: la prima volta carichiamo i dati salvati di questo utente"""
+        await self._refresh(self._loaded_users, self._loading_users, user_id, user_data, repository.load_user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refresh(self._loaded_chats, self._loading_chats, chat_id, chat_data, repository.load_chat_data)
+
+    async def _refresh(self, loaded, loading, key, data, load):
+        # Gli update di chat diverse girano in parallelo (anche dello stesso utente): chi arriva
+        # mentre il caricamento è in corso aspetta lo stesso task, invece di partire con i dati vuoti.
+        # Segnato come caricato solo alla fine; se fallisce si riprova all'update successivo
+        if key in loaded:
+            return
+        task = loading.get(key)
+        if task is None:
+            task = loading[key] = asyncio.ensure_future(self._load(loaded, key, data, load))
+            task.add_done_callback(lambda _: loading.pop(key, None))
+        # shield: se l'update che aspetta viene annullato il caricamento continua per gli altri
+        await asyncio.shield(task)
+
+    @staticmethod
+    async def _load(loaded, key, data, load):
+        for name, value in (await load(key)).items():
+            data.setdefault(name, value)
+        loaded.add(key)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # --- AGGIORNAMENTI (solo in memoria, scritti a blocchi) ---
+
+    async def update_conversation(self, name, key, new_state):
+        self._conversations[(name, key)] = new_state
+        self._schedule_write()
+
+    async def update_user_data(self, user_id, data):
+        self._user_data[user_id] = data
+        self._dropped_users.discard(user_id)
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id, data):
+        self._chat_data[chat_id] = data
+        self._dropped_chats.discard(chat_id)
+        self._schedule_write()
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._user_data.pop(user_id, None)
+        self._dropped_users.add(user_id)
+        self._schedule_write()
+
+    async def drop_chat_data(self, chat_id):
+        self._chat_data.pop(chat_id, None)
+        self._dropped_chats.add(chat_id)
+        self._schedule_write()
+
+    # --- SCRITTURA ---
+
+    def _schedule_write(self):
+        # L'Application chiama tutti gli update_* insieme: la scrittura parte quando hanno finito
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self.write_pending())
+
+    async def write_pending(self):
+        """Scrive in una sola transazione tutte le modifiche accumulate"""
+        async with self._write_lock:
+            if not (self._conversations or self._user_data or self._chat_data
+                    or self._dropped_users or self._dropped_chats):
+                return
+            conversations = [(name, key, state) for (name, key), state in self._conversations.items()]
+            user_data, chat_data = self._user_data, self._chat_data
+            dropped_users, dropped_chats = self._dropped_users, self._dropped_chats
+            self._reset_pending()
+            try:
+                # I dati non serializzabili li scarta save_bot_state (con un log), senza fermare il resto
+                await repository.save_bot_state(conversations, user_data, chat_data, dropped_users, dropped_chats)
+            except (sqlite3.Error, OSError):
+                # Errore del database o del disco: rimettiamo in coda quello che non è stato scritto
+                # (senza coprire modifiche più recenti) e si riprova al prossimo salvataggio.
+                # Gli altri errori (bug) non si risolverebbero riprovando: salgono senza rimettere in coda
+                for name, key, state in conversations:
+                    self._conversations.setdefault((name, key), state)
+                for user_id, data in user_data.items():
+                    self._user_data.setdefault(user_id, data)
+                for chat_id, data in chat_data.items():
+                    self._chat_data.setdefault(chat_id, data)
+                self._dropped_users |= dropped_users - self._user_data.keys()
+                self._dropped_chats |= dropped_chats - self._chat_data.keys()
+                raise
+
+    async def flush(self):
+        """Chiamato allo spegnimento, dopo l'ultimo giro di update_*"""
+        if self._write_task is not None:
+            await asyncio.gather(self._write_task, return_exceptions=True)
+        await self.write_pending()
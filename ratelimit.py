@@ -0,0 +1,221 @@
+"""
+Limite alle chiamate verso Telegram, prima che sia Telegram a bloccarci (RetryAfter).
+
+- Un "secchio di gettoni" globale (~30 messaggi/s) e uno per chat
+  (~20 messaggi/min nei gruppi, ~1/s nelle chat private).
+- Le modifiche ai messaggi (tastiere, pannelli) hanno un secchio per chat tutto loro:
+  altrimenti pochi tocchi sui pulsanti esaurirebbero il limite dei messaggi nuovi.
+- Chi aspetta è in coda per priorità: le risposte a un utente (INTERACTIVE) passano
+  davanti agli invii massivi (BULK: notifiche, export...), che si segnalano con
+  rate_limit_args=ratelimit.BULK nelle chiamate al bot.
+- Se arriva comunque un RetryAfter, la chat (o tutto il bot) resta ferma per il tempo
+  richiesto e la chiamata viene ripetuta.
+- stats(): coda attuale e massima, attese medie/massime per priorità, RetryAfter ricevuti.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0  # Risposte dirette a un utente
+BULK = 1         # Invii che possono aspettare
+
+GLOBAL_RATE = 30         # Messaggi al secondo su tutto il bot
+GROUP_RATE = 20 / 60     # Messaggi al secondo in un gruppo
+GROUP_BURST = 20
+PRIVATE_RATE = 1         # Messaggi al secondo in una chat privata
+PRIVATE_BURST = 5
+EDIT_RATE = 3            # Modifiche al secondo in una chat, a parte dai messaggi nuovi
+EDIT_BURST = 10
+MAX_RETRIES = 2          # Tentativi extra dopo un RetryAfter
+MAX_IDLE_GATES = 5000    # Oltre, le chat ferme vengono dimenticate
+
+# Chiamate che non consumano il limite della chat (non inviano messaggi)
+NO_CHAT_LIMIT = {'answerCallbackQuery', 'answerInlineQuery', 'getMe', 'getChat', 'getFile'}
+# Chiamate che usano il secchio delle modifiche invece di quello dei messaggi
+EDITS = {'editMessageText', 'editMessageReplyMarkup', 'editMessageCaption', 'editMessageMedia', 'deleteMessage'}
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Secondi da aspettare prima che ci sia un gettone (0 se disponibile subito)"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    @property
+    def idle(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst and time.monotonic() >= self.blocked_until
+
+
+class _Gate:
+    """Un secchio con la sua coda di attesa ordinata per priorità (a parità, in ordine di arrivo)"""
+
+    def __init__(self, rate, burst, limiter):
+        self.bucket = TokenBucket(rate, burst)
+        self._limiter = limiter
+        self._waiters = []
+        self._task = None
+
+    @property
+    def idle(self):
+        return not self._waiters and self.bucket.idle
+
+    async def acquire(self, priority):
+        if not self._waiters and self.bucket.wait_time() == 0:
+            self.bucket.take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._limiter.sequence), future))
+        self._limiter.waiting(+1)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+        try:
+            await future
+        finally:
+            self._limiter.waiting(-1)
+
+    async def _drain(self):
+        while self._waiters:
+            delay = self.bucket.wait_time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():  # Chiamata annullata nel frattempo
+                continue
+            self.bucket.take()
+            future.set_result(None)
+
+    def pause(self, seconds):
+        self.bucket.blocked_until = max(self.bucket.blocked_until, time.monotonic() + seconds)
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+        for _, _, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+
+class RateLimiter(BaseRateLimiter[int]):
+    def __init__(self, global_rate=GLOBAL_RATE, max_retries=MAX_RETRIES):
+        self.max_retries = max_retries
+        self.sequence = itertools.count()
+        self._global = _Gate(global_rate, global_rate, self)
+        self._chats = {}
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.counts = Counter()
+        self.wait_total = Counter()
+        self.wait_max = Counter()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        self._global.cancel()
+        for gate in self._chats.values():
+            gate.cancel()
+        self._chats.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = BULK if rate_limit_args == BULK else INTERACTIVE
+        chat_id = data.get('chat_id') if endpoint not in NO_CHAT_LIMIT else None
+        chat_gate = self._chat_gate(chat_id, endpoint in EDITS) if chat_id is not None else None
+
+        retries = 0
+        while True:
+            started = time.monotonic()
+            if chat_gate is not None:
+                await chat_gate.acquire(priority)
+            await self._global.acquire(priority)
+            self._record_wait(priority, time.monotonic() - started)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                delay = exc.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                self.counts['retry_after'] += 1
+                # Limite di una chat se la chiamata ne aveva una, altrimenti di tutto il bot
+                (chat_gate or self._global).pause(delay)
+                if retries >= self.max_retries:
+                    self.counts['retry_after_gave_up'] += 1
+                    raise
+                retries += 1
+                logger.warning(f"⏳ {endpoint}: RetryAfter {delay}s (chat {chat_id}), nuovo tentativo {retries}/{self.max_retries}")
+
+    def _chat_gate(self, chat_id, edit=False):
+        key = (chat_id, edit)
+        gate = self._chats.get(key)
+        if gate is None:
+            if len(self._chats) >= MAX_IDLE_GATES:
+                self._chats = {k: g for k, g in self._chats.items() if not g.idle}
+            if edit:
+                gate = _Gate(EDIT_RATE, EDIT_BURST, self)
+            elif isinstance(chat_id, int) and chat_id < 0:  # Gli ID dei gruppi sono negativi
+                gate = _Gate(GROUP_RATE, GROUP_BURST, self)
+            else:
+                gate = _Gate(PRIVATE_RATE, PRIVATE_BURST, self)
+            self._chats[key] = gate
+        return gate
+
+    # --- METRICHE ---
+
+    def waiting(self, delta):
+        self.queue_depth += delta
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def _record_wait(self, priority, seconds):
+        name = 'bulk' if priority == BULK else 'interactive'
+        self.counts[name] += 1
+        self.wait_total[name] += seconds
+        self.wait_max[name] = max(self.wait_max[name], seconds)
+
+    def stats(self):
+        waits = {
+            name: {
+                'requests': self.counts[name],
+                'avg_wait': self.wait_total[name] / self.counts[name] if self.counts[name] else 0.0,
+                'max_wait': self.wait_max[name],
+            }
+            for name in ('interactive', 'bulk')
+        }
+        return {
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'retry_after': self.counts['retry_after'],
+            'retry_after_gave_up': self.counts['retry_after_gave_up'],
+            **waits,
+        }
+
+
+# Istanza unica: main.py la passa all'ApplicationBuilder, gli altri moduli ne leggono le statistiche
+limiter = RateLimiter()
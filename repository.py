@@ -0,0 +1,98 @@
+"""
+Versione asincrona del layer database.
+
+Gli handler sono async: se chiamassero direttamente le funzioni di database.py,
+una query lenta bloccherebbe l'event loop e quindi tutte le altre chat.
+Qui ogni funzione viene eseguita su thread dedicati:
+- un solo thread scrittore (SQLite accetta comunque uno scrittore alla volta),
+- un piccolo pool di lettori (in WAL leggono in parallelo allo scrittore).
+Ogni thread usa la propria connessione persistente (vedi database.get_connection).
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+READER_THREADS = 4
+
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+_readers = ThreadPoolExecutor(max_workers=READER_THREADS, thread_name_prefix="db-reader")
+
+
+def _run_on(executor, func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+    return wrapper
+
+
+def _read(func):
+    return _run_on(_readers, func)
+
+
+def _write(func):
+    return _run_on(_writer, func)
+
+
+def shutdown():
+    """Attende le operazioni in corso, ferma i thread e chiude le connessioni"""
+    _writer.shutdown(wait=True)
+    _readers.shutdown(wait=True)
+    database.close_connections()
+
+
+init_db = _write(database.init_db)
+
+# --- CATEGORIE ---
+add_category = _write(database.add_category)
+get_categories = _read(database.get_categories)
+get_category_by_id = _read(database.get_category_by_id)
+update_category_name = _write(database.update_category_name)
+delete_category = _write(database.delete_category)
+
+# --- PRODOTTI ---
+add_product = _write(database.add_product)
+import_products = _write(database.import_products)
+get_products = _read(database.get_products)
+get_low_stock_products = _read(database.get_low_stock_products)
+get_shopping_list = _read(database.get_shopping_list)
+get_orphaned_products = _read(database.get_orphaned_products)
+
+# --- MODIFICA PRODOTTI ---
+get_products_by_category = _read(database.get_products_by_category)
+get_product_by_id = _read(database.get_product_by_id)
+update_product_quantity = _write(database.update_product_quantity)
+update_product_threshold = _write(database.update_product_threshold)
+adjust_quantity = _write(database.adjust_quantity)
+adjust_threshold = _write(database.adjust_threshold)
+adjust_product = _write(database.adjust_product)
+update_product_category = _write(database.update_product_category)
+delete_product = _write(database.delete_product)
+
+# --- SCHERMATE ---
+get_product_panel = _read(database.get_product_panel)
+get_category_panel = _read(database.get_category_panel)
+get_category_overview = _read(database.get_category_overview)
+
+# --- PAGINAZIONE ---
+get_categories_page = _read(database.get_categories_page)
+get_products_page = _read(database.get_products_page)
+
+# --- PERSISTENZA BOT ---
+load_conversations = _read(database.load_conversations)
+load_user_data = _read(database.load_user_data)
+load_chat_data = _read(database.load_chat_data)
+save_bot_state = _write(database.save_bot_state)
+
+# --- RICERCA ---
+search_products = _read(database.search_products)
+
+# --- EXPORT ---
+export_products = _read(database.export_products)
+
+# --- NOTIFICHE ---
+get_all_shopping_lists = _read(database.get_all_shopping_lists)
+get_digest_fingerprints = _read(database.get_digest_fingerprints)
+save_digest_fingerprints = _write(database.save_digest_fingerprints)
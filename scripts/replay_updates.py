@@ -0,0 +1,54 @@
+"""
+Invia al webhook locale degli Update registrati (JSON), come farebbe Telegram.
+
+Serve per provare la modalità webhook end-to-end senza passare dai server di Telegram:
+avvia il bot con WEBHOOK_URL impostato, poi lancia questo script con lo stesso
+WEBHOOK_SECRET. Il file può contenere un singolo Update o una lista di Update.
+
+Uso:  python scripts/replay_updates.py scripts/sample_updates.json [--delay 0.5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help="File JSON con uno o più Update")
+    parser.add_argument('--url', default=None, help="Endpoint (default: http://WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH)")
+    parser.add_argument('--secret', default=os.getenv("WEBHOOK_SECRET"), help="Secret token (default: WEBHOOK_SECRET)")
+    parser.add_argument('--delay', type=float, default=0.0, help="Pausa tra un Update e l'altro (secondi)")
+    args = parser.parse_args()
+
+    url = args.url or "http://{}:{}/{}".format(
+        os.getenv("WEBHOOK_LISTEN", "127.0.0.1"), os.getenv("WEBHOOK_PORT", 8443), os.getenv("WEBHOOK_PATH", "telegram"))
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+
+    updates = []
+    for path in args.files:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        updates.extend(data if isinstance(data, list) else [data])
+
+    with httpx.Client(timeout=10) as client:
+        for update in updates:
+            start = time.perf_counter()
+            response = client.post(url, json=update, headers=headers)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"update_id={update.get('update_id')} -> HTTP {response.status_code} ({elapsed:.1f} ms)")
+            if args.delay:
+                time.sleep(args.delay)
+
+
+if __name__ == '__main__':
+    main()
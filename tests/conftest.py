@@ -0,0 +1,41 @@
+import os
+import sys
+import warnings
+
+import pytest
+from telegram.warnings import PTBUserWarning
+
+# I moduli del bot stanno nella radice del repo; config vuole un token anche se non si parla con Telegram
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_TOKEN", "123:test")
+
+import cache  # noqa: E402
+import database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Database vuoto e migrato in una cartella temporanea, cache compresa"""
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "homestock.db"))
+    cache.inventory.clear()
+    database.init_db()
+    yield database
+    database.close_connections()
+    cache.inventory.clear()
+
+
+@pytest.fixture
+def app(db, monkeypatch):
+    """
+    Application con tutti gli handler, senza rete (StubRequest di benchmarks/load_test.py, chiamate
+    contate in app.bot.request.calls) e senza limiti di invio. Nel test: `async with app:` e process_update().
+    """
+    import edits
+    import main
+    from benchmarks.load_test import StubRequest
+
+    # Le modifiche già viste da altri test non devono essere saltate
+    monkeypatch.setattr(edits, "tracker", edits.EditTracker())
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", PTBUserWarning)  # per_message delle ConversationHandler, voluto
+        return main.build_application(request=StubRequest(), updates_request=StubRequest(), rate_limiter=None)
@@ -0,0 +1,81 @@
+"""
+Tocchi ➕/➖ concorrenti: ogni variazione deve arrivare, senza sovrascritture, e la quantità
+non deve mai scendere sotto zero. La cache deve restare uguale a SQLite.
+"""
+import asyncio
+import random
+import threading
+
+import repository
+
+
+def new_product(db, quantita):
+    db.import_products(1, [("Pasta", quantita, 1.0, "Dispensa")])
+    return db.get_products(1)[0]['id']
+
+
+def stored_quantity(db, product_id):
+    return db.get_connection().execute("SELECT quantita FROM prodotti WHERE id = ?", (product_id,)).fetchone()[0]
+
+
+def test_concurrent_taps(db):
+    product_id = new_product(db, 10.0)
+    deltas = [+1] * 300 + [-1] * 200
+    random.Random(3).shuffle(deltas)
+
+    async def scenario():
+        # Letture in mezzo alle scritture, come farebbero i pannelli delle altre chat
+        await asyncio.gather(*(repository.adjust_product(product_id, quantity_delta=d) for d in deltas),
+                             *(repository.get_product_by_id(product_id) for _ in range(50)))
+        return await repository.get_product_by_id(product_id)
+
+    # 10 + 300 - 200: la quantità non arriva mai vicino a zero, quindi il risultato è esatto
+    prod = asyncio.run(scenario())
+    assert prod['quantita'] == 110.0
+    assert stored_quantity(db, product_id) == 110.0
+
+
+def test_concurrent_taps_stop_at_zero(db):
+    product_id = new_product(db, 5.0)
+
+    async def scenario():
+        await asyncio.gather(*(repository.adjust_product(product_id, quantity_delta=-1) for _ in range(40)))
+        return await repository.adjust_product(product_id, quantity_delta=+1)
+
+    prod = asyncio.run(scenario())
+    assert prod['quantita'] == 1.0
+    assert stored_quantity(db, product_id) == 1.0
+
+
+def test_taps_from_many_threads(db):
+    # Ogni thread col suo event loop (come più processi di handler): le scritture restano in coda
+    # sull'unico thread scrittore, quindi anche la cache le vede nell'ordine di SQLite
+    product_id = new_product(db, 0.0)
+    start = threading.Barrier(8)
+
+    def worker(delta, taps):
+        async def tap():
+            for _ in range(taps):
+                await repository.adjust_product(product_id, quantity_delta=delta)
+        start.wait()
+        asyncio.run(tap())
+
+    def run(deltas, taps):
+        threads = [threading.Thread(target=worker, args=(delta, taps)) for delta in deltas]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return stored_quantity(db, product_id)
+
+    quantita = run([+1, -1] * 4, 50)
+    # Con lo zero di mezzo alcuni ➖ vanno persi: il totale è tra 0 e la somma dei soli ➕
+    assert 0.0 <= quantita <= 200.0
+    assert db.get_product_by_id(product_id)['quantita'] == quantita
+
+    # Solo ➖, più di quanti ne servano: esattamente zero, mai negativo
+    assert run([-1] * 8, int(quantita) // 8 + 5) == 0.0
+    assert db.get_product_by_id(product_id)['quantita'] == 0.0
+
+    assert run([+1] * 8, 25) == 200.0
+    assert db.get_product_by_id(product_id)['quantita'] == 200.0
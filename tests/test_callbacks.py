@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+import callbacks
+from benchmarks.load_test import Chat
+
+
+def all_routes():
+    """Tutte le Route registrate, visitando il trie"""
+    found, stack = [], [callbacks.router._root]
+    while stack:
+        node = stack.pop()
+        for char, child in node.items():
+            if char is None:
+                found.append(child)
+            else:
+                stack.append(child)
+    return found
+
+
+VALUES = [0, 1, -1, 63, 64, -64, 127, 128, 300, 2 ** 31 - 1, -2 ** 31, 2 ** 53, -2 ** 62]
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_varint_round_trip(value):
+    data = callbacks.MOVE_TO(value, -value)
+    assert callbacks.router.resolve(data) == (value, -value)
+    assert callbacks.router.resolve(data).route is callbacks.MOVE_TO
+
+
+def test_small_ids_stay_short():
+    assert callbacks.OPEN_PRODUCT(42) == "op.AVQ"
+    assert len(callbacks.ADJUST_STOCK(42, -1)) < len("mod_prod_42")  # Più corto del vecchio formato
+
+
+def test_every_route_fits_telegram_limit():
+    routes = all_routes()
+    assert len(routes) > 30
+    for route in routes:
+        # Id SQLite a 64 bit: il caso peggiore per ogni argomento
+        data = route(*[-2 ** 63] * len(route.fields)) if route.fields else route()
+        assert len(data.encode()) <= callbacks.MAX_DATA_BYTES, data
+        assert callbacks.router.resolve(data).route is route
+
+
+def test_oversized_payload_is_refused():
+    wide = callbacks.Route('zz', 'Wide', *[f"f{i}" for i in range(8)])
+    with pytest.raises(ValueError):
+        wide(*[2 ** 62] * 8)
+
+
+def test_duplicate_prefix_is_refused():
+    with pytest.raises(ValueError):
+        callbacks.router.add(callbacks.Route('op', 'Again', 'product_id'))
+
+
+@pytest.mark.parametrize("data", [
+    "mod_prod_42",  # Formato di prima del codec
+    "sconosciuto",
+    "main_menuX",  # Azione senza argomenti con qualcosa in più
+    "op",  # Prefisso senza payload
+    "op.",
+    "op.!!!",  # Non base64
+    "op." + callbacks.MOVE_TO(1, 2).split(".")[1],  # Numero di argomenti sbagliato
+    "op.AZQ",  # Varint troncato
+])
+def test_unknown_callbacks(data):
+    assert callbacks.router.resolve(data) is None
+
+
+def with_version(version, route, *args):
+    """callback_data come lo avrebbe scritto un'altra versione del codec"""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(callbacks, "VERSION", version)
+        return route(*args)
+
+
+def test_other_version_is_stale():
+    for version in (callbacks.VERSION - 1, callbacks.VERSION + 1):
+        assert callbacks.router.resolve(with_version(version, callbacks.OPEN_PRODUCT, 42)) is None
+    assert callbacks.router.resolve(callbacks.OPEN_PRODUCT(42)) == (42,)
+
+
+@pytest.mark.parametrize("data", ["mod_prod_42", "sconosciuto", "op.AZQ"])
+def test_stale_buttons_reach_stale_button(app, monkeypatch, data):
+    monkeypatch.setitem(callbacks.stats, 'stale_buttons', 0)
+    stale_version = with_version(callbacks.VERSION + 1, callbacks.OPEN_PRODUCT, 42)
+
+    async def scenario():
+        async with app:
+            chat = Chat(1, app.bot)
+            for payload in (data, stale_version):
+                await app.process_update(chat.callback(payload))
+
+    asyncio.run(scenario())
+    assert callbacks.stats['stale_buttons'] == 2
+    # Risposta alla query e ritorno al menu principale, nient'altro
+    assert app.bot.request.calls['answerCallbackQuery'] == 2
+    assert app.bot.request.calls['editMessageText'] >= 1
@@ -0,0 +1,113 @@
+import random
+
+import pytest
+
+import utils
+from utils import MAX_MESSAGE_LENGTH, iter_message_chunks, tg_len
+
+HEADER = "**🛒 LISTA**\n"
+
+
+def section(title, count, name="Pasta"):
+    return [f"\n📂 **{title}**\n"] + [f"🔴 **{name} {i}**: {i}\n" for i in range(count)]
+
+
+def body(chunk, header=HEADER):
+    assert chunk.startswith(header)
+    return chunk[len(header):]
+
+
+@pytest.mark.parametrize("text, units", [
+    ("Pasta", 5),
+    ("caffè", 5),  # Accento nel BMP: 1 unità
+    ("🔴", 2),  # Fuori dal BMP: coppia surrogata
+    ("👨‍👩‍👧", 8),  # Sequenza ZWJ: 3 emoji da 2 + 2 joiner
+    ("🇮🇹", 4),  # Bandiera: 2 indicatori regionali
+    ("⚠️", 2),  # Simbolo BMP + selettore di variante
+])
+def test_tg_len(text, units):
+    assert tg_len(text) == units
+
+
+def test_emoji_count_double():
+    # 1000 righe da 3 caratteri ma 4 unità UTF-16: contando i caratteri starebbero in 3 messaggi
+    lines = ["🍝🍝\n"] * 1000
+    chunks = list(iter_message_chunks(HEADER, [["\n"] + lines]))
+    assert all(tg_len(chunk) <= MAX_MESSAGE_LENGTH for chunk in chunks)
+    assert max(len(chunk) for chunk in chunks) < MAX_MESSAGE_LENGTH * 0.8
+    assert "".join(body(chunk)[1:] for chunk in chunks) == "".join(lines)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_no_chunk_over_limit(seed):
+    rng = random.Random(seed)
+    names = ["Pasta", "Caffè", "🍝 Spaghetti", "🇮🇹 Mozzarella", "👨‍👩‍👧 Merenda", "x" * 300]
+    sections = [section(f"Categoria {s} {'🥫' * rng.randint(0, 3)}", rng.randint(0, 200), rng.choice(names))
+                for s in range(30)]
+    chunks = list(iter_message_chunks(HEADER, sections))
+    assert len(chunks) > 1
+    assert all(tg_len(chunk) <= MAX_MESSAGE_LENGTH for chunk in chunks)
+    # Nessuna riga persa né duplicata (tolte le intestazioni ripetute)
+    lines = [line for chunk in chunks for line in body(chunk).splitlines(keepends=True)]
+    expected = [line for sec in sections for line in sec]
+    assert [line for line in lines if "🔴" in line] == [line for line in expected if "🔴" in line]
+
+
+def test_sections_are_not_split_when_they_fit():
+    sections = [section(f"C{s}", 40) for s in range(10)]
+    chunks = list(iter_message_chunks(HEADER, sections))
+    for chunk in chunks:
+        headers = body(chunk).count("📂")
+        # Ogni messaggio contiene sezioni intere: tante righe quante intestazioni × 40
+        assert body(chunk).count("🔴") == headers * 40
+
+
+def test_long_section_repeats_its_header():
+    long = section("Dispensa", 500)
+    chunks = list(iter_message_chunks(HEADER, [section("Frigo", 3, "Latte"), long, section("Bagno", 2, "Sapone")]))
+    assert len(chunks) >= 4
+    assert all(tg_len(chunk) <= MAX_MESSAGE_LENGTH for chunk in chunks)
+    assert all(chunk.startswith(HEADER) for chunk in chunks)
+    # Frigo esce da solo, poi ogni pezzo di Dispensa riparte dalla sua intestazione
+    assert "Frigo" in chunks[0] and "Dispensa" not in chunks[0]
+    dispensa = [chunk for chunk in chunks if "Dispensa" in chunk]
+    assert all(body(chunk).startswith(long[0]) for chunk in dispensa)
+    assert sum(body(chunk).count("Pasta") for chunk in dispensa) == 500
+    assert "Bagno" in chunks[-1]  # Le sezioni dopo riempiono l'ultimo pezzo
+
+
+def test_line_longer_than_message():
+    name = "🍝" * 3000 + "Pasta"  # 6005 unità: non starebbe in nessun messaggio
+    sections = [[f"\n📂 **Dispensa**\n", f"🔴 **{name}**: 1\n", "🔴 **Riso**: 2\n"]]
+    chunks = list(iter_message_chunks(HEADER, sections))
+    assert len(chunks) == 2
+    assert all(tg_len(chunk) <= MAX_MESSAGE_LENGTH for chunk in chunks)
+    assert "".join(body(chunk)[len(sections[0][0]):] for chunk in chunks) == "".join(sections[0][1:])
+
+
+@pytest.mark.parametrize("line, room", [("abcdef", 4), ("🍝🍝🍝", 4), ("🍝🍝🍝", 3), ("a🍝b🍝", 2), ("🍝", 1)])
+def test_cut_keeps_surrogate_pairs(line, room):
+    pieces = utils._cut(line, room)
+    assert "".join(pieces) == line
+    # Un'emoji da sola occupa 2 unità anche se room è 1: mai spezzata a metà
+    assert all(tg_len(piece) <= max(room, 2) for piece in pieces)
+    assert all(piece.encode('utf-16-le').decode('utf-16-le') == piece for piece in pieces)
+
+
+def test_small_limit_and_no_limit():
+    sections = [section(f"C{s}", 5) for s in range(20)]
+    small = list(iter_message_chunks(HEADER, sections, limit=200))
+    assert len(small) > 5 and all(tg_len(chunk) <= 200 for chunk in small)
+    single = list(iter_message_chunks(HEADER, sections, limit=None))
+    assert single == [HEADER + "".join(line for sec in sections for line in sec)]
+
+
+def test_shopping_list_chunks():
+    products = [{'nome': f"🥛 Latte {i}", 'quantita': 0.0} for i in range(600)]
+    chunks = list(utils.iter_shopping_list_chunks(products, products[:50], title="🛒 LISTA"))
+    assert len(chunks) > 1
+    assert all(tg_len(chunk) <= MAX_MESSAGE_LENGTH and chunk.startswith("**🛒 LISTA**\n") for chunk in chunks)
+    assert sum(chunk.count("🔴") for chunk in chunks) == 600
+    assert sum(chunk.count("🟡") for chunk in chunks) == 50
+    assert list(utils.iter_shopping_list_chunks([], [])) == [
+        "🛒 **LISTA DELLA SPESA**\n\n🎉 **Ottimo! Hai tutto quello che ti serve.**\nLa dispensa è piena."]
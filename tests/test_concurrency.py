@@ -0,0 +1,80 @@
+import asyncio
+import random
+from datetime import datetime, timezone
+
+import pytest
+from telegram import Chat, Message, Update
+
+from concurrency import PerChatUpdateProcessor
+
+
+def message_update(update_id, chat_id):
+    chat = Chat(chat_id, Chat.GROUP if chat_id < 0 else Chat.PRIVATE)
+    return Update(update_id, message=Message(update_id, datetime.now(timezone.utc), chat, text=str(update_id)))
+
+
+def run(processor, updates, handler):
+    """Consegna gli update come fa Application: un task per update, nell'ordine di arrivo"""
+    async def scenario():
+        await asyncio.gather(*(asyncio.create_task(processor.process_update(update, handler(update)))
+                               for update in updates))
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("limit", [1, 2, 8])
+def test_order_per_chat_with_interleaved_chats(limit):
+    rng = random.Random(limit)
+    updates = [message_update(i, 1 if i % 2 else -100) for i in range(40)]
+    events = []  # (evento, chat, update_id)
+
+    async def handler(update):
+        events.append(('start', update.effective_chat.id, update.update_id))
+        await asyncio.sleep(rng.uniform(0, 0.005))
+        events.append(('end', update.effective_chat.id, update.update_id))
+
+    processor = PerChatUpdateProcessor(limit)
+    run(processor, updates, handler)
+
+    for chat_id in (1, -100):
+        mine = [(kind, uid) for kind, cid, uid in events if cid == chat_id]
+        expected = [u.update_id for u in updates if u.effective_chat.id == chat_id]
+        # Uno alla volta, nell'ordine di arrivo: start/end alternati
+        assert mine == [(kind, uid) for uid in expected for kind in ('start', 'end')]
+
+    # Le due chat procedono in parallelo: a un certo punto sono entrambe a metà di un update
+    running, overlapped = set(), False
+    for kind, chat_id, _ in events:
+        (running.add if kind == 'start' else running.discard)(chat_id)
+        overlapped |= len(running) == 2
+    assert overlapped == (limit > 1)
+
+    assert processor.stats()['processed'] == 40
+    assert processor.stats()['busy_chats'] == 0
+
+
+def test_error_does_not_stop_chat_queue():
+    updates = [message_update(i, 7) for i in range(5)]
+    done = []
+
+    async def handler(update):
+        await asyncio.sleep(0)
+        if update.update_id == 1:
+            raise RuntimeError("boom")
+        done.append(update.update_id)
+
+    run(PerChatUpdateProcessor(2), updates, handler)
+    assert done == [0, 2, 3, 4]
+
+
+def test_updates_without_chat_are_not_queued():
+    processor = PerChatUpdateProcessor(4)
+    done = []
+
+    async def handler(update):
+        await asyncio.sleep(0.01 if update.update_id == 0 else 0)
+        done.append(update.update_id)
+
+    run(processor, [message_update(0, 5), Update(1), Update(2)], handler)
+    assert done == [1, 2, 0]
+    assert processor.counts['queued'] == 0
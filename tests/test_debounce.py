@@ -0,0 +1,60 @@
+import asyncio
+
+from debounce import TapDebouncer
+
+
+def test_flush_group_writes_before_next_update():
+    applied = []
+
+    async def apply(product_id, base, values, context):
+        applied.append((product_id, values['quantita'], context))
+
+    async def scenario():
+        taps = TapDebouncer(apply, window=60)
+        taps.tap(1, 'quantita', +1, 5, context='pannello 1', group='chat A')
+        taps.tap(1, 'quantita', +1, 5, context='pannello 1', group='chat A')
+        taps.tap(2, 'quantita', -1, 5, context='pannello 2', group='chat A')
+        taps.tap(3, 'quantita', +1, 0, context='pannello 3', group='chat B')
+
+        # Un altro tocco sul prodotto 2: la sua raffica continua, il prodotto 1 va scritto.
+        # Il pannello 1 è il messaggio dell'update in arrivo: niente ridisegno
+        await taps.flush_group('chat A', keep=2, redraw=lambda context: context != 'pannello 1')
+        assert applied == [(1, 7, None)]
+        assert taps.busy('chat A') and taps.busy('chat B')
+
+        await taps.flush_group('chat A')
+        assert applied[-1] == (2, 4, 'pannello 2')
+        assert not taps.busy('chat A')
+        assert taps.stats()['early_writes'] == 2
+
+        await taps.flush()
+        assert applied[-1] == (3, 1, 'pannello 3')
+
+    asyncio.run(scenario())
+
+
+def test_flush_group_waits_for_timer_writes():
+    release = None
+    done = []
+
+    async def apply(product_id, base, values, context):
+        await release.wait()
+        done.append(product_id)
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        taps = TapDebouncer(apply, window=0.01)
+        taps.tap(1, 'quantita', -1, 3, group='chat A')
+        await asyncio.sleep(0.05)  # La finestra è scaduta: la scrittura è partita ed è ferma
+        assert taps.busy('chat A') and not done
+
+        flushing = asyncio.create_task(taps.flush_group('chat A'))
+        await asyncio.sleep(0.01)
+        assert not flushing.done()
+        release.set()
+        await flushing
+        assert done == [1]
+        assert not taps.busy('chat A')
+
+    asyncio.run(scenario())
@@ -0,0 +1,100 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, NetworkError
+
+import edits
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    tracker = edits.EditTracker(max_messages=3)
+    monkeypatch.setattr(edits, "tracker", tracker)
+    return tracker
+
+
+class Query:
+    """Callback query di un messaggio: registra le modifiche, errors = eccezioni da sollevare alle prossime"""
+
+    def __init__(self, chat_id=1, message_id=10, inline_message_id=None):
+        self.inline_message_id = inline_message_id
+        self.message = SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=message_id)
+        self.calls = []
+        self.errors = []
+
+    async def edit_message_text(self, text, reply_markup=None, parse_mode=None):
+        self.calls.append(text)
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def edit(query, text, markup=None, parse_mode='Markdown'):
+    asyncio.run(edits.edit_message_text(query, text, reply_markup=markup, parse_mode=parse_mode))
+
+
+def keyboard(data):
+    return InlineKeyboardMarkup([[InlineKeyboardButton("➖", callback_data=data)]])
+
+
+def test_same_render_is_skipped(tracker):
+    query = Query()
+    edit(query, "Latte: 2", keyboard("a"))
+    edit(query, "Latte: 2", keyboard("a"))
+    assert query.calls == ["Latte: 2"]
+
+    # Cambia il testo, la tastiera o il parse_mode: la modifica parte
+    edit(query, "Latte: 1", keyboard("a"))
+    edit(query, "Latte: 1", keyboard("b"))
+    edit(query, "Latte: 1", keyboard("b"), parse_mode=None)
+    edit(query, "Latte: 1", keyboard("b"), parse_mode=None)
+    assert len(query.calls) == 4
+    assert tracker.stats() == {'edits': 4, 'skipped': 2, 'not_modified': 0, 'messages': 1}
+
+
+def test_messages_are_tracked_separately(tracker):
+    first, other_message, other_chat, inline = Query(), Query(message_id=11), Query(chat_id=2), Query(inline_message_id="abc")
+    for query in (first, other_message, other_chat, inline):
+        edit(query, "Menu")
+        edit(query, "Menu")
+        assert query.calls == ["Menu"]
+
+    # Solo gli ultimi max_messages: il primo è stato dimenticato
+    edit(first, "Menu")
+    assert first.calls == ["Menu", "Menu"]
+
+
+def test_unknown_message_is_never_skipped(tracker):
+    query = Query()
+    query.message = None
+    edit(query, "Menu")
+    edit(query, "Menu")
+    assert query.calls == ["Menu", "Menu"]
+    assert tracker.stats()['messages'] == 0
+
+
+def test_not_modified_is_remembered(tracker):
+    # Dopo un riavvio non sappiamo cosa mostra il messaggio: Telegram risponde "not modified"
+    query = Query()
+    query.errors = [BadRequest("Message is not modified: specified new message content and reply markup are "
+                               "exactly the same as a current content and reply markup of the message")]
+    edit(query, "Menu")
+    edit(query, "Menu")
+    assert query.calls == ["Menu"]
+    assert tracker.stats() == {'edits': 0, 'skipped': 1, 'not_modified': 1, 'messages': 1}
+
+
+@pytest.mark.parametrize("error", [BadRequest("Message can't be edited"), NetworkError("timeout")])
+def test_failed_edit_forgets_message(tracker, error):
+    query = Query()
+    edit(query, "Menu")
+    query.errors = [error]
+    with pytest.raises(type(error)):
+        edit(query, "Lista")
+    # Non sappiamo se il messaggio mostra "Menu" o "Lista": nessuna delle due modifiche va saltata
+    edit(query, "Menu")
+    edit(query, "Lista")
+    edit(query, "Lista")
+    assert query.calls == ["Menu", "Lista", "Menu", "Lista"]
+    assert tracker.stats()['edits'] == 3
@@ -0,0 +1,46 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError
+
+import main
+import network
+
+
+@pytest.fixture
+def exits(monkeypatch):
+    """Codici passati a os._exit (che qui non chiude il processo)"""
+    codes = []
+    monkeypatch.setattr(main.os, "_exit", codes.append)
+    return codes
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(network, "breaker", network.CircuitBreaker())
+    monkeypatch.setattr(network, "stats", network.Counter())
+    return network.breaker
+
+
+def handle(error):
+    asyncio.run(main.global_error_handler(None, SimpleNamespace(error=error)))
+
+
+@pytest.mark.parametrize("error", [BadRequest("Message is not modified"), Forbidden("bot was blocked by the user"),
+                                   ChatMigrated(-100123)])
+def test_api_errors_are_not_network_errors(breaker, exits, error):
+    for _ in range(breaker.failure_budget + 1):
+        handle(error)
+    assert breaker.consecutive_failures == 0
+    assert exits == []
+    assert network.stats['handler_api_errors'] == breaker.failure_budget + 1
+    assert network.stats['handler_network_errors'] == 0
+
+
+def test_os_errors_count_towards_budget(breaker, exits):
+    handle(NetworkError("connection reset"))  # Già contato da ResilientRequest
+    assert breaker.consecutive_failures == 0
+    for _ in range(breaker.failure_budget):
+        handle(OSError("connection reset"))
+    assert exits == [1]
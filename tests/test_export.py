@@ -0,0 +1,79 @@
+import asyncio
+import csv
+import io
+import json
+import tracemalloc
+from types import SimpleNamespace
+
+import pytest
+from telegram import InputFile
+
+import database
+from handlers import export
+
+PRODUCTS = 100_000
+MAX_PEAK_MB = 8.0  # Come benchmarks/bench_export.py: la memoria non deve crescere con l'inventario
+
+
+@pytest.fixture(scope="module")
+def big_pantry(tmp_path_factory):
+    # Riempire 100 000 righe costa: un solo database per tutti i formati
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(database, "DB_NAME", str(tmp_path_factory.mktemp("export") / "homestock.db"))
+        database.init_db()
+        _populate(database.get_connection())
+        yield database
+        database.close_connections()
+
+
+def _populate(conn):
+    with conn:
+        conn.executemany("INSERT INTO categorie (owner_id, nome) VALUES (1, ?)", [(f"Categoria {c}",) for c in range(50)])
+        conn.executemany('''
+            INSERT INTO prodotti (owner_id, categoria_id, nome, quantita, soglia_minima)
+            VALUES (1, ?, ?, ?, ?)
+        ''', ((1 + i % 50, f"Prodotto con un nome abbastanza lungo {i}", float(i % 13), float(i % 5))
+              for i in range(PRODUCTS)))
+
+
+@pytest.mark.parametrize("fmt", export.FORMATS)
+def test_export_peak_memory(big_pantry, fmt):
+    tracemalloc.start()
+    try:
+        out, count = database.export_products(1, fmt)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    with out:
+        size = out.seek(0, io.SEEK_END)
+        out.seek(0)
+        head = out.read(4096).decode()
+
+    assert count == PRODUCTS
+    assert peak / 2 ** 20 < MAX_PEAK_MB
+    assert size > 3 * peak  # Il file intero non è mai stato in memoria
+    if fmt == 'csv':
+        assert next(csv.reader(io.StringIO(head))) == list(database.EXPORT_COLUMNS)
+    else:
+        assert json.loads(head[head.index("{"):head.index("}") + 1])['categoria'] == "Categoria 0"
+
+
+def test_export_sends_file_handle(db):
+    db.import_products(1, [("Pasta", 3, 1, "Dispensa")])
+    sent = {}
+
+    async def reply_document(document, **kwargs):
+        sent['document'] = document
+        sent['content'] = document.input_file_content.read()  # Ancora aperto durante l'invio
+
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=1),
+                             message=SimpleNamespace(reply_document=reply_document))
+    asyncio.run(export.export_inventory(update, SimpleNamespace(args=['csv'])))
+
+    document = sent['document']
+    assert isinstance(document, InputFile)
+    assert document.filename.startswith("homestock_") and document.filename.endswith(".csv")
+    assert not isinstance(document.input_file_content, bytes)  # Il file non è stato letto in memoria
+    assert document.input_file_content.closed
+    assert b"Pasta" in sent['content']
@@ -0,0 +1,124 @@
+import math
+
+import pytest
+
+import database
+import forecast
+
+NOW = 2_460_000.0  # Un giorno giuliano qualsiasi
+
+
+def consumption(events):
+    """(recente, aggiornato) dopo una serie di cali (giorno, quantità), come li somma il trigger"""
+    recente, aggiornato = 0.0, events[0][0]
+    for day, amount in events:
+        recente = recente * float(forecast.decay(day - aggiornato)) + amount
+        aggiornato = day
+    return recente, aggiornato
+
+
+def days_left(quantita, events, dal, now):
+    recente, aggiornato = consumption(events)
+    return forecast.run_out_days([quantita], [recente], [aggiornato], [dal], now)[0]
+
+
+def test_follows_recent_usage():
+    # Cento giorni a 1 al giorno, poi una settimana a 3 al giorno
+    usual = [(NOW - 107 + d, 1.0) for d in range(100)]
+    recent = [(NOW - 7 + d, 3.0) for d in range(1, 8)]
+
+    before = days_left(30, usual, NOW - 107, NOW - 7)
+    after = days_left(30, usual + recent, NOW - 107, NOW)
+    assert before == pytest.approx(30, rel=0.1)
+    # La media di sempre direbbe ~26 giorni: conta l'ultima settimana
+    assert after < 20
+
+    # Gli stessi cento giorni, ma finiti un mese fa: il tasso si spegne e la previsione si allunga
+    idle = [(day - 30, amount) for day, amount in usual]
+    assert days_left(10, idle, NOW - 137, NOW) > 10 * days_left(10, usual, NOW - 107, NOW - 7)
+    assert math.isnan(days_left(30, idle, NOW - 137, NOW))  # Oltre MAX_DAYS: nessuna previsione
+
+
+def test_steady_rate_any_history_length():
+    for length in (5, 30, 300):
+        events = [(NOW - length + d, 2.0) for d in range(1, length + 1)]
+        assert days_left(40, events, NOW - length, NOW) == pytest.approx(20, rel=0.15)
+
+
+def test_trigger_keeps_recent_consumption(db):
+    db.import_products(1, [("Pasta", 10, 1, "Dispensa")])
+    prod_id = db.get_products(1)[0]['id']
+    conn = db.get_connection()
+    with conn:
+        conn.execute("UPDATE consumi SET recente = 4, aggiornato = julianday('now') - ?, dal = julianday('now') - 30",
+                     (forecast.TAU_DAYS,))
+
+    db.adjust_product(prod_id, quantity_delta=-2)
+    db.adjust_product(prod_id, quantity_delta=+5)  # Un rifornimento non è un consumo
+    row = conn.execute("SELECT consumato, recente, aggiornato FROM consumi WHERE product_id = ?", (prod_id,)).fetchone()
+    assert row['consumato'] == 2.0
+    assert row['recente'] == pytest.approx(4 / math.e + 2, rel=1e-3)
+    assert row['aggiornato'] == pytest.approx(forecast.julian_now(), abs=1e-3)
+
+
+def test_migration_starts_from_average(tmp_path, monkeypatch):
+    # Database fermo alla migrazione 7, con 60 consumati in 30 giorni
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "old.db"))
+    monkeypatch.setattr(database, "MIGRATIONS", database.MIGRATIONS[:7])
+    database.init_db()
+    database.import_products(1, [("Pasta", 10, 1, "Dispensa")])
+    conn = database.get_connection()
+    with conn:
+        conn.execute("UPDATE consumi SET consumato = 60, dal = julianday('now') - 30")
+
+    monkeypatch.undo()
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "old.db"))
+    database.migrate(conn)
+    try:
+        row = conn.execute(database.FORECAST_QUERY).fetchone()
+        # 2 al giorno: 10 bastano per 5 giorni
+        assert forecast.forecast([row])[row['product_id']] == pytest.approx(5, rel=1e-3)
+    finally:
+        database.close_connections()
+
+
+def rows(*products):
+    """Righe come quelle di FORECAST_QUERY: (quantita, recente, giorni da aggiornato, giorni da dal)"""
+    return [{'product_id': i, 'quantita': q, 'recente': r, 'aggiornato': NOW - agg, 'dal': NOW - dal}
+            for i, (q, r, agg, dal) in enumerate(products)]
+
+
+@pytest.mark.parametrize("product, expected", [
+    ((10, 0, 0, 30), None),  # Nessun consumo
+    ((10, 5, 0, forecast.MIN_DAYS - 0.5), None),  # Storico troppo breve
+    ((10, 5, 0, forecast.MIN_DAYS), 10 / (5 / float(forecast.window_days(forecast.MIN_DAYS)))),
+    ((1000, 0.1, 0, 300), None),  # Oltre MAX_DAYS
+    ((0, 0, 0, 30), 0.0),  # Già finito, anche senza consumi
+    ((0, 5, 0, 1), 0.0),  # Già finito, anche con storico breve
+])
+def test_forecast_limits(product, expected):
+    days = forecast.forecast(rows(product), now=NOW).get(0)
+    assert days == (pytest.approx(expected) if expected is not None else None)
+
+
+def test_forecast_vectorised():
+    days = forecast.forecast(rows((10, 0, 0, 30), (4, 2, 0, 1000), (0, 0, 0, 0)), now=NOW)
+    assert days == {1: pytest.approx(4 / (2 / forecast.TAU_DAYS)), 2: 0.0}
+    assert forecast.forecast([], now=NOW) == {}
+
+
+def test_by_urgency():
+    products = [{'id': 1}, {'id': 2}, {'id': 3}, {'id': 4}]
+    assert [p['id'] for p in forecast.by_urgency(products, {3: 1.5, 2: 8.0})] == [3, 2, 1, 4]
+
+
+@pytest.mark.parametrize("days, text", [
+    (None, None),
+    (0.0, None),
+    (0.4, "⏳ Finisce entro oggi"),
+    (1.2, "⏳ Finisce tra ~1 giorno"),
+    (1.6, "⏳ Finisce tra ~2 giorni"),
+    (30.0, "⏳ Finisce tra ~30 giorni"),
+])
+def test_describe(days, text):
+    assert forecast.describe(days) == text
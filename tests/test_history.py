@@ -0,0 +1,25 @@
+def history(db, product_id):
+    return [row['quantita'] for row in db.get_connection().execute(
+        "SELECT quantita FROM storico WHERE product_id = ? ORDER BY quando, id", (product_id,))]
+
+
+def test_history_is_trimmed(db):
+    db.import_products(1, [("Pasta", 5, 1, "Dispensa"), ("Riso", 2, 1, "Dispensa")])
+    pasta, riso = (p['id'] for p in sorted(db.get_products(1), key=lambda p: p['nome']))
+    conn = db.get_connection()
+    with conn:
+        # Righe di quattro mesi fa e di un mese fa
+        conn.executemany('''
+            INSERT INTO storico (product_id, owner_id, quando, quantita, variazione)
+            VALUES (?, 1, julianday('now') - ?, ?, 0)
+        ''', [(pasta, 120, 9.0), (pasta, 30, 7.0), (riso, 120, 9.0)])
+
+    db.adjust_product(pasta, quantity_delta=-1)
+    assert history(db, pasta) == [7.0, 5.0, 4.0]  # Solo la riga di 120 giorni fa se ne va
+    assert history(db, riso) == [9.0, 2.0]  # Si pulisce solo il prodotto modificato
+
+    db.adjust_product(pasta, quantity_delta=0)  # Quantità invariata: nessuna riga
+    assert len(history(db, pasta)) == 3
+
+    db.delete_product(riso)
+    assert history(db, riso) == []
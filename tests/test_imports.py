@@ -0,0 +1,112 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import repository
+from handlers import imports
+
+
+@pytest.mark.parametrize("line, fields", [
+    ("Latte, 2, 1, Frigo", ["Latte", " 2", " 1", " Frigo"]),
+    ("Pasta; 1,5; 1; Dispensa", ["Pasta", " 1,5", " 1", " Dispensa"]),  # Virgola decimale
+    ("Pasta;1,5", ["Pasta", "1,5"]),
+    ("Latte", ["Latte"]),
+])
+def test_split_line(line, fields):
+    assert imports._split_line(line) == fields
+
+
+@pytest.mark.parametrize("text, rows", [
+    # Delimitatori
+    ("Latte,2,1,Frigo\nPasta,3,1,Dispensa\n", [["Latte", "2", "1", "Frigo"], ["Pasta", "3", "1", "Dispensa"]]),
+    ("Latte;1,5;1;Frigo\nPasta;3;1;Dispensa\n", [["Latte", "1,5", "1", "Frigo"], ["Pasta", "3", "1", "Dispensa"]]),
+    ("Latte\t2\nPasta\t3\n", [["Latte", "2"], ["Pasta", "3"]]),
+    ('"Riso, integrale",2,1,Dispensa\nPasta,3,1,Dispensa\n',
+     [["Riso, integrale", "2", "1", "Dispensa"], ["Pasta", "3", "1", "Dispensa"]]),
+    # Intestazione sì / no
+    ("nome,quantita,soglia,categoria\nLatte,2,1,Frigo\n", [["Latte", "2", "1", "Frigo"]]),
+    ("nome;quantità\nLatte;1,5\n", [["Latte", "1,5"]]),
+    ("Latte,2\n", [["Latte", "2"]]),
+    ("Latte\n", [["Latte"]]),  # Una sola colonna: niente da annusare, resta (e poi sarà un errore)
+    # Righe vuote
+    ("Latte,2\n\n , \nPasta,3\n", [["Latte", "2"], ["Pasta", "3"]]),
+    ("", []),
+])
+def test_rows_from_csv(text, rows):
+    assert imports.rows_from_csv(text) == rows
+
+
+@pytest.mark.parametrize("text, rows", [
+    ('[{"nome": "Latte", "quantita": 2, "soglia": 1, "categoria": "Frigo"}]', [["Latte", 2, 1, "Frigo"]]),
+    ('[{"name": "Milk", "qty": 2}]', [["Milk", 2, None, None]]),  # Chiavi alternative
+    ('{"prodotti": [["Pasta", 3]]}', [["Pasta", 3]]),
+    ('{"products": [{"nome": "Pasta", "quantità": "1,5"}]}', [["Pasta", "1,5", None, None]]),
+    ('{"altro": 1}', []),
+])
+def test_rows_from_json(text, rows):
+    assert imports.rows_from_json(text) == rows
+
+
+# import_document risponde "Non riesco a leggere il file" per ValueError e TypeError
+@pytest.mark.parametrize("text", ['[{"nome": "Latte",', "", "nome,quantita", "null", "5", '[5]', '{"prodotti": 5}'])
+def test_malformed_json(text):
+    with pytest.raises((ValueError, TypeError)):
+        imports.rows_from_json(text)
+
+
+@pytest.mark.parametrize("fields, expected", [
+    (["Latte", "2"], ("Latte", 2.0, 1.0, None)),
+    (["Latte", "2", "", ""], ("Latte", 2.0, 1.0, None)),
+    ([" Pasta ", " 1,5 ", "0", " Dispensa "], ("Pasta", 1.5, 0.0, "Dispensa")),
+    (["Riso", 3, 1, "Dispensa"], ("Riso", 3.0, 1.0, "Dispensa")),  # Numeri già numeri (JSON)
+    (["Latte", "0"], ("Latte", 0.0, 1.0, None)),
+])
+def test_parse_row(fields, expected):
+    assert imports.parse_row(fields) == expected
+
+
+@pytest.mark.parametrize("fields, error", [
+    (["", "2"], "nome mancante"),
+    ([None, "2"], "nome mancante"),
+    (["Latte"], "quantità o minimo non validi"),
+    (["Latte", "-1"], "quantità o minimo non validi"),
+    (["Latte", "due"], "quantità o minimo non validi"),
+    (["Latte", "nan"], "quantità o minimo non validi"),
+    (["Latte", "inf"], "quantità o minimo non validi"),
+    (["Latte", "2", "-0.5"], "quantità o minimo non validi"),
+    (["Latte", "2", "uno"], "quantità o minimo non validi"),
+    (["Latte", None], "quantità o minimo non validi"),
+])
+def test_rejected_rows(fields, error):
+    with pytest.raises(ValueError, match=error):
+        imports.parse_row(fields)
+
+
+def test_parse_rows_numbers_errors():
+    items, errors = imports.parse_rows([["Latte", "2"], ["Pane", "-1"], ["Pasta", "3"], ["", "1"]])
+    assert [item[0] for item in items] == ["Latte", "Pasta"]
+    assert errors == [(2, "quantità o minimo non validi"), (4, "nome mancante")]
+
+
+@pytest.mark.parametrize("count, imported", [
+    (imports.MAX_IMPORT_ROWS, True),
+    (imports.MAX_IMPORT_ROWS + 1, False),
+])
+def test_max_import_rows(monkeypatch, count, imported):
+    calls, replies = [], []
+
+    async def import_products(owner_id, items):
+        calls.append(len(items))
+        return len(items), []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    monkeypatch.setattr(repository, "import_products", import_products)
+    update = SimpleNamespace(message=SimpleNamespace(reply_text=reply_text), effective_chat=SimpleNamespace(id=1))
+    asyncio.run(imports._import(update, [[f"Prodotto {i}", "1"] for i in range(count)]))
+
+    assert calls == ([count] if imported else [])
+    assert len(replies) == 1
+    assert ("Troppi prodotti" in replies[0]) != imported
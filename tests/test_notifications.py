@@ -0,0 +1,103 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import Forbidden, NetworkError
+
+import config
+from handlers import notifications
+
+
+class Bot:
+    """Registra i messaggi inviati; failures[chat_id] = eccezione da sollevare per quella chat"""
+
+    def __init__(self):
+        self.sent = []
+        self.failures = {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.failures:
+            raise self.failures[chat_id]
+        self.sent.append(chat_id)
+
+
+@pytest.fixture
+def digest(db, monkeypatch):
+    """digest() esegue un giro del job e restituisce le chat a cui ha scritto"""
+    monkeypatch.setattr(config, "DIGEST_SPACING", 0)
+    bot = Bot()
+
+    def run():
+        bot.sent.clear()
+        asyncio.run(notifications.send_low_stock_digest(SimpleNamespace(bot=bot)))
+        return sorted(bot.sent)
+
+    run.bot = bot
+    return run
+
+
+def product(db, owner_id, nome):
+    return next(p['id'] for p in db.get_products(owner_id) if p['nome'] == nome)
+
+
+def test_fingerprint_ignores_order_and_details():
+    latte = {'id': 1, 'stato': 'da_comprare', 'nome': "Latte", 'quantita': 0}
+    pasta = {'id': 2, 'stato': 'opzionale', 'nome': "Pasta", 'quantita': 1}
+    digest = notifications.fingerprint([latte], [pasta])
+    assert notifications.fingerprint([], [pasta, latte]) == digest
+    assert notifications.fingerprint([{**latte, 'quantita': 0.5}], [pasta]) == digest  # Solo id e stato
+    assert notifications.fingerprint([latte, {**pasta, 'stato': 'da_comprare'}], []) != digest
+    assert notifications.fingerprint([latte], []) != digest
+
+
+def test_unchanged_list_is_not_resent(db, digest):
+    db.import_products(1, [("Latte", 0, 1, "Frigo"), ("Pasta", 5, 1, None)])
+    db.import_products(2, [("Caffè", 0, 1, None)])
+    assert digest() == [1, 2]
+    assert digest() == []
+
+    # Quantità diversa ma stesso stato: per il riepilogo non è cambiato niente
+    db.update_product_quantity(product(db, 1, "Latte"), 0.5)
+    assert digest() == []
+
+
+def test_changed_list_is_sent_again(db, digest):
+    db.import_products(1, [("Latte", 0, 1, "Frigo"), ("Pasta", 5, 1, None)])
+    db.import_products(2, [("Caffè", 0, 1, None)])
+    assert digest() == [1, 2]
+
+    db.update_product_quantity(product(db, 1, "Pasta"), 0)  # Nuovo prodotto in lista
+    assert digest() == [1]
+    db.update_product_quantity(product(db, 1, "Pasta"), 1)  # Da comprare -> opzionale
+    assert digest() == [1]
+    db.delete_product(product(db, 1, "Pasta"))  # Esce dalla lista
+    assert digest() == [1]
+    assert digest() == []
+
+
+def test_cleared_list_resets_fingerprint(db, digest):
+    db.import_products(1, [("Latte", 0, 1, "Frigo")])
+    db.import_products(2, [("Caffè", 0, 1, None)])
+    assert digest() == [1, 2]
+
+    latte = product(db, 1, "Latte")
+    db.update_product_quantity(latte, 3)
+    assert digest() == []
+    assert set(db.get_digest_fingerprints()) == {2}
+
+    # Di nuovo la stessa lista di prima: è un nuovo avviso
+    db.update_product_quantity(latte, 0)
+    assert digest() == [1]
+    assert set(db.get_digest_fingerprints()) == {1, 2}
+
+
+def test_failed_send(db, digest):
+    db.import_products(1, [("Latte", 0, 1, "Frigo")])
+    db.import_products(2, [("Caffè", 0, 1, None)])
+    digest.bot.failures = {1: NetworkError("timeout"), 2: Forbidden("bot was blocked by the user")}
+    assert digest() == []
+    # Errore temporaneo: si riprova al prossimo giro. Bot bloccato: segnato come inviato
+    assert set(db.get_digest_fingerprints()) == {2}
+
+    digest.bot.failures = {}
+    assert digest() == [1]
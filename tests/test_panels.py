@@ -0,0 +1,48 @@
+import pytest
+
+import cache
+
+
+@pytest.fixture
+def queries(db, monkeypatch):
+    """SQL eseguito da SQLite durante il test"""
+    executed = []
+    execute = db.TimedConnection.execute
+
+    def record(self, sql, params=()):
+        executed.append(sql)
+        return execute(self, sql, params)
+
+    monkeypatch.setattr(db.TimedConnection, "execute", record)
+    return executed
+
+
+def test_product_panel_from_cache(db, queries):
+    db.import_products(1, [("Pasta", 3, 1, "Dispensa")])
+    prod_id = db.get_products(1)[0]['id']  # Inventario in cache
+    queries.clear()
+
+    panel = db.get_product_panel(prod_id)
+    assert panel['nome'] == "Pasta" and panel['nome_categoria'] == "Dispensa"
+    assert panel['giorni_rimasti'] is None  # Storico troppo breve
+    assert len(queries) == 1 and "FROM consumi" in queries[0]  # Solo la riga dei consumi
+
+    db.get_product_panel(prod_id)
+    assert len(queries) == 1  # Già in cache fino alla prossima modifica
+
+    db.adjust_product(prod_id, quantity_delta=-1)
+    queries.clear()
+    assert db.get_product_panel(prod_id)['quantita'] == 2.0
+    assert len(queries) == 1 and "FROM consumi" in queries[0]
+
+    db.delete_product(prod_id)
+    assert db.get_product_panel(prod_id) is None
+
+
+def test_product_panel_same_without_cache(db):
+    db.import_products(1, [("Pasta", 3, 1, "Dispensa")])
+    prod_id = db.get_products(1)[0]['id']
+    cached = db.get_product_panel(prod_id)
+
+    cache.inventory.clear()
+    assert db.get_product_panel(prod_id) == cached
@@ -0,0 +1,119 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import repository
+from persistence import SQLitePersistence
+
+
+def test_concurrent_updates_wait_for_user_data(monkeypatch):
+    loads = []
+
+    async def load_user_data(user_id):
+        loads.append(user_id)
+        await asyncio.sleep(0.05)
+        return {'new_prod': {'nome': "Pasta"}}
+
+    monkeypatch.setattr(repository, "load_user_data", load_user_data)
+
+    async def scenario():
+        persistence = SQLitePersistence()
+        user_data = {}
+        seen = []
+
+        async def update():
+            # Due update dello stesso utente da chat diverse, in parallelo
+            await persistence.refresh_user_data(7, user_data)
+            seen.append(dict(user_data))
+
+        await asyncio.gather(update(), update())
+        await persistence.refresh_user_data(7, user_data)
+        return seen
+
+    seen = asyncio.run(scenario())
+    assert seen == [{'new_prod': {'nome': "Pasta"}}] * 2
+    assert loads == [7]
+
+
+def test_failed_load_is_retried(monkeypatch):
+    results = [OSError("database is locked"), {'step': 2}]
+
+    async def load_chat_data(chat_id):
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(repository, "load_chat_data", load_chat_data)
+
+    async def scenario():
+        persistence = SQLitePersistence()
+        chat_data = {}
+        with pytest.raises(OSError):
+            await persistence.refresh_chat_data(-100, chat_data)
+        assert chat_data == {}
+        await persistence.refresh_chat_data(-100, chat_data)
+        return chat_data
+
+    assert asyncio.run(scenario()) == {'step': 2}
+    assert results == []
+
+
+def test_unencodable_entries_are_dropped(db, caplog):
+    circular = {}
+    circular['self'] = circular
+
+    async def scenario():
+        persistence = SQLitePersistence()
+        await persistence.update_user_data(1, {'new_prod': {'nome': "Pasta"}})
+        await persistence.update_user_data(2, {'file': object()})
+        await persistence.update_chat_data(-100, circular)
+        await persistence.update_chat_data(-200, {'flash_msg': "✅"})
+        await persistence.update_conversation('conv_prodotti', (1, 1), 13)
+        await persistence.update_conversation('conv_prodotti', (2, 2), object())
+        await persistence.flush()
+        return persistence
+
+    persistence = asyncio.run(scenario())
+    assert db.load_user_data(1) == {'new_prod': {'nome': "Pasta"}}
+    assert db.load_chat_data(-200) == {'flash_msg': "✅"}
+    assert db.load_conversations('conv_prodotti') == {(1, 1): 13}
+    assert db.load_user_data(2) == db.load_chat_data(-100) == {}
+    # Scartati, non rimessi in coda: riprovare non li renderebbe serializzabili
+    assert persistence._user_data == persistence._chat_data == persistence._conversations == {}
+    assert len([r for r in caplog.records if "non salvabile" in r.message]) == 3
+
+
+@pytest.mark.parametrize("error, requeued", [
+    (sqlite3.OperationalError("database is locked"), True),
+    (OSError("disk I/O error"), True),
+    (RuntimeError("bug"), False),
+])
+def test_only_io_errors_are_requeued(db, monkeypatch, error, requeued):
+    save = repository.save_bot_state
+    failures = [error]
+
+    async def flaky_save(*args):
+        if failures:
+            raise failures.pop()
+        return await save(*args)
+
+    monkeypatch.setattr(repository, "save_bot_state", flaky_save)
+
+    async def scenario():
+        persistence = SQLitePersistence()
+        await persistence.update_user_data(1, {'step': 1})
+        await persistence.update_user_data(2, {'step': 1})
+        await persistence.drop_chat_data(-100)
+        with pytest.raises(type(error)):
+            await persistence._write_task  # Il salvataggio che gli update_* hanno fatto partire
+        # Nel frattempo l'utente 2 è andato avanti: la versione in coda non deve coprirla
+        await persistence.update_user_data(2, {'step': 2})
+        await persistence.flush()
+
+    db.save_bot_state(chat_data={-100: {'old': True}})
+    asyncio.run(scenario())
+    assert db.load_user_data(1) == ({'step': 1} if requeued else {})
+    assert db.load_user_data(2) == {'step': 2}
+    assert db.load_chat_data(-100) == ({} if requeued else {'old': True})
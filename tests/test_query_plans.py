@@ -0,0 +1,88 @@
+"""
+Piani di esecuzione delle query più usate: devono cercare negli indici delle migrazioni, non
+scorrere le tabelle. Le query sono quelle eseguite davvero dalle funzioni di database.py
+(registrate durante la chiamata), con la cache vuota così che si arrivi a SQLite.
+"""
+import pytest
+
+import cache
+
+
+@pytest.fixture
+def pantry(db):
+    for owner_id in (1, 2):
+        db.import_products(owner_id, [(f"Prodotto {i}", i % 3, 1.0, f"Categoria {i % 4}") for i in range(40)]
+                           + [("Senza categoria", 0, 1.0, None)])
+    cache.inventory.clear()
+    return db
+
+
+def executed(db, monkeypatch, call):
+    """(sql, parametri) di ogni query eseguita da call()"""
+    queries = []
+    execute = db.TimedConnection.execute
+
+    def record(self, sql, params=()):
+        queries.append((sql, params))
+        return execute(self, sql, params)
+
+    monkeypatch.setattr(db.TimedConnection, "execute", record)
+    call()
+    monkeypatch.setattr(db.TimedConnection, "execute", execute)
+    assert queries
+    return queries
+
+
+def plans(db, queries):
+    return [detail for sql, params in queries for detail in db.explain(sql, params)]
+
+
+def assert_search(details, index):
+    assert any(d.startswith("SEARCH") and index in d for d in details), details
+    # Nessuna tabella letta per intero (la SCAN delle sole righe di un indice resta ammessa)
+    assert not [d for d in details if d.startswith("SCAN") and "INDEX" not in d], details
+
+
+def category_of(db, owner_id):
+    return db.get_connection().execute(
+        "SELECT id FROM categorie WHERE owner_id = ? ORDER BY nome LIMIT 1", (owner_id,)).fetchone()['id']
+
+
+def test_category_product_list(pantry, monkeypatch):
+    cat_id = category_of(pantry, 1)
+    queries = executed(pantry, monkeypatch, lambda: pantry.get_products_page(1, cat_id))
+    assert_search(plans(pantry, queries), "idx_prodotti_owner_cat_nome")
+
+    queries = executed(pantry, monkeypatch, lambda: pantry.get_products_page(1, None))
+    assert_search(plans(pantry, queries), "idx_prodotti_owner_cat_nome")
+
+
+def test_inventory_load(pantry, monkeypatch):
+    queries = executed(pantry, monkeypatch, lambda: pantry.get_products(1))
+    assert_search(plans(pantry, queries), "idx_prodotti_owner_")  # Uno qualsiasi dei due che iniziano con owner_id
+
+
+@pytest.mark.parametrize("direction", ["after_id", "before_id"])
+def test_keyset_pages(pantry, monkeypatch, direction):
+    cat_id = category_of(pantry, 1)
+    first, _, _ = pantry.get_products_page(1, cat_id, limit=3)
+    anchor = {direction: first[-1]['id']}
+
+    queries = executed(pantry, monkeypatch, lambda: pantry.get_products_page(1, cat_id, limit=3, **anchor))
+    details = plans(pantry, queries)
+    assert_search(details, "idx_prodotti_owner_cat_nome")
+    assert any("nome>?" in d or "nome<?" in d for d in details), details  # Riparte dall'ancora nell'indice
+    assert not any("TEMP B-TREE" in d for d in details), details  # L'ordine lo dà già l'indice
+
+    category = {direction: cat_id}
+    queries = executed(pantry, monkeypatch, lambda: pantry.get_categories_page(1, limit=2, **category))
+    details = plans(pantry, queries)
+    assert_search(details, "sqlite_autoindex_categorie_1")
+    assert not any("TEMP B-TREE" in d for d in details), details
+
+
+def test_shopping_list(pantry, monkeypatch):
+    queries = executed(pantry, monkeypatch, lambda: pantry.get_shopping_list(1))
+    details = plans(pantry, queries)
+    assert_search(details, "idx_lista_spesa_owner")
+    assert not any("prodotti" in d and "owner_id" in d for d in details), details  # Mai l'inventario intero
@@ -0,0 +1,115 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from telegram.error import RetryAfter
+
+import ratelimit
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Orologio finto per i secchi: si sposta a mano con clock.now += secondi"""
+    class Clock:
+        now = 1000.0
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: Clock.now)
+    return Clock
+
+
+def test_burst_then_rate(clock):
+    bucket = ratelimit.TokenBucket(rate=2, burst=5)
+    for _ in range(5):
+        assert bucket.wait_time() == 0
+        bucket.take()
+    assert bucket.wait_time() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.wait_time() == 0
+    bucket.take()
+
+    clock.now += 60  # Da fermo non accumula oltre il burst
+    assert bucket.idle
+    assert bucket.tokens == 5
+
+
+def test_pause_blocks_bucket(clock):
+    bucket = ratelimit.TokenBucket(rate=1, burst=5)
+    bucket.blocked_until = clock.now + 3
+    assert bucket.wait_time() == pytest.approx(3)
+    assert not bucket.idle
+    clock.now += 3
+    assert bucket.wait_time() == 0
+
+
+def test_chat_buckets_are_separate():
+    limiter = ratelimit.RateLimiter()
+    group, private = limiter._chat_gate(-100), limiter._chat_gate(7)
+    assert (group.bucket.rate, group.bucket.burst) == (ratelimit.GROUP_RATE, ratelimit.GROUP_BURST)
+    assert (private.bucket.rate, private.bucket.burst) == (ratelimit.PRIVATE_RATE, ratelimit.PRIVATE_BURST)
+    assert limiter._chat_gate(7) is private
+    assert limiter._chat_gate(8) is not private
+
+    # Le modifiche hanno un secchio loro, in gruppo come in privato
+    for chat_id, gate in ((-100, group), (7, private)):
+        edits = limiter._chat_gate(chat_id, edit=True)
+        assert edits is not gate
+        assert (edits.bucket.rate, edits.bucket.burst) == (ratelimit.EDIT_RATE, ratelimit.EDIT_BURST)
+
+
+def run(limiter, endpoint, chat_id, times, callback=None):
+    """Chiama process_request `times` volte per la stessa chat e restituisce i secondi impiegati"""
+    async def ok():
+        return True
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for _ in range(times):
+            assert await limiter.process_request(callback or ok, (), {}, endpoint, {'chat_id': chat_id}, None)
+        return loop.time() - started
+
+    return asyncio.run(scenario())
+
+
+def test_edits_do_not_use_message_bucket():
+    limiter = ratelimit.RateLimiter()
+    # Tutto il burst dei messaggi di una chat privata, poi le modifiche passano lo stesso subito
+    assert run(limiter, 'sendMessage', 7, ratelimit.PRIVATE_BURST) < 0.1
+    assert run(limiter, 'editMessageText', 7, ratelimit.EDIT_BURST) < 0.1
+    assert run(limiter, 'answerCallbackQuery', 7, 10) < 0.1  # Solo il secchio globale
+    # Il sesto messaggio invece aspetta il suo gettone
+    assert run(limiter, 'sendMessage', 7, 1) > 0.5
+
+
+# retry_after come float è deprecato in PTB 22, il limitatore gestisce entrambi i tipi
+@pytest.mark.filterwarnings("ignore::telegram.warnings.PTBDeprecationWarning")
+def test_retry_after_pauses_chat_and_retries_once():
+    limiter = ratelimit.RateLimiter()
+    attempts = []
+
+    async def flood_once():
+        attempts.append(asyncio.get_running_loop().time())
+        if len(attempts) == 1:
+            raise RetryAfter(timedelta(seconds=0.2))
+        return True
+
+    run(limiter, 'sendMessage', 7, 1, flood_once)
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.2
+    assert limiter.stats()['retry_after'] == 1
+    assert limiter.stats()['retry_after_gave_up'] == 0
+
+
+@pytest.mark.filterwarnings("ignore::telegram.warnings.PTBDeprecationWarning")
+def test_retry_after_gives_up():
+    limiter = ratelimit.RateLimiter(max_retries=1)
+    attempts = []
+
+    async def flood():
+        attempts.append(1)
+        raise RetryAfter(timedelta(seconds=0.01))
+
+    with pytest.raises(RetryAfter):
+        run(limiter, 'sendMessage', 7, 1, flood)
+    assert len(attempts) == 2
+    assert limiter.stats()['retry_after_gave_up'] == 1
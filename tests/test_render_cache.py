@@ -0,0 +1,55 @@
+import asyncio
+
+import cache
+import database
+import forecast
+from handlers import products
+
+
+def test_forecast_views_expire_each_day(db, monkeypatch):
+    day = [100]
+    monkeypatch.setattr(forecast, "today", lambda: day[0])
+    monkeypatch.setattr(cache, "rendered", cache.RenderCache())
+    builds = []
+
+    async def builder(owner_id):
+        builds.append(owner_id)
+        return f"render {len(builds)}", None
+
+    async def render(daily):
+        return await products.cached_view(1, 'daily' if daily else 'plain', builder, daily=daily)
+
+    async def scenario():
+        first = await render(daily=True), await render(daily=False)
+        assert (await render(daily=True), await render(daily=False)) == first
+        assert len(builds) == 2
+
+        day[0] += 1  # Stessi dati, giorno dopo: cambia solo la vista ordinata per previsione
+        await render(daily=True)
+        await render(daily=False)
+        assert len(builds) == 3
+
+    asyncio.run(scenario())
+
+
+def test_shopping_order_recomputed_each_day(db, monkeypatch):
+    day = [100]
+    monkeypatch.setattr(forecast, "today", lambda: day[0])
+    db.import_products(1, [("Pasta", 0, 1, "Dispensa")])
+    db.get_products(1)  # Inventario in cache
+
+    calls = []
+    shopping_forecast = database._shopping_forecast
+
+    def counted(owner_id=None):
+        calls.append(owner_id)
+        return shopping_forecast(owner_id)
+
+    monkeypatch.setattr(database, "_shopping_forecast", counted)
+
+    db.get_shopping_list(1)
+    db.get_shopping_list(1)
+    assert calls == [1]
+    day[0] += 1
+    db.get_shopping_list(1)
+    assert calls == [1, 1]
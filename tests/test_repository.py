@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+import database
+import repository
+
+SLOW_READ = 1.0  # Secondi di una lettura lenta simulata
+
+
+def test_slow_read_does_not_block_other_chats(db, monkeypatch):
+    db.import_products(1, [("Pasta", 3, 1, "Dispensa")])
+    db.import_products(2, [("Latte", 1, 2, "Frigo")])
+
+    inventory = database._inventory
+
+    def slow_inventory(owner_id):
+        if owner_id == 1:
+            time.sleep(SLOW_READ)  # Query lenta: tiene occupato un thread lettore
+        return inventory(owner_id)
+
+    monkeypatch.setattr(database, "_inventory", slow_inventory)
+
+    async def scenario():
+        slow = asyncio.create_task(repository.get_products(1))
+        await asyncio.sleep(0.05)  # La lettura lenta è già partita
+
+        started = time.perf_counter()
+        products = await repository.get_products(2)
+        elapsed = time.perf_counter() - started
+
+        # Nel frattempo anche l'event loop resta libero
+        loop_started = time.perf_counter()
+        await asyncio.sleep(0)
+        loop_elapsed = time.perf_counter() - loop_started
+
+        assert not slow.done()
+        assert [p['nome'] for p in await slow] == ["Pasta"]
+        return products, elapsed, loop_elapsed
+
+    products, elapsed, loop_elapsed = asyncio.run(scenario())
+    assert [p['nome'] for p in products] == ["Latte"]
+    assert elapsed < SLOW_READ / 4
+    assert loop_elapsed < SLOW_READ / 4
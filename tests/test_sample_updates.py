@@ -0,0 +1,52 @@
+import asyncio
+import json
+import os
+
+from telegram import Update
+
+import callbacks
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "sample_updates.json")
+
+
+def test_sample_updates_reach_handlers(app, db, monkeypatch):
+    """Gli update di scripts/sample_updates.json (quelli di replay_updates.py) passano per gli handler veri"""
+    with open(SAMPLE, encoding='utf-8') as f:
+        samples = json.load(f)
+    chat_id = samples[0]['message']['chat']['id']
+    db.import_products(chat_id, [("Latte", 0, 1, "Frigo"), ("Pasta", 5, 1, "Dispensa")])
+    monkeypatch.setitem(callbacks.stats, 'stale_buttons', 0)
+
+    # Le chiamate al bot, con i parametri
+    stub = app.bot.request
+    sent = []
+    do_request = stub.do_request
+
+    async def recording(url, method, request_data=None, **kwargs):
+        sent.append((url.rsplit('/', 1)[-1], request_data.parameters if request_data else {}))
+        return await do_request(url, method, request_data, **kwargs)
+
+    monkeypatch.setattr(stub, "do_request", recording)
+
+    async def scenario():
+        async with app:
+            for data in samples:
+                await app.process_update(Update.de_json(data, app.bot))
+
+    asyncio.run(scenario())
+    calls = [(endpoint, params) for endpoint, params in sent if endpoint != 'getMe']
+    assert [endpoint for endpoint, _ in calls] == ['sendMessage', 'answerCallbackQuery', 'editMessageText']
+
+    # /start: il benvenuto con il menu principale
+    _, welcome = calls[0]
+    assert welcome['chat_id'] == chat_id
+    assert welcome['text'].startswith("Ciao Test! 👋")
+    assert 'inline_keyboard' in json.dumps(welcome['reply_markup'])
+
+    # show_shopping_list: risposta alla query e lista della spesa nello stesso messaggio
+    _, answer = calls[1]
+    assert answer['callback_query_id'] == samples[1]['callback_query']['id']
+    _, shopping = calls[2]
+    assert (shopping['chat_id'], shopping['message_id']) == (chat_id, samples[1]['callback_query']['message']['message_id'])
+    assert "Latte" in shopping['text'] and "Pasta" not in shopping['text']
+    assert callbacks.stats['stale_buttons'] == 0
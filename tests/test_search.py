@@ -0,0 +1,111 @@
+import pytest
+
+import database
+
+
+def names(rows):
+    return sorted(row['nome'] for row in rows)
+
+
+@pytest.fixture
+def pantry(db):
+    """Chat privata 1 e gruppo -100 con prodotti dai nomi simili"""
+    db.import_products(1, [("Latte intero", 2, 1, "Frigo"), ("Latte di soia", 1, 1, "Frigo"),
+                           ("Pasta", 3, 1, "Dispensa"), ("Caffè", 1, 1, None)])
+    db.import_products(-100, [("Latte", 5, 1, "Frigo"), ("Pasta fresca", 1, 1, "Frigo")])
+    return db
+
+
+def ids(db, owner_id):
+    return {p['nome']: p['id'] for p in db.get_products(owner_id)}
+
+
+def test_prefix_and_all_words(pantry):
+    assert names(pantry.search_products(1, "lat")) == ["Latte di soia", "Latte intero"]
+    assert names(pantry.search_products(1, "lat soi")) == ["Latte di soia"]
+    assert names(pantry.search_products(1, "frigo")) == ["Latte di soia", "Latte intero"]  # Nome della categoria
+    assert names(pantry.search_products(1, "caffe")) == ["Caffè"]  # Senza accenti
+    assert pantry.search_products(1, "lat pasta") == []
+
+
+def test_owner_scoping(pantry):
+    assert names(pantry.search_products(1, "pasta")) == ["Pasta"]
+    assert names(pantry.search_products(-100, "pasta")) == ["Pasta fresca"]
+    assert names(pantry.search_products(-100, "latte")) == ["Latte"]
+    assert pantry.search_products(2, "latte") == []
+    # Il token del gruppo non coincide con quello della chat 100
+    pantry.import_products(100, [("Latte", 1, 1, None)])
+    assert [p['owner_id'] for p in pantry.search_products(100, "latte")] == [100]
+    assert [p['owner_id'] for p in pantry.search_products(-100, "latte")] == [-100]
+
+
+@pytest.mark.parametrize("text", [
+    '"', 'latte"', '"latte', 'lat*', '*', 'latte OR pasta', 'latte AND', 'NOT latte', 'NEAR(latte pasta)',
+    'latte -soia', '^latte', 'nome:latte', '{nome}: latte', '(latte', 'latte)', "l'atte", 'chat : "chatm100"',
+    'chatm100', 'chat1 OR chatm100', '"" OR ""',
+])
+def test_operators_are_plain_text(pantry, text):
+    """Qualsiasi cosa scriva l'utente è testo da cercare: niente errori FTS5, niente prodotti di altre chat"""
+    found = pantry.search_products(1, text)
+    assert all(p['owner_id'] == 1 for p in found)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('"latte"', ["Latte di soia", "Latte intero"]),
+    ('latte*', ["Latte di soia", "Latte intero"]),
+    ('latte OR pasta', []),  # OR è una parola da cercare, non un operatore
+    ('NOT latte', []),
+    ('latte-soia', []),  # "lattesoia" non esiste
+    ('nome:latte', []),
+])
+def test_operators_match_as_words(pantry, text, expected):
+    assert names(pantry.search_products(1, text)) == expected
+
+
+@pytest.mark.parametrize("text", ["", "   ", '"*"', "-:^()"])
+def test_nothing_to_search(text):
+    assert database._fts_query(1, text) is None
+
+
+def test_fts_query_format():
+    assert database._fts_query(-5, 'lat "fre"') == 'chat : "chatm5" AND {nome categoria} : ("lat"* "fre"*)'
+
+
+def test_insert_trigger(pantry):
+    pantry.add_product(1, None, "Biscotti", 2, 1)
+    assert names(pantry.search_products(1, "bisc")) == ["Biscotti"]
+
+
+def test_rename_triggers(pantry):
+    conn = pantry.get_connection()
+    pasta = ids(pantry, 1)["Pasta"]
+    with conn:
+        conn.execute("UPDATE prodotti SET nome = 'Riso' WHERE id = ?", (pasta,))
+    assert pantry.search_products(1, "pasta") == []
+    assert names(pantry.search_products(1, "riso")) == ["Riso"]
+
+    # Rinominare la categoria aggiorna i suoi prodotti
+    frigo = next(c['id'] for c in pantry.get_categories(1) if c['nome'] == "Frigo")
+    assert pantry.update_category_name(frigo, "Frigorifero")
+    assert names(pantry.search_products(1, "frigorifero")) == ["Latte di soia", "Latte intero"]
+    assert names(pantry.search_products(-100, "frigorifero")) == []
+
+    # Spostare un prodotto cambia la categoria nell'indice
+    dispensa = next(c['id'] for c in pantry.get_categories(1) if c['nome'] == "Dispensa")
+    pantry.update_product_category(ids(pantry, 1)["Caffè"], dispensa)
+    assert names(pantry.search_products(1, "dispensa")) == ["Caffè", "Riso"]
+
+
+def test_delete_triggers(pantry):
+    pantry.delete_product(ids(pantry, 1)["Latte intero"])
+    assert names(pantry.search_products(1, "latte")) == ["Latte di soia"]
+
+    # Categoria eliminata: i prodotti restano, senza categoria
+    frigo = next(c['id'] for c in pantry.get_categories(1) if c['nome'] == "Frigo")
+    pantry.delete_category(frigo)
+    assert pantry.search_products(1, "frigo") == []
+    assert names(pantry.search_products(1, "latte")) == ["Latte di soia"]
+
+    conn = pantry.get_connection()
+    indexed = conn.execute("SELECT count(*) FROM prodotti_fts").fetchone()[0]
+    assert indexed == conn.execute("SELECT count(*) FROM prodotti").fetchone()[0]
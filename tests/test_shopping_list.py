@@ -0,0 +1,31 @@
+import cache
+import database
+
+
+def test_forecast_query_outside_cache_lock(db, monkeypatch):
+    db.import_products(1, [("Pasta", 0, 1, "Dispensa"), ("Latte", 2, 2, "Frigo"), ("Riso", 5, 1, "Dispensa")])
+    db.get_products(1)  # Inventario in cache
+
+    calls = []
+    shopping_forecast = database._shopping_forecast
+
+    def checked(owner_id=None):
+        # Una query con il lock preso bloccherebbe le letture in cache di tutte le chat
+        assert not cache.inventory._lock._is_owned()
+        calls.append(owner_id)
+        return shopping_forecast(owner_id)
+
+    monkeypatch.setattr(database, "_shopping_forecast", checked)
+
+    da_comprare, opzionali = db.get_shopping_list(1)
+    assert [p['nome'] for p in da_comprare] == ["Pasta"]
+    assert [p['nome'] for p in opzionali] == ["Latte"]
+
+    # Lista già calcolata: nessuna query finché l'inventario non cambia
+    assert db.get_shopping_list(1) == (da_comprare, opzionali)
+    assert calls == [1]
+
+    db.adjust_product(da_comprare[0]['id'], quantity_delta=+5)
+    da_comprare, _ = db.get_shopping_list(1)
+    assert da_comprare == []
+    assert calls == [1, 1]
@@ -1,5 +1,9 @@
+import itertools
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+import callbacks
+
 
 # --- KEYBOARD GENERATORS ---
 
@@ -42,13 +46,56 @@ def create_smart_grid(buttons, back_button_data=None, cols=None):
     return InlineKeyboardMarkup(keyboard)
 
 
+def create_paginated_grid(buttons, page_action, page, back_button_data=None, cols=None):
+    """
+    Come create_smart_grid, con in più la riga di navigazione "◀ ▶" sopra il tasto indietro.
+    - page: tupla (righe, c'è_una_pagina_prima, c'è_una_pagina_dopo) come quelle di database.get_*_page
+    - page_action: Route di navigazione (vedi callbacks), chiamata con (forward, anchor_id):
+      "◀" riceve (False, primo_id), "▶" riceve (True, ultimo_id)
+    """
+    rows, has_prev, has_next = page
+    markup = create_smart_grid(buttons, back_button_data, cols)
+
+    nav = []
+    if has_prev and rows:
+        nav.append(InlineKeyboardButton("◀", callback_data=page_action(False, rows[0]['id'])))
+    if has_next and rows:
+        nav.append(InlineKeyboardButton("▶", callback_data=page_action(True, rows[-1]['id'])))
+    if not nav:
+        return markup
+
+    keyboard = [list(row) for row in markup.inline_keyboard]
+    # La navigazione va prima del tasto indietro (che è sempre l'ultima riga)
+    position = len(keyboard) - 1 if back_button_data else len(keyboard)
+    keyboard.insert(position, nav)
+    return InlineKeyboardMarkup(keyboard)
+
+
+def page_bounds(context):
+    """
+    Legge l'azione di navigazione (creata da create_paginated_grid) che ha attivato l'handler.
+    Restituisce (after_id, before_id); (None, None) se non è una navigazione (prima pagina).
+    """
+    action = getattr(context, 'action', None)
+    if action is None or 'anchor_id' not in action._fields:
+        return None, None
+    return (action.anchor_id, None) if action.forward else (None, action.anchor_id)
+
+
+def category_button_text(cat):
+    """Etichetta con i conteggi (vedi database.get_category_overview), es. 📂 Cucina (12 · 🛒3)"""
+    if cat['n_bassi']:
+        return f"📂 {cat['nome']} ({cat['n_prodotti']} · 🛒{cat['n_bassi']})"
+    return f"📂 {cat['nome']} ({cat['n_prodotti']})"
+
+
 def get_main_menu_keyboard():
     # Definiamo i bottoni del menu principale
     buttons = [
-        InlineKeyboardButton("🛒 Gestisci Prodotti", callback_data='menu_prodotti'),
-        InlineKeyboardButton("📂 Gestisci Categorie", callback_data='menu_categorie'),
-        InlineKeyboardButton("🚨 Genera Lista Spesa", callback_data='show_shopping_list'),
-        InlineKeyboardButton("📋 Inventario Completo", callback_data='show_full_inventory')
+        InlineKeyboardButton("🛒 Gestisci Prodotti", callback_data=callbacks.MENU_PRODUCTS()),
+        InlineKeyboardButton("📂 Gestisci Categorie", callback_data=callbacks.MENU_CATEGORIES()),
+        InlineKeyboardButton("🚨 Genera Lista Spesa", callback_data=callbacks.SHOPPING_LIST()),
+        InlineKeyboardButton("📋 Inventario Completo", callback_data=callbacks.FULL_INVENTORY())
     ]
     # Smart grid automatica
     return create_smart_grid(buttons)
@@ -56,75 +103,77 @@ def get_main_menu_keyboard():
 
 # --- FORMATTING ---
 
-def format_inventory_message(products, title="📋 Elenco Prodotti", shopping_list_mode=False):
+# Limite di Telegram per un singolo messaggio (in unità UTF-16, le emoji contano 2)
+MAX_MESSAGE_LENGTH = 4096
+
+
+def tg_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def fmt_num(value):
+    # Rimuove .0 se è intero
+    return f"{int(value)}" if value.is_integer() else f"{value}"
+
+
+def iter_message_chunks(header, sections, limit=MAX_MESSAGE_LENGTH):
     """
-    Formatta la lista dei prodotti.
-    shopping_list_mode=True: Separa 'Da Comprare' (Rosso) da 'Opzionali' (Giallo).
-    shopping_list_mode=False: Mostra tutto raggruppato per categoria con icone R/G/V.
+    Impacchetta le sezioni in messaggi che rispettano il limite di Telegram.
+    - header: prima riga di ogni messaggio (il titolo).
+    - sections: iterabile di liste di righe; la prima riga è l'intestazione della sezione.
+    Si va a capo sui confini di sezione; una sezione troppo lunga viene spezzata tra le righe
+    ripetendo la sua intestazione (e una riga che da sola non ci starebbe, spezzata dove capita).
+    Con limit=None esce un unico messaggio.
+    I testi sono costruiti con join (niente concatenazioni ripetute).
     """
-    if not products:
-        if shopping_list_mode:
-            return f"{title}\n\n🎉 **Ottimo! Hai tutto quello che ti serve.**\nLa dispensa è piena."
-        else:
-            return f"{title}\n\n📦 **Nessun prodotto trovato.**\nInizia ad aggiungere qualcosa!"
-
-    text = f"**{title}**\n"
-
-    # --- LOGICA LISTA DELLA SPESA (SEPARATA) ---
-    if shopping_list_mode:
-        red_list = []  # Quantità < Soglia
-        yellow_list = []  # Quantità == Soglia
-
-        for p in products:
-            if p['quantita'] < p['soglia_minima']:
-                red_list.append(p)
-            elif p['quantita'] == p['soglia_minima']:
-                yellow_list.append(p)
-
-        # 1. Sezione DA COMPRARE (Rossi)
-        if red_list:
-            text += "\n🔥 **DA COMPRARE**\n"
-            grouped_red = {}
-            for p in red_list:
-                cat = p['nome_categoria'] if p['nome_categoria'] else "Altro"
-                if cat not in grouped_red: grouped_red[cat] = []
-                grouped_red[cat].append(p)
-
-            for category, items in grouped_red.items():
-                for item in items:
-                    # Rimuove .0 se è intero
-                    qty_str = f"{int(item['quantita'])}" if item['quantita'].is_integer() else f"{item['quantita']}"
-                    # FORMATO: "🔴 Nome: Quantità"
-                    text += f"🔴 **{item['nome']}**: {qty_str}\n"
-
-        # 2. Sezione OPZIONALI (Gialli)
-        if yellow_list:
-            text += "\n⚠️ **OPZIONALI (In esaurimento)**\n"
-            grouped_yellow = {}
-            for p in yellow_list:
-                cat = p['nome_categoria'] if p['nome_categoria'] else "Altro"
-                if cat not in grouped_yellow: grouped_yellow[cat] = []
-                grouped_yellow[cat].append(p)
-
-            for category, items in grouped_yellow.items():
-                for item in items:
-                    # Rimuove .0 se è intero
-                    qty_str = f"{int(item['quantita'])}" if item['quantita'].is_integer() else f"{item['quantita']}"
-                    # FORMATO: "🟡 Nome: Quantità"
-                    text += f"🟡 **{item['nome']}**: {qty_str}\n"
-
-        return text
-
-    # --- LOGICA INVENTARIO COMPLETO (STANDARD) ---
-    grouped = {}
-    for p in products:
-        cat = p['nome_categoria'] if p['nome_categoria'] else "Senza Categoria"
-        if cat not in grouped:
-            grouped[cat] = []
-        grouped[cat].append(p)
-
-    for category, items in grouped.items():
-        text += f"\n📂 **{category}**\n"
+    parts, size = [header], tg_len(header)
+
+    for section in sections:
+        section_size = sum(tg_len(line) for line in section)
+        if limit is None or size + section_size <= limit:
+            parts.extend(section)
+            size += section_size
+            continue
+
+        # Non ci sta: chiudiamo il messaggio corrente (se contiene qualcosa oltre al titolo)
+        if len(parts) > 1:
+            yield "".join(parts)
+            parts, size = [header], tg_len(header)
+
+        section_header, lines = section[0], section[1:]
+        parts.append(section_header)
+        size += tg_len(section_header)
+        room = limit - tg_len(header) - tg_len(section_header)
+        for line in lines:
+            for piece in (_cut(line, room) if tg_len(line) > room else (line,)):
+                piece_size = tg_len(piece)
+                if size + piece_size > limit and len(parts) > 2:
+                    yield "".join(parts)
+                    parts, size = [header, section_header], tg_len(header) + tg_len(section_header)
+                parts.append(piece)
+                size += piece_size
+
+    yield "".join(parts)
+
+
+def _cut(line, room):
+    """Spezza una riga in pezzi da al massimo `room` unità UTF-16 (le emoji fuori dal BMP ne valgono 2)"""
+    pieces, current, size = [], [], 0
+    for char in line:
+        char_size = 2 if ord(char) > 0xFFFF else 1
+        if size + char_size > room and current:
+            pieces.append("".join(current))
+            current, size = [], 0
+        current.append(char)
+        size += char_size
+    pieces.append("".join(current))
+    return pieces
+
+
+def _inventory_sections(products):
+    # I prodotti arrivano ordinati per categoria: basta raggrupparli in sequenza
+    for category, items in itertools.groupby(products, key=lambda p: p['nome_categoria'] or "Senza Categoria"):
+        lines = [f"\n📂 **{category}**\n"]
         for item in items:
             qty = item['quantita']
             soglia = item['soglia_minima']
@@ -137,10 +186,33 @@ def format_inventory_message(products, title="📋 Elenco Prodotti", shopping_li
             else:
                 icon = "🟢"  # Ok
 
-            qty_str = f"{int(qty)}" if qty.is_integer() else f"{qty}"
-            soglia_str = f"{int(soglia)}" if soglia.is_integer() else f"{soglia}"
-
             # FORMATO INVENTARIO: "🔴 Nome: Quantità (Min: Soglia)"
-            text += f"{icon} **{item['nome']}**: {qty_str} (Min: {soglia_str})\n"
+            lines.append(f"{icon} **{item['nome']}**: {fmt_num(qty)} (Min: {fmt_num(soglia)})\n")
+        yield lines
+
 
-    return text
\ No newline at end of file
+def iter_inventory_chunks(products, title="📋 Elenco Prodotti", limit=MAX_MESSAGE_LENGTH):
+    """Inventario completo, raggruppato per categoria, diviso in messaggi da massimo `limit` caratteri"""
+    if not products:
+        yield f"{title}\n\n📦 **Nessun prodotto trovato.**\nInizia ad aggiungere qualcosa!"
+        return
+    yield from iter_message_chunks(f"**{title}**\n", _inventory_sections(products), limit)
+
+
+def _shopping_sections(da_comprare, opzionali):
+    # 1. Sezione DA COMPRARE (Rossi) - FORMATO: "🔴 Nome: Quantità"
+    if da_comprare:
+        yield ["\n🔥 **DA COMPRARE**\n"] + [f"🔴 **{item['nome']}**: {fmt_num(item['quantita'])}\n"
+                                           for item in da_comprare]
+    # 2. Sezione OPZIONALI (Gialli) - FORMATO: "🟡 Nome: Quantità"
+    if opzionali:
+        yield ["\n⚠️ **OPZIONALI (In esaurimento)**\n"] + [f"🟡 **{item['nome']}**: {fmt_num(item['quantita'])}\n"
+                                                          for item in opzionali]
+
+
+def iter_shopping_list_chunks(da_comprare, opzionali, title="🛒 **LISTA DELLA SPESA**", limit=MAX_MESSAGE_LENGTH):
+    """Lista della spesa già divisa (vedi database.get_shopping_list), in messaggi da massimo `limit` caratteri"""
+    if not da_comprare and not opzionali:
+        yield f"{title}\n\n🎉 **Ottimo! Hai tutto quello che ti serve.**\nLa dispensa è piena."
+        return
+    yield from iter_message_chunks(f"**{title}**\n", _shopping_sections(da_comprare, opzionali), limit)